@@ -0,0 +1,127 @@
+from argparse import ArgumentParser, Namespace
+from difflib import SequenceMatcher
+from pathlib import Path
+import time
+
+from extract_text_from_speech import (
+    add_transcription_arguments,
+    extract_text_from_features,
+    load_audio,
+    load_stt_model,
+    set_torch_threads,
+)
+
+
+def main(args):
+    # Both models run with the same threads, which are set once per process
+    set_torch_threads(args)
+
+    # The baseline is the float32 eager model on CPU, the candidate is configured by the transcription options
+    baseline_args = Namespace(**{
+        **vars(args),
+        "cpu_profile": False,
+        "torch_compile": False,
+    })
+
+    file_paths = [Path(file_path) for file_path in args.audio_files]
+
+    print("Baseline: float32")
+    baseline_texts = transcribe_samples(baseline_args, file_paths, device="cpu")
+
+    print("Candidate: " + compose_profile_name(args))
+    candidate_texts = transcribe_samples(args, file_paths, device="cpu")
+
+    total_words = 0
+    total_errors = 0
+
+    for file_path, baseline_text, candidate_text in zip(file_paths, baseline_texts, candidate_texts):
+        errors, differences = compare_words(baseline_text.split(), candidate_text.split())
+        total_words += len(baseline_text.split())
+        total_errors += errors
+
+        if differences:
+            print(f"{file_path.name}: {errors} word errors")
+            for difference in differences:
+                print(f"  {difference}")
+
+    print(f"Word error rate against the baseline: {total_errors / max(total_words, 1):.2%} ({total_errors}/{total_words})")
+
+
+def transcribe_samples(args, file_paths: list[Path], device: str) -> list[str]:
+    import torch
+
+    started_at = time.perf_counter()
+    model, processor, _ = load_stt_model(args)
+    model = model.to(device)
+    print(f"Model load: {time.perf_counter() - started_at:.1f} s")
+
+    sampling_rate = processor.feature_extractor.sampling_rate
+    texts = []
+    audio_duration = 0.
+    inference_duration = 0.
+
+    # Every run gets the same samples in the same order, one file at a time, so only the model differs
+    for file_path in file_paths:
+        data = load_audio(file_path, sampling_rate)
+        audio_duration += len(data) / sampling_rate
+
+        inputs = processor(
+            data,
+            return_tensors="pt",
+            truncation=False,
+            return_attention_mask=True,
+            sampling_rate=sampling_rate,
+        )
+        inputs = inputs.to(device, torch.float32)
+
+        started_at = time.perf_counter()
+        texts.append(extract_text_from_features(model, processor, inputs))
+        inference_duration += time.perf_counter() - started_at
+
+    print(f"Audio: {audio_duration:.1f} s, inference: {inference_duration:.1f} s,"
+          f" real-time factor: {inference_duration / audio_duration:.3f}")
+
+    return texts
+
+
+def compare_words(baseline_words: list[str], candidate_words: list[str]) -> tuple[int, list[str]]:
+    errors = 0
+    differences = []
+
+    matcher = SequenceMatcher(a=baseline_words, b=candidate_words, autojunk=False)
+    for tag, a_start, a_end, b_start, b_end in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+
+        errors += max(a_end - a_start, b_end - b_start)
+        differences.append(f"{' '.join(baseline_words[a_start:a_end])!r} -> {' '.join(candidate_words[b_start:b_end])!r}")
+
+    return errors, differences
+
+
+def compose_profile_name(args) -> str:
+    parts = ["int8" if args.cpu_profile else "float32"]
+    if args.torch_compile:
+        parts.append("compiled")
+    if args.torch_threads:
+        parts.append(f"{args.torch_threads} threads")
+    if args.torch_interop_threads:
+        parts.append(f"{args.torch_interop_threads} inter-op threads")
+
+    return ", ".join(parts)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description="Compare speed and transcripts of a CPU inference profile against the float32 model."
+    )
+    add_transcription_arguments(parser)
+    parser.add_argument(
+        "audio_files",
+        nargs="+",
+        help="fixed set of sample audio files (like ../data/samples/*.oga)",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
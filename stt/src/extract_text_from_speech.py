@@ -1,66 +1,453 @@
-from argparse import ArgumentParser
-from contextlib import contextmanager
+from argparse import ArgumentParser, BooleanOptionalAction
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
 from pathlib import Path
 import subprocess
-from tempfile import NamedTemporaryFile
+from tempfile import TemporaryDirectory
+import time
+import traceback
+from typing import Iterable, Iterator
 
 import librosa
+import numpy as np
+
+from manifest import ManifestRegistry, compose_file_info, compute_file_hash, is_same_file
+from vad import split_audio_at_silence
+
+FFMPEG_READ_CHUNK_SIZE = 1024 * 1024
+# Telegram voice messages, broken ones can be repaired by fix_opus_file
+OPUS_FILE_SUFFIXES = {".oga", ".ogg", ".opus"}
 
 
 def main(args):
-    model, processor = prepare_stt_model(args.model_size)
+    warn_if_opus_repair_unavailable()
+    set_torch_threads(args)
+    model, processor, device = load_stt_model(args)
+
+    writer = TranscriptWriter(compose_model_name(args))
+    files = select_files_to_transcribe([Path(file_path) for file_path in args.audio_files], writer)
+
+    with create_decode_executor(args) as executor:
+        transcribe_files(model, processor, device, iter_audio_features(executor, files, args), writer, args)
+
+    print("Done")
+
+
+class TranscriptWriter:
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.manifests = ManifestRegistry()
+
+    def save(self, file_path: Path, text: str, stats: dict, inference_time: float) -> None:
+        transcript_mtime_ns = save_transcript(file_path, text)
+
+        self.manifests.get(file_path.parent).add({
+            "file": file_path.name,
+            "sha256": stats["sha256"],
+            "size": stats["size"],
+            "mtime_ns": stats["mtime_ns"],
+            "duration": round(stats["duration"], 3),
+            "model": self.model_name,
+            "decode_time": round(stats["decode_time"], 3),
+            "inference_time": round(inference_time, 3),
+            "transcript": text,
+            "transcript_mtime_ns": transcript_mtime_ns,
+        })
+
 
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    model = model.to(device)
-    print(f"Prepared: model_size={args.model_size} {device=}")
+def select_files_to_transcribe(file_paths: list[Path], writer: TranscriptWriter) -> list[tuple[Path, dict]]:
+    files = []
 
-    for file_path in args.audio_files:
-        file_path = Path(file_path)
-        output_file_name = file_path.with_suffix(".txt")
+    for file_path in file_paths:
+        manifest = writer.manifests.get(file_path.parent)
 
-        if output_file_name.exists():
+        # A file with the size and mtime of its record is unchanged, so it isn't hashed again
+        if manifest.is_transcribed(file_path, writer.model_name):
             continue
 
+        try:
+            file_info = compose_file_info(file_path)
+            file_info["sha256"] = compute_file_hash(file_path)
+        except OSError:
+            report_failed_file(file_path)
+            continue
+
+        record = manifest.find(file_info["sha256"], writer.model_name)
+
+        if record is None:
+            files.append((file_path, file_info,))
+        elif record["file"] != file_path.name:
+            # The same audio is already transcribed under another name, e.g. a forwarded voice message
+            print(f"Copying the transcript of {record['file']} to {file_path.name}")
+            transcript_mtime_ns = save_transcript(file_path, record["transcript"])
+            manifest.add({
+                **record,
+                **file_info,
+                "file": file_path.name,
+                "copied_from": record["file"],
+                "transcript_mtime_ns": transcript_mtime_ns,
+            })
+        elif not is_same_file(record, file_info):
+            # Records made before the stats were kept, or of a file touched since, get the actual stats
+            manifest.add({**record, **file_info})
+
+    return files
+
+
+def compose_model_name(args) -> str:
+    # Quantized models give slightly different transcripts, so they are distinguished in the manifest
+    return f"whisper-{args.model_size}" + ("-int8" if args.cpu_profile else "")
+
+
+def set_torch_threads(args) -> None:
+    # Called once per process before any model work, as torch refuses to change inter-op threads after it started them
+    import torch
+
+    if args.torch_threads:
+        torch.set_num_threads(args.torch_threads)
+    if args.torch_interop_threads:
+        torch.set_num_interop_threads(args.torch_interop_threads)
+
+
+def load_stt_model(args) -> tuple:
+    import torch
+
+    if args.cpu_profile:
+        model, processor = prepare_cpu_stt_model(args.model_size, args.model_cache_dir)
+        device = "cpu"
+    else:
+        model, processor = prepare_stt_model(args.model_size)
+
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        model = model.to(device)
+
+    if args.torch_compile:
+        model.forward = torch.compile(model.forward)
+
+    print(f"Prepared: model_size={args.model_size} {device=} cpu_profile={args.cpu_profile} threads={torch.get_num_threads()}")
+
+    return model, processor, device
+
+
+def transcribe_files(
+        model,
+        processor,
+        device: str,
+        audio_features: Iterable[tuple[Path, dict, dict]],
+        writer: TranscriptWriter,
+        args,
+) -> None:
+    batch = []
+
+    # A failed file is reported and left without a transcript, the others go on
+    for file_path, features, stats in audio_features:
         print(f"Processing {file_path.name}...")
+
+        if args.split_long_audio and len(features["input_features"]) != 1:
+            try:
+                transcribe_chunks(model, processor, device, (file_path, features, stats,), writer, args.batch_size)
+            except Exception:
+                report_failed_file(file_path)
+
+            continue
+
+        # Clips up to 30 seconds fit into one window of the model, so they are padded to the same length
+        if args.batch_size > 1 and features["input_features"].shape[-1] <= processor.feature_extractor.nb_max_frames:
+            batch.append((file_path, features, stats,))
+
+            if len(batch) >= args.batch_size:
+                transcribe_batch_by_files(model, processor, device, batch, writer)
+                batch = []
+
+            continue
+
         try:
-            data, samplerate = librosa.load(
-                str(file_path),
-                sr=processor.feature_extractor.sampling_rate,
-            )
-        except ValueError as e:
-            if "array is too big" not in str(e):
-                raise
-
-            print("Cannot read the file! Trying to convert it to WAV by ffmpeg...")
-            with convert_to_temporary_wav_file(
-                    str(file_path),
-                    processor.feature_extractor.sampling_rate
-            ) as temp_file_path:
-                data, samplerate = librosa.load(
-                    str(temp_file_path),
-                    sr=processor.feature_extractor.sampling_rate,
-                )
-
-        inputs = processor(
-            data,
-            return_tensors="pt",
-            truncation=False,
-            # padding="longest",
-            return_attention_mask=True,
-            sampling_rate=samplerate,
-        )
-        inputs = inputs.to(device, torch.float32)
-
-        text = extract_text_from_features(model, processor, inputs)
-        print(f"{text=}")
-
-        with open(output_file_name, "w") as fp:
-            fp.writelines(f"{text}\n")
+            transcribe_file(model, processor, device, (file_path, features, stats,), writer)
+        except Exception:
+            report_failed_file(file_path)
 
-    print("Done")
+    if batch:
+        transcribe_batch_by_files(model, processor, device, batch, writer)
+
+
+def transcribe_file(
+        model,
+        processor,
+        device: str,
+        audio_features: tuple[Path, dict, dict],
+        writer: TranscriptWriter,
+) -> None:
+    file_path, features, stats = audio_features
+
+    started_at = time.perf_counter()
+    inputs = stack_features([features], device)
+
+    text = extract_text_from_features(model, processor, inputs)
+    print(f"{text=}")
+
+    writer.save(file_path, text, stats, time.perf_counter() - started_at)
+
+
+def transcribe_batch_by_files(
+        model,
+        processor,
+        device: str,
+        batch: list[tuple[Path, dict, dict]],
+        writer: TranscriptWriter,
+) -> None:
+    try:
+        transcribe_batch(model, processor, device, batch, writer)
+        return
+    except Exception:
+        if len(batch) == 1:
+            report_failed_file(batch[0][0])
+            return
+
+        traceback.print_exc()
+
+    # One broken file fails the whole batch, so its files are transcribed one by one to leave only that file behind
+    print(f"The batch failed, transcribing its {len(batch)} files one by one...")
+    for audio_features in batch:
+        try:
+            transcribe_file(model, processor, device, audio_features, writer)
+        except Exception:
+            report_failed_file(audio_features[0])
+
+
+def report_failed_file(file_path: Path) -> None:
+    print(f"Cannot transcribe {file_path.name}!")
+    traceback.print_exc()
+
+
+def create_decode_executor(args) -> ProcessPoolExecutor:
+    # Workers are spawned, so they don't inherit the model and the CUDA state of this process
+    return ProcessPoolExecutor(
+        args.decode_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=(args.model_size,),
+    )
+
+
+def iter_audio_features(
+        executor: ProcessPoolExecutor,
+        files: Iterable[tuple[Path, dict]],
+        args,
+) -> Iterator[tuple[Path, dict, dict]]:
+    # Files are decoded ahead while the model is busy, the number of pending files bounds the memory
+    max_pending = args.batch_size + args.decode_workers * 2
+    pending = deque()
+
+    for file_path, file_info in files:
+        future = executor.submit(prepare_audio_features, file_path, args.decoder, args.split_long_audio)
+        pending.append((file_path, file_info, future,))
+
+        if len(pending) >= max_pending:
+            yield from take_audio_features(pending.popleft())
+
+    while pending:
+        yield from take_audio_features(pending.popleft())
+
+
+def take_audio_features(pending_file: tuple) -> Iterator[tuple[Path, dict, dict]]:
+    file_path, file_info, future = pending_file
+
+    try:
+        features, stats = future.result()
+    except Exception:
+        # A file that cannot be decoded is skipped, so it doesn't stop the files after it
+        report_failed_file(file_path)
+        return
+
+    yield file_path, features, {**stats, **file_info}
+
+
+worker_feature_extractor = None
+
+
+def init_worker(model_size: str) -> None:
+    from transformers import WhisperFeatureExtractor
+
+    global worker_feature_extractor
+    worker_feature_extractor = WhisperFeatureExtractor.from_pretrained(f"openai/whisper-{model_size}")
+
+
+def prepare_audio_features(file_path: Path, decoder: str, split_long_audio: bool) -> tuple[dict, dict]:
+    feature_extractor = worker_feature_extractor
+
+    started_at = time.perf_counter()
+    data = load_audio(file_path, feature_extractor.sampling_rate, decoder)
+    duration = len(data) / feature_extractor.sampling_rate
+
+    if split_long_audio:
+        # Every chunk fits into one window of the model, the features of chunks are a batch
+        chunks = split_audio_at_silence(data, feature_extractor.sampling_rate, feature_extractor.n_samples)
+        if not chunks:
+            features = {
+                "input_features": np.zeros((0, feature_extractor.feature_size, feature_extractor.nb_max_frames)),
+                "attention_mask": np.zeros((0, feature_extractor.nb_max_frames), dtype=np.int32),
+            }
+
+            return features, {"duration": duration, "decode_time": time.perf_counter() - started_at}
+
+        data = chunks if len(chunks) > 1 else chunks[0]
+
+    # Short clips are padded to 30 seconds, long ones are kept whole for the long-form generation
+    features = feature_extractor(
+        data,
+        return_tensors="np",
+        truncation=False,
+        # padding="longest",
+        return_attention_mask=True,
+        sampling_rate=feature_extractor.sampling_rate,
+    )
+
+    features = {"input_features": features["input_features"], "attention_mask": features["attention_mask"]}
+
+    return features, {"duration": duration, "decode_time": time.perf_counter() - started_at}
+
+
+def load_audio(file_path: Path, sampling_rate: int, decoder: str = "librosa") -> np.ndarray:
+    try:
+        return decode_audio(file_path, sampling_rate, decoder)
+    except Exception as e:
+        if file_path.suffix not in OPUS_FILE_SUFFIXES:
+            raise
+
+        try:
+            from fix_opus_file import recode_opus_file
+        except ImportError:
+            print(f"Cannot decode {file_path.name}, and pyogg to recode it isn't installed")
+            raise e
+
+        print(f"Cannot decode {file_path.name} ({e})! Trying to recode it by pyogg...")
+        with TemporaryDirectory() as temp_dir:
+            recoded_file_path = Path(temp_dir) / f"{file_path.stem}.opus"
+            recode_opus_file(str(file_path), str(recoded_file_path))
+
+            return decode_audio(recoded_file_path, sampling_rate, decoder)
+
+
+def warn_if_opus_repair_unavailable() -> None:
+    # pyogg isn't in the Pipfile: its PyPI release lacks the encoder, the Dockerfile has a commented block for it
+    try:
+        import fix_opus_file
+    except ImportError as e:
+        print(f"Warning: broken Opus files won't be repaired, pyogg isn't available ({e})")
+
+
+def decode_audio(file_path: Path, sampling_rate: int, decoder: str) -> np.ndarray:
+    if decoder == "ffmpeg":
+        return decode_audio_by_ffmpeg(file_path, sampling_rate)
+
+    try:
+        data, _ = librosa.load(str(file_path), sr=sampling_rate)
+    except ValueError as e:
+        if "array is too big" not in str(e):
+            raise
+
+        print(f"Cannot read {file_path.name}! Trying to decode it by ffmpeg...")
+        data = decode_audio_by_ffmpeg(file_path, sampling_rate)
+
+    return data
+
+
+def decode_audio_by_ffmpeg(file_path: Path, sampling_rate: int) -> np.ndarray:
+    # ffmpeg resamples and downmixes the audio, raw float32 samples are read from its stdout
+    cmd = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-loglevel", "error",
+        "-i", str(file_path),
+        "-ac", "1", "-ar", str(sampling_rate), "-f", "f32le",
+        "-",
+    ]
+
+    # The samples are collected in one growing buffer and viewed as an array without a copy,
+    # so the peak memory stays about the size of the decoded audio
+    buffer = bytearray()
+    # ffmpeg reads commands from stdin otherwise, taking the input of the terminal or of the service
+    with subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE) as process:
+        while chunk := process.stdout.read(FFMPEG_READ_CHUNK_SIZE):
+            buffer += chunk
+
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with return code {process.returncode}")
+
+    return np.frombuffer(buffer, dtype=np.float32)
+
+
+def transcribe_batch(
+        model,
+        processor,
+        device: str,
+        batch: list[tuple[Path, dict, dict]],
+        writer: TranscriptWriter,
+) -> None:
+    print(f"Transcribing a batch of {len(batch)} files...")
+    started_at = time.perf_counter()
+
+    # Every clip is padded to 30 seconds, the attention mask marks the padding
+    inputs = stack_features([features for _, features, _ in batch], device)
+
+    texts = extract_texts_from_features(model, processor, inputs)
+
+    # Files of a batch share its inference time equally
+    inference_time = (time.perf_counter() - started_at) / len(batch)
+
+    for (file_path, _, stats), text in zip(batch, texts):
+        print(f"{file_path.name}: {text=}")
+        writer.save(file_path, text, stats, inference_time)
+
+
+def transcribe_chunks(
+        model,
+        processor,
+        device: str,
+        audio_features: tuple[Path, dict, dict],
+        writer: TranscriptWriter,
+        batch_size: int,
+) -> None:
+    file_path, features, stats = audio_features
+
+    chunk_count = len(features["input_features"])
+    print(f"Transcribing {chunk_count} chunks of speech...")
+    started_at = time.perf_counter()
+
+    texts = []
+    for start in range(0, chunk_count, batch_size):
+        inputs = stack_features([{key: value[start:start + batch_size] for key, value in features.items()}], device)
+        texts.extend(extract_texts_from_features(model, processor, inputs))
+
+    text = " ".join(text for text in texts if text)
+    print(f"{text=}")
+
+    writer.save(file_path, text, stats, time.perf_counter() - started_at)
+
+
+def stack_features(features: list[dict], device: str) -> dict:
+    import torch
+
+    input_features = np.concatenate([item["input_features"] for item in features])
+    attention_mask = np.concatenate([item["attention_mask"] for item in features])
+
+    return {
+        "input_features": torch.from_numpy(input_features).to(device, torch.float32),
+        "attention_mask": torch.from_numpy(attention_mask).to(device),
+    }
+
+
+def save_transcript(file_path: Path, text: str) -> int:
+    # Returns the mtime of the written file, a later mtime means the transcript was edited by hand
+    with open(file_path.with_suffix(".txt"), "w") as fp:
+        fp.writelines(f"{text}\n")
+
+    return os.stat(file_path.with_suffix(".txt")).st_mtime_ns
 
 
 def prepare_stt_model(model_size: str) -> tuple:
+    from transformers import WhisperForConditionalGeneration, WhisperProcessor
+
     processor = WhisperProcessor.from_pretrained(f"openai/whisper-{model_size}")
     model = WhisperForConditionalGeneration.from_pretrained(f"openai/whisper-{model_size}")
     model.config.forced_decoder_ids = None
@@ -68,42 +455,120 @@ def prepare_stt_model(model_size: str) -> tuple:
     return model, processor
 
 
+def prepare_cpu_stt_model(model_size: str, model_cache_dir: str | None) -> tuple:
+    import torch
+    import transformers
+    from transformers import WhisperProcessor
+
+    # The pickled model depends on the library versions, so they are a part of the file name
+    cache_path = None
+    if model_cache_dir:
+        cache_name = f"whisper-{model_size}-int8-torch-{torch.__version__}-transformers-{transformers.__version__}.pt"
+        cache_path = Path(model_cache_dir) / cache_name
+
+    if cache_path is not None and cache_path.exists():
+        print(f"Loading the prepared model from {cache_path}...")
+        processor = WhisperProcessor.from_pretrained(f"openai/whisper-{model_size}")
+        model = torch.load(cache_path, weights_only=False)
+
+        return model, processor
+
+    model, processor = prepare_stt_model(model_size)
+
+    # Linear layers take most of the inference time on CPU, their weights are kept in int8
+    # and activations are quantized on the fly
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if cache_path is not None:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+
+        temp_path = cache_path.with_name(f"{cache_path.name}.tmp")
+        torch.save(model, temp_path)
+        os.replace(temp_path, cache_path)
+
+    return model, processor
+
+
 def extract_text_from_features(model, processor, inputs: dict) -> str:
+    transcription = extract_texts_from_features(model, processor, inputs)
+
+    return " ".join(transcription).strip()
+
+
+def extract_texts_from_features(model, processor, inputs: dict) -> list[str]:
     # generate token ids
     predicted_ids = model.generate(
         **inputs,
         return_timestamps=True,
     )
-    # decode token ids to text
+    # decode token ids to text, one item per input of the batch
     transcription = processor.batch_decode(predicted_ids, skip_special_tokens=True)
 
-    return " ".join(transcription).strip()
-
-
-@contextmanager
-def convert_to_temporary_wav_file(input_audio_file: str, sampling_rate: int):
-    temp_file = NamedTemporaryFile(suffix=".wav").name
-
-    try:
-        cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", input_audio_file, "-ar", str(sampling_rate), "-y", temp_file]
-        return_code = subprocess.call(cmd)
-
-        if return_code != 0:
-            raise RuntimeError(f"ffmpeg failed with return code {return_code}")
-
-        yield temp_file
-    finally:
-        import os
-        os.remove(temp_file)
+    return [text.strip() for text in transcription]
 
 
-if __name__ == "__main__":
-    parser = ArgumentParser(description="Transcribe audio files to text by the Whisper Model.")
+def add_transcription_arguments(parser: ArgumentParser) -> None:
     parser.add_argument(
         "--model-size",
         help="model size (check Whisper model variants on Hugging Face)",
         default="large-v3-turbo",
     )
+    parser.add_argument(
+        "--batch-size",
+        help="number of clips up to 30 seconds to transcribe in one batch, longer files are transcribed one by one",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--decode-workers",
+        help="number of processes to decode and featurize audio files while the model transcribes",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--decoder",
+        help="decode audio files by librosa, or by ffmpeg straight into memory (ffmpeg is also the fallback of librosa)",
+        choices=["librosa", "ffmpeg"],
+        default="librosa",
+    )
+    parser.add_argument(
+        "--split-long-audio",
+        help="cut audio into chunks up to 30 seconds at silence and transcribe them in batches of --batch-size,"
+             " leading and trailing silence is skipped",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--cpu-profile",
+        help="run the model on CPU with linear layers dynamically quantized to int8",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--model-cache-dir",
+        help="directory to keep the model prepared by --cpu-profile, so later starts skip the quantization",
+    )
+    parser.add_argument(
+        "--torch-threads",
+        help="number of threads for intra-op parallelism of torch (by default torch picks it)",
+        type=int,
+    )
+    parser.add_argument(
+        "--torch-interop-threads",
+        help="number of threads for inter-op parallelism of torch (by default torch picks it)",
+        type=int,
+    )
+    parser.add_argument(
+        "--torch-compile",
+        help="compile the model by torch.compile, the first batches are slow because of the compilation",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Transcribe audio files to text by the Whisper Model.")
+    add_transcription_arguments(parser)
     parser.add_argument(
         "audio_files",
         nargs="+",
@@ -112,7 +577,4 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    import torch
-    from transformers import WhisperProcessor, WhisperForConditionalGeneration
-
     main(args)
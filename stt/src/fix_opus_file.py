@@ -1,7 +1,13 @@
-import struct
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import os
+from pathlib import Path
 
 import pyogg
 
+# PCM is handed over to the encoder in blocks of this length, the encoder splits them into frames itself
+BLOCK_SECONDS = 60
+
 
 def recode_opus_file(inout_file_path: str, output_file_path: str):
     # https://pyogg.readthedocs.io/en/latest/examples.html#write-an-oggopus-file
@@ -15,18 +21,78 @@ def recode_opus_file(inout_file_path: str, output_file_path: str):
     opus_buffered_encoder.set_channels(input_opus.channels)
     opus_buffered_encoder.set_frame_size(20)  # milliseconds
 
-    writer = pyogg.OggOpusWriter(output_file_path, opus_buffered_encoder)
+    # The output appears only when it's complete
+    temp_file_path = f"{output_file_path}.part"
+    writer = pyogg.OggOpusWriter(temp_file_path, opus_buffered_encoder)
+
+    # Samples x channels of native int16, which is the little-endian PCM of https://wiki.xiph.org/OggOpus on every
+    # supported platform; a block of rows is a contiguous view of the decoded buffer, so nothing is copied
+    pcm = input_opus.as_array()
+    block_length = input_opus.frequency * BLOCK_SECONDS
 
-    # Loop through the input's PCM data and write it as OggOpus
-    for byte in input_opus.as_array():
-        # Encode the PCM data
-        writer.write(
-            # https://wiki.xiph.org/OggOpus
-            memoryview(bytearray(struct.pack("<h", *byte)))
-        )
+    for start in range(0, len(pcm), block_length):
+        writer.write(memoryview(pcm[start:start + block_length]).cast("B"))
 
     writer.close()
+    os.replace(temp_file_path, output_file_path)
+
+
+def recode_opus_files(file_paths: list[tuple[str, str]], workers: int) -> list[Exception | None]:
+    # Returns the error of every file, or None if it's recoded
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(recode_opus_file, input_path, output_path) for input_path, output_path in file_paths]
+
+        errors = []
+        for future in futures:
+            try:
+                future.result()
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+
+        return errors
+
+
+def main(args):
+    file_paths = []
+    for input_path in args.input_files:
+        output_dir = Path(args.output_dir) if args.output_dir else Path(input_path).parent
+        file_paths.append((input_path, str(output_dir / f"{Path(input_path).name}{args.output_suffix}"),))
+
+    errors = recode_opus_files(file_paths, args.workers)
+
+    for (input_path, output_path), error in zip(file_paths, errors):
+        if error is None:
+            print(f"Recoded {input_path} to {output_path}")
+        else:
+            print(f"Cannot recode {input_path}: {error}")
+
+    print(f"Done: {errors.count(None)} of {len(errors)} files recoded")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Recode broken Opus files, so they can be decoded by librosa and ffmpeg.")
+    parser.add_argument(
+        "--output-dir",
+        help="directory for recoded files (by default next to the input files)",
+    )
+    parser.add_argument(
+        "--output-suffix",
+        help="suffix added to names of recoded files",
+        default=".opus",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of processes to recode files in parallel",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "input_files",
+        nargs="+",
+        help="paths to Opus files (like ../data/audio_files/*.oga)",
+    )
 
+    args = parser.parse_args()
 
-bad_file_path = "channel_123_msg_345.oga"
-recode_opus_file(bad_file_path, f"{bad_file_path}.opus")
+    main(args)
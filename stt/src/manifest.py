@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+# One manifest per audio directory, telegram-dumper reads transcripts from it too
+MANIFEST_FILE_NAME = "transcripts.jsonl"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class TranscriptionManifest:
+    def __init__(self, directory: Path):
+        self.path = directory / MANIFEST_FILE_NAME
+
+        # The last record wins, for a file and for an audio content transcribed by a model
+        self._by_file: dict[tuple[str, str], dict] = {}
+        self._by_content: dict[tuple[str, str], dict] = {}
+        self._file_names: set[str] = set()
+        # (size, mtime_ns) of the manifest file as it was read, other processes append to it too
+        self._stat: tuple[int, int] | None = None
+
+        self._load()
+
+    def find(self, audio_hash: str, model: str) -> dict | None:
+        return self._by_content.get((audio_hash, model,))
+
+    def has_file(self, file_name: str) -> bool:
+        return file_name in self._file_names
+
+    def find_file(self, file_name: str, model: str) -> dict | None:
+        return self._by_file.get((file_name, model,))
+
+    def is_transcribed(self, file_path: Path, model: str) -> bool:
+        # Decided by stats only, a file that differs from its record is hashed to find out more
+        if not self.has_file(file_path.name):
+            # Transcripts made before the manifest appeared are kept
+            return file_path.with_suffix(".txt").exists()
+
+        try:
+            file_info = compose_file_info(file_path)
+        except OSError:
+            return False
+
+        record = self.find_file(file_path.name, model)
+
+        return record is not None and is_same_file(record, file_info)
+
+    def is_changed(self) -> bool:
+        return self._read_stat() != self._stat
+
+    def add(self, record: dict) -> None:
+        # Records are appended and flushed one by one, so an interrupted run keeps everything done before
+        with open(self.path, "a") as fp:
+            fp.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        self._index(record)
+        self._stat = self._read_stat()
+
+    def iter_records(self):
+        # Files transcribed by several models have a record of every model
+        return iter(self._by_file.values())
+
+    def _read_stat(self) -> tuple[int, int] | None:
+        try:
+            manifest_stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+
+        return manifest_stat.st_size, manifest_stat.st_mtime_ns
+
+    def _load(self) -> None:
+        self._stat = self._read_stat()
+
+        try:
+            with open(self.path, "r") as fp:
+                for line in fp:
+                    try:
+                        self._index(json.loads(line))
+                    except ValueError:
+                        # A line cut by an interrupted write
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def _index(self, record: dict) -> None:
+        self._by_file[(record["file"], record["model"],)] = record
+        self._file_names.add(record["file"])
+        self._by_content[(record["sha256"], record["model"],)] = record
+
+
+class ManifestRegistry:
+    def __init__(self):
+        self._manifests: dict[Path, TranscriptionManifest] = {}
+
+    def get(self, directory: Path) -> TranscriptionManifest:
+        directory = directory.absolute()
+
+        # Manifests changed by other processes, like a transcription service, are read again
+        if directory not in self._manifests or self._manifests[directory].is_changed():
+            self._manifests[directory] = TranscriptionManifest(directory)
+
+        return self._manifests[directory]
+
+
+def compose_file_info(file_path: Path) -> dict:
+    file_stat = os.stat(file_path)
+
+    return {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns}
+
+
+def is_same_file(record: dict, file_info: dict) -> bool:
+    return record.get("size") == file_info["size"] and record.get("mtime_ns") == file_info["mtime_ns"]
+
+
+def compute_file_hash(file_path: Path) -> str:
+    audio_hash = hashlib.sha256()
+
+    with open(file_path, "rb") as fp:
+        while chunk := fp.read(HASH_CHUNK_SIZE):
+            audio_hash.update(chunk)
+
+    return audio_hash.hexdigest()
@@ -0,0 +1,43 @@
+from argparse import ArgumentParser
+from collections import defaultdict
+from pathlib import Path
+
+from manifest import TranscriptionManifest
+
+
+def main(args):
+    totals = defaultdict(lambda: {"files": 0, "duration": 0., "decode_time": 0., "inference_time": 0.})
+
+    for directory in args.audio_dirs:
+        for record in TranscriptionManifest(Path(directory)).iter_records():
+            # Copied transcripts took no model time
+            if "copied_from" in record:
+                continue
+
+            model_totals = totals[record["model"]]
+            model_totals["files"] += 1
+            for key in ("duration", "decode_time", "inference_time"):
+                model_totals[key] += record[key]
+
+    for model, model_totals in sorted(totals.items()):
+        inference_time = max(model_totals["inference_time"], 1e-9)
+
+        print(
+            f"{model}: {model_totals['files']} files, {model_totals['duration'] / 3600:.2f} h of audio,"
+            f" decode {model_totals['decode_time']:.1f} s, inference {model_totals['inference_time']:.1f} s,"
+            f" real-time factor {inference_time / max(model_totals['duration'], 1e-9):.3f},"
+            f" {model_totals['files'] / inference_time:.2f} files/s"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Report transcription throughput of every model from the manifests.")
+    parser.add_argument(
+        "audio_dirs",
+        nargs="+",
+        help="directories with audio files and their transcription manifests",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
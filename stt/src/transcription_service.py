@@ -0,0 +1,242 @@
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from pathlib import Path
+import threading
+import time
+import traceback
+from typing import Callable
+
+from extract_text_from_speech import (
+    add_transcription_arguments,
+    TranscriptWriter,
+    compose_model_name,
+    create_decode_executor,
+    iter_audio_features,
+    load_stt_model,
+    select_files_to_transcribe,
+    set_torch_threads,
+    transcribe_files,
+    warn_if_opus_repair_unavailable,
+)
+from manifest import ManifestRegistry
+
+AUDIO_FILE_SUFFIXES = {".oga", ".ogg"}
+# Files taken from the queue at once, more of them keep the decode workers and batches full
+MAX_FILES_PER_ROUND = 64
+
+
+class TranscriptionQueue:
+    def __init__(self):
+        self._condition = threading.Condition()
+        # Dicts keep the order of submission and work as ordered sets
+        self._pending: dict[Path, None] = {}
+        self._processing: set[Path] = set()
+        self._failed: set[Path] = set()
+        self._done_count = 0
+
+    def put(self, file_path: Path, retry_failed: bool = False) -> bool:
+        with self._condition:
+            if retry_failed:
+                self._failed.discard(file_path)
+
+            if file_path in self._pending or file_path in self._processing or file_path in self._failed:
+                return False
+
+            self._pending[file_path] = None
+            self._condition.notify()
+
+            return True
+
+    def take(self, limit: int) -> list[Path]:
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+
+            file_paths = list(self._pending)[:limit]
+            for file_path in file_paths:
+                del self._pending[file_path]
+                self._processing.add(file_path)
+
+            return file_paths
+
+    def finish(self, file_paths: list[Path], is_transcribed: Callable[[Path], bool]) -> None:
+        with self._condition:
+            for file_path in file_paths:
+                self._processing.discard(file_path)
+
+                if is_transcribed(file_path):
+                    self._done_count += 1
+                else:
+                    self._failed.add(file_path)
+
+    def get_status(self) -> dict:
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                "processing": len(self._processing),
+                "done": self._done_count,
+                "failed": len(self._failed),
+            }
+
+
+def main(args):
+    warn_if_opus_repair_unavailable()
+    set_torch_threads(args)
+    model, processor, device = load_stt_model(args)
+    writer = TranscriptWriter(compose_model_name(args))
+
+    queue = TranscriptionQueue()
+
+    watcher = threading.Thread(target=watch_directories, args=(queue, args), daemon=True)
+    watcher.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), create_request_handler(queue))
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    print(f"Listening on http://{args.host}:{args.port}")
+
+    # The decode workers and the model live as long as the service
+    with create_decode_executor(args) as executor:
+        try:
+            while True:
+                file_paths = queue.take(MAX_FILES_PER_ROUND)
+
+                try:
+                    files = select_files_to_transcribe(file_paths, writer)
+                    audio_features = iter_audio_features(executor, files, args)
+
+                    transcribe_files(model, processor, device, audio_features, writer, args)
+                except Exception:
+                    # Failed files are skipped inside the round, so this is an error of the round itself.
+                    # Files left without transcripts are marked failed, they are taken again only by a request
+                    traceback.print_exc()
+                finally:
+                    queue.finish(file_paths, lambda file_path: is_transcribed(file_path, writer))
+        except KeyboardInterrupt:
+            print("Stopping...")
+        finally:
+            server.shutdown()
+
+
+def watch_directories(queue: TranscriptionQueue, args) -> None:
+    # Polling is used, as it works on every platform and volume; a directory is rescanned only when its mtime changes
+    mtimes: dict[Path, int] = {}
+    # The watcher has manifests of its own, as they are read in another thread
+    manifests = ManifestRegistry()
+    model_name = compose_model_name(args)
+
+    while True:
+        for directory in args.audio_dirs:
+            directory = Path(directory)
+
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+                if mtimes.get(directory) == mtime:
+                    continue
+
+                mtimes[directory] = mtime
+                manifest = manifests.get(directory)
+                queued_count = sum(
+                    1
+                    for file_path in find_audio_files(directory)
+                    if not manifest.is_transcribed(file_path, model_name) and queue.put(file_path)
+                )
+            except FileNotFoundError:
+                continue
+
+            if queued_count:
+                print(f"Queued {queued_count} files from {directory}")
+
+        time.sleep(args.poll_interval)
+
+
+def find_audio_files(directory: Path) -> list[Path]:
+    with os.scandir(directory) as entries:
+        file_names = {entry.name for entry in entries if entry.is_file()}
+
+    return [
+        (directory / file_name).absolute()
+        for file_name in sorted(file_names)
+        if Path(file_name).suffix in AUDIO_FILE_SUFFIXES
+    ]
+
+
+def is_transcribed(file_path: Path, writer: TranscriptWriter) -> bool:
+    # The same manifest check as the selection of files to transcribe, so skipped files are done too
+    return writer.manifests.get(file_path.parent).is_transcribed(file_path, writer.model_name)
+
+
+def create_request_handler(queue: TranscriptionQueue) -> type[BaseHTTPRequestHandler]:
+    class RequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/status":
+                self.send_json(404, {"error": "Not found"})
+                return
+
+            self.send_json(200, queue.get_status())
+
+        def do_POST(self):
+            # Body: {"files": ["/path/to/audio.oga", ...]}
+            if self.path != "/files":
+                self.send_json(404, {"error": "Not found"})
+                return
+
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                file_paths = [Path(file_path).absolute() for file_path in body["files"]]
+            except (ValueError, KeyError, TypeError):
+                self.send_json(400, {"error": "Expected a JSON object with a list of files"})
+                return
+
+            missing_files = [str(file_path) for file_path in file_paths if not file_path.is_file()]
+            if missing_files:
+                self.send_json(400, {"error": "Files not found", "files": missing_files})
+                return
+
+            queued_count = sum(1 for file_path in file_paths if queue.put(file_path, retry_failed=True))
+
+            self.send_json(202, {"queued": queued_count, **queue.get_status()})
+
+        def send_json(self, status: int, data: dict) -> None:
+            body = json.dumps(data).encode()
+
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return RequestHandler
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Keep the Whisper Model loaded and transcribe new audio files as they appear.")
+    add_transcription_arguments(parser)
+    parser.add_argument(
+        "--poll-interval",
+        help="seconds between checks of the watched directories",
+        type=float,
+        default=10.,
+    )
+    parser.add_argument(
+        "--host",
+        help="address of the HTTP endpoint to submit files and read the queue status",
+        default="127.0.0.1",
+    )
+    parser.add_argument(
+        "--port",
+        help="port of the HTTP endpoint",
+        type=int,
+        default=8765,
+    )
+    parser.add_argument(
+        "audio_dirs",
+        nargs="*",
+        help="directories to watch for new audio files (like ../data/audio_files)",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,59 @@
+import numpy as np
+
+FRAME_SECONDS = .03
+# Speech is kept with a margin around it, so word edges aren't cut off
+PADDING_SECONDS = .3
+# A chunk isn't cut before this length, the cut point is the quietest frame after it
+MIN_CHUNK_SECONDS = 15
+# Frames louder than the noise floor (the 10th percentile of frame energies) by this factor are speech
+NOISE_FACTOR = 2.
+# Frames no more than 20 dB quieter than the loud ones (the 90th percentile) are speech, even without pauses
+LOUDNESS_FACTOR = .1
+# About -60 dBFS, anything quieter is silence even in a very clean recording
+MIN_SPEECH_ENERGY = .001
+
+
+def split_audio_at_silence(data: np.ndarray, sampling_rate: int, max_chunk_length: int) -> list[np.ndarray]:
+    # Returns views of the data: leading and trailing silence is dropped, the rest is cut at quiet points
+    # into chunks up to max_chunk_length samples, and chunks without speech are dropped
+    frame_length = int(sampling_rate * FRAME_SECONDS)
+    frame_count = len(data) // frame_length
+    if frame_count == 0:
+        return []
+
+    energy = compute_frame_energy(data, frame_length, frame_count)
+    noise_energy, loud_energy = np.percentile(energy, [10, 90])
+    threshold = max(min(noise_energy * NOISE_FACTOR, loud_energy * LOUDNESS_FACTOR), MIN_SPEECH_ENERGY)
+    is_speech = energy > threshold
+
+    speech_frames = np.flatnonzero(is_speech)
+    if len(speech_frames) == 0:
+        return []
+
+    padding = int(PADDING_SECONDS / FRAME_SECONDS)
+    start = max(speech_frames[0] - padding, 0)
+    end = min(speech_frames[-1] + padding + 1, frame_count)
+
+    max_frames = max_chunk_length // frame_length
+    min_frames = min(int(MIN_CHUNK_SECONDS / FRAME_SECONDS), max_frames - 1)
+
+    bounds = []
+    while end - start > max_frames:
+        cut = start + min_frames + int(np.argmin(energy[start + min_frames:start + max_frames]))
+        bounds.append((start, cut,))
+        start = cut
+
+    bounds.append((start, end,))
+
+    return [
+        data[chunk_start * frame_length:chunk_end * frame_length]
+        for chunk_start, chunk_end in bounds
+        if is_speech[chunk_start:chunk_end].any()
+    ]
+
+
+def compute_frame_energy(data: np.ndarray, frame_length: int, frame_count: int) -> np.ndarray:
+    # RMS of every frame, einsum doesn't allocate the squared copy of the whole recording
+    frames = data[:frame_count * frame_length].reshape(frame_count, frame_length)
+
+    return np.sqrt(np.einsum("ij,ij->i", frames, frames) / frame_length)
@@ -0,0 +1,106 @@
+from argparse import Namespace
+
+from manifest import ManifestRegistry, TranscriptionManifest, compose_file_info
+import transcription_report
+
+MODEL = "whisper-small"
+
+
+def add_record(manifest: TranscriptionManifest, file_path, model: str = MODEL, **fields) -> dict:
+    record = {
+        "file": file_path.name,
+        "sha256": "hash",
+        **compose_file_info(file_path),
+        "duration": 1.,
+        "model": model,
+        "decode_time": .1,
+        "inference_time": .2,
+        "transcript": "text",
+        **fields,
+    }
+    manifest.add(record)
+
+    return record
+
+
+def test_file_is_transcribed_while_its_stats_match_the_record(tmp_path):
+    audio_path = tmp_path / "1.ogg"
+    audio_path.write_bytes(b"audio")
+    manifest = TranscriptionManifest(tmp_path)
+
+    assert not manifest.is_transcribed(audio_path, MODEL)
+
+    add_record(manifest, audio_path)
+
+    assert manifest.is_transcribed(audio_path, MODEL)
+    assert not manifest.is_transcribed(audio_path, "whisper-medium")
+
+    audio_path.write_bytes(b"rewritten audio")
+
+    assert not manifest.is_transcribed(audio_path, MODEL)
+
+
+def test_transcripts_made_before_manifest_are_kept(tmp_path):
+    audio_path = tmp_path / "1.ogg"
+    audio_path.write_bytes(b"audio")
+    audio_path.with_suffix(".txt").write_text("old text")
+
+    assert TranscriptionManifest(tmp_path).is_transcribed(audio_path, MODEL)
+
+
+def test_registry_reloads_manifest_changed_by_another_process(tmp_path):
+    audio_path = tmp_path / "1.ogg"
+    audio_path.write_bytes(b"audio")
+    registry = ManifestRegistry()
+
+    assert not registry.get(tmp_path).is_transcribed(audio_path, MODEL)
+
+    add_record(TranscriptionManifest(tmp_path), audio_path)
+
+    assert registry.get(tmp_path).is_transcribed(audio_path, MODEL)
+
+
+def test_registry_keeps_manifest_after_own_appends(tmp_path):
+    audio_path = tmp_path / "1.ogg"
+    audio_path.write_bytes(b"audio")
+    registry = ManifestRegistry()
+
+    manifest = registry.get(tmp_path)
+    add_record(manifest, audio_path)
+
+    assert registry.get(tmp_path) is manifest
+
+
+def test_records_are_kept_for_every_model(tmp_path):
+    audio_path = tmp_path / "1.ogg"
+    audio_path.write_bytes(b"audio")
+    manifest = TranscriptionManifest(tmp_path)
+    add_record(manifest, audio_path, duration=2.)
+    add_record(manifest, audio_path, model="whisper-medium", duration=2.)
+
+    manifest = TranscriptionManifest(tmp_path)
+
+    assert manifest.is_transcribed(audio_path, MODEL)
+    assert manifest.is_transcribed(audio_path, "whisper-medium")
+    assert manifest.find_file("1.ogg", MODEL)["model"] == MODEL
+    assert sorted(record["model"] for record in manifest.iter_records()) == ["whisper-medium", MODEL]
+
+
+def test_report_counts_every_model(tmp_path, capsys):
+    first_path = tmp_path / "1.ogg"
+    second_path = tmp_path / "2.ogg"
+    first_path.write_bytes(b"first")
+    second_path.write_bytes(b"second")
+    manifest = TranscriptionManifest(tmp_path)
+    add_record(manifest, first_path, duration=3600.)
+    add_record(manifest, first_path, model="whisper-medium", duration=3600.)
+    add_record(manifest, second_path, model="whisper-medium", duration=3600.)
+    # Copied transcripts took no model time
+    add_record(manifest, second_path, copied_from="1.ogg")
+
+    transcription_report.main(Namespace(audio_dirs=[str(tmp_path)]))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("whisper-medium: 2 files, 2.00 h of audio")
+    assert lines[1].startswith(f"{MODEL}: 1 files, 1.00 h of audio")
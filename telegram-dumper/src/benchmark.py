@@ -0,0 +1,290 @@
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta, timezone
+import json
+from pathlib import Path
+import random
+from tempfile import TemporaryDirectory
+import time
+
+from telethon.tl import types
+from telethon.tl.patched import Message
+
+from lib import JsonlMessageIndex, dumps, iter_jsonl_with_messages, save_jsonl_chunks, save_jsonl_with_messages, to_json_data
+from lib.codec import orjson, orjson_dumps, orjson_loads, stdlib_dumps, stdlib_loads
+from lib.compression import get_jsonl_size, zstandard
+import simplify_api_dump
+
+
+def benchmark_convert(args):
+    messages = [compose_sample_message(message_id) for message_id in range(1, args.count + 1)]
+
+    for message in messages[:100]:
+        assert to_json_data(message) == json.loads(message.to_json()), "Conversion results differ"
+
+    baseline_time = measure(lambda: [json.loads(message.to_json()) for message in messages])
+    print_rate("json.loads(to_json())", len(messages), baseline_time)
+
+    convert_time = measure(lambda: [to_json_data(message) for message in messages])
+    print_rate("to_json_data()", len(messages), convert_time)
+
+    print(f"Speedup: {baseline_time / convert_time:.2f}x")
+
+
+def benchmark_codec(args):
+    if args.input_jsonl_file:
+        records = list(iter_jsonl_with_messages(args.input_jsonl_file))
+    else:
+        records = [to_json_data(compose_sample_message(message_id)) for message_id in range(1, args.count + 1)]
+
+    codecs = {"stdlib": (stdlib_dumps, stdlib_loads)}
+    if orjson is not None:
+        codecs["orjson"] = (orjson_dumps, orjson_loads)
+    else:
+        print("orjson is not installed, only the stdlib codec is measured")
+
+    lines = {}
+    for name, (dumps, loads) in codecs.items():
+        encode_time = measure(lambda: [dumps(record) for record in records])
+        print_rate(f"{name} dumps", len(records), encode_time)
+
+        lines[name] = [dumps(record) for record in records]
+        decode_time = measure(lambda: [loads(line) for line in lines[name]])
+        print_rate(f"{name} loads", len(records), decode_time)
+
+    if "orjson" in lines:
+        different_lines = sum(1 for a, b in zip(lines["stdlib"], lines["orjson"]) if a != b)
+        print(f"Lines different between codecs: {different_lines}")
+
+
+def benchmark_compression(args):
+    if args.input_jsonl_file:
+        records = list(iter_jsonl_with_messages(args.input_jsonl_file))
+    else:
+        # Texts, numbers and binary fields vary, so generated messages compress about as well as a real dump
+        random_generator = random.Random(args.seed)
+        records = [
+            to_json_data(compose_sample_message(message_id, random_generator))
+            for message_id in range(1, args.count + 1)
+        ]
+
+    suffixes = [".jsonl", ".jsonl.gz"]
+    if zstandard is not None:
+        suffixes.append(".jsonl.zst")
+    else:
+        print("zstandard is not installed, only gzip is measured")
+
+    message_ids = random.sample([record["id"] for record in records], min(args.lookups, len(records)))
+
+    with TemporaryDirectory() as temp_dir:
+        plain_size = None
+        for suffix in suffixes:
+            file_path = Path(temp_dir) / f"messages{suffix}"
+
+            write_time = measure(lambda: save_jsonl_with_messages(file_path, records))
+            read_time = measure(lambda: sum(1 for _ in iter_jsonl_with_messages(file_path)))
+
+            index = JsonlMessageIndex.open(file_path)
+            lookup_time = measure(lambda: [index.get(message_id) for message_id in message_ids])
+
+            size = file_path.stat().st_size
+            plain_size = plain_size or size
+            content_size = get_jsonl_size(file_path) / 1024 ** 2
+
+            print(f"{suffix}: {size / 1024 ** 2:.1f} MiB ({plain_size / size:.1f}x smaller),"
+                  f" write {content_size / write_time:.0f} MiB/s, read {content_size / read_time:.0f} MiB/s,"
+                  f" {len(message_ids) / lookup_time:,.0f} lookups/s by the index")
+
+
+def benchmark_simplify(args):
+    with TemporaryDirectory() as temp_dir:
+        input_path = Path(temp_dir) / "messages.jsonl"
+        output_path = Path(temp_dir) / "simplified.jsonl"
+
+        template = to_json_data(compose_sample_message(0))
+        save_jsonl_chunks(input_path, generate_message_lines(template, args.count))
+        print(f"Generated {args.count} messages, {input_path.stat().st_size / 1024 ** 2:.1f} MiB")
+
+        reference_output = None
+        for workers in args.workers:
+            simplify_args = Namespace(
+                input_jsonl_file=str(input_path),
+                output_jsonl_file=str(output_path),
+                remove_media=False,
+                remove_reply_messages=False,
+                transcripts_cache=False,
+                projection_spec=None,
+                workers=workers,
+            )
+
+            elapsed = measure(lambda: simplify_api_dump.main(simplify_args))
+            print_rate(f"simplify_api_dump --workers {workers}", args.count, elapsed)
+
+            output = output_path.read_bytes()
+            reference_output = reference_output or output
+            assert output == reference_output, "Outputs differ between numbers of workers"
+
+
+def generate_message_lines(template: dict, count: int, chunk_length: int = 10000):
+    for start in range(1, count + 1, chunk_length):
+        chunk = []
+        for message_id in range(start, min(start + chunk_length, count + 1)):
+            template["id"] = message_id
+            chunk.append(dumps(template) + b"\n")
+
+        yield b"".join(chunk)
+
+
+def compose_sample_message(message_id: int, random_generator: random.Random | None = None) -> Message:
+    # Without a random generator every message is the same but the ID
+    if random_generator is None:
+        date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        text = "Lorem ipsum dolor sit amet, consectetur adipiscing elit " * 4
+        numbers = [12345, 67, 12, 4321, 100, 7, 123456, 42]
+        document_id = 5368324170671202287
+        file_reference = bytes(range(32))
+        waveform = bytes(range(63))
+    else:
+        date = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=message_id * 30)
+        words_count = random_generator.randint(3, 80)
+        text = " ".join(random_generator.choices(SAMPLE_VOCABULARY, SAMPLE_WORD_WEIGHTS, k=words_count))
+        numbers = [random_generator.randint(1, 10 ** random_generator.randint(1, 6)) for _ in range(8)]
+        document_id = random_generator.getrandbits(63)
+        file_reference = random_generator.randbytes(32)
+        waveform = random_generator.randbytes(63)
+
+    views, forwards, replies, max_id, likes, custom_likes, size, duration = numbers
+    custom_emoji = types.ReactionCustomEmoji(document_id=5368324170671202286)
+
+    return Message(
+        id=message_id,
+        peer_id=types.PeerChannel(channel_id=1234567890),
+        date=date,
+        message=text,
+        post=True,
+        views=views,
+        forwards=forwards,
+        edit_date=date,
+        replies=types.MessageReplies(replies=replies, replies_pts=3456, channel_id=987654321, max_id=max_id),
+        reactions=types.MessageReactions(results=[
+            types.ReactionCount(reaction=types.ReactionEmoji(emoticon="👍"), count=likes),
+            types.ReactionCount(reaction=custom_emoji, count=custom_likes),
+        ]),
+        entities=[
+            types.MessageEntityBold(offset=0, length=5),
+            types.MessageEntityTextUrl(offset=6, length=5, url="https://example.com/"),
+        ],
+        media=types.MessageMediaDocument(
+            document=types.Document(
+                id=document_id,
+                access_hash=-1234567890123456789,
+                file_reference=file_reference,
+                date=date,
+                mime_type="audio/ogg",
+                size=size,
+                dc_id=2,
+                attributes=[
+                    types.DocumentAttributeAudio(duration=duration, voice=True, waveform=waveform),
+                ],
+            ),
+            voice=True,
+        ),
+    )
+
+
+def compose_vocabulary(size: int) -> list[str]:
+    # Pseudo-words of Cyrillic syllables, as most of the dumped texts are
+    random_generator = random.Random(0)
+    syllables = [consonant + vowel for consonant in "бвгдзклмнпрстхчш" for vowel in "аеиоуя"]
+
+    return ["".join(random_generator.choices(syllables, k=random_generator.randint(1, 4))) for _ in range(size)]
+
+
+SAMPLE_VOCABULARY = compose_vocabulary(5000)
+# Frequencies of words in texts follow the Zipf's law
+SAMPLE_WORD_WEIGHTS = [1 / rank for rank in range(1, len(SAMPLE_VOCABULARY) + 1)]
+
+
+def measure(func) -> float:
+    started_at = time.perf_counter()
+    func()
+
+    return time.perf_counter() - started_at
+
+
+def print_rate(name: str, count: int, elapsed: float) -> None:
+    print(f"{name}: {elapsed:.3f} s, {count / elapsed:,.0f} items/s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Measure performance of the dumper hot paths.")
+    subparsers = parser.add_subparsers(required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="convert Telethon messages to JSON-safe dicts")
+    convert_parser.add_argument(
+        "--count",
+        help="number of messages to convert",
+        type=int,
+        default=20000,
+    )
+    convert_parser.set_defaults(func=benchmark_convert)
+
+    codec_parser = subparsers.add_parser("codec", help="encode and decode messages by the JSON codecs")
+    codec_parser.add_argument(
+        "--input-jsonl-file",
+        help="take messages from a JSONL dump instead of generated ones",
+    )
+    codec_parser.add_argument(
+        "--count",
+        help="number of generated messages",
+        type=int,
+        default=100000,
+    )
+    codec_parser.set_defaults(func=benchmark_codec)
+
+    compression_parser = subparsers.add_parser(
+        "compression",
+        help="compare size, throughput and lookups of compressed JSONL files with plain ones",
+    )
+    compression_parser.add_argument(
+        "--input-jsonl-file",
+        help="take messages from a JSONL dump instead of generated ones",
+    )
+    compression_parser.add_argument(
+        "--count",
+        help="number of generated messages",
+        type=int,
+        default=100000,
+    )
+    compression_parser.add_argument(
+        "--lookups",
+        help="number of random messages read by the index",
+        type=int,
+        default=1000,
+    )
+    compression_parser.add_argument(
+        "--seed",
+        help="seed of generated messages",
+        type=int,
+        default=0,
+    )
+    compression_parser.set_defaults(func=benchmark_compression)
+
+    simplify_parser = subparsers.add_parser("simplify", help="run simplify_api_dump on generated messages")
+    simplify_parser.add_argument(
+        "--count",
+        help="number of generated messages",
+        type=int,
+        default=1000000,
+    )
+    simplify_parser.add_argument(
+        "--workers",
+        help="numbers of workers to compare",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16],
+    )
+    simplify_parser.set_defaults(func=benchmark_simplify)
+
+    args = parser.parse_args()
+
+    args.func(args)
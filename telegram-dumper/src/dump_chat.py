@@ -1,46 +1,100 @@
 import asyncio
-import json
-from argparse import ArgumentParser, BooleanOptionalAction
-from datetime import datetime, timedelta
+from argparse import ArgumentParser, ArgumentTypeError, BooleanOptionalAction
+from datetime import datetime, timedelta, timezone
+from itertools import chain
 import logging
 from os import getenv
 from pathlib import Path
+from typing import AsyncIterator, Iterable
 
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
 from telethon.hints import Entity
+from telethon.tl.functions.channels import GetFullChannelRequest
+from telethon.tl.functions.messages import GetRepliesRequest
+from telethon.tl.types import MessageEmpty, PeerChannel
+from telethon.tl.types.messages import Messages
 from telethon.tl.patched import Message
 
 from lib import (
+    AdaptiveRateLimiter,
+    AudioDownloader,
+    JsonlMessageIndex,
+    MessageStorage,
+    append_jsonl_with_messages,
     compose_voice_message_file_name,
     data_get,
-    read_jsonl_with_messages,
+    iter_jsonl_with_messages,
+    merge_jsonl_with_messages,
+    open_message_storage,
+    read_json_file,
+    read_jsonl_tail,
+    save_json_file,
     save_jsonl_with_messages,
+    to_json_data,
+    truncate_file,
 )
+from lib.compression import COMPRESSIONS
 
 logging.basicConfig(format="[%(levelname) 5s/%(asctime)s] %(name)s: %(message)s", level=logging.INFO)
 
 API_ID = int(getenv("TELEGRAM_API_ID"))
 API_HASH = getenv("TELEGRAM_API_HASH")
+SESSION_PATH = "../sessions/anon"
+# Requests sent through the rate limiter sleep through flood waits up to this length, longer ones reach the limiter,
+# which backs off. Other requests of the client keep the default threshold of Telethon and sleep through the waits.
+FLOOD_SLEEP_THRESHOLD = 5
+# Replies are requested page by page, it's the max page size of the API
+REPLIES_PAGE_SIZE = 100
+# Max number of discussion group message IDs scanned for a batch of posts, comments found by a scan are kept in memory
+# until their posts come. Threads newer than the window are fetched post by post.
+DISCUSSION_SCAN_WINDOW = 20000
+COMPRESSION_SUFFIXES = {compression: suffix for suffix, compression in COMPRESSIONS.items()}
 
 
 async def main(args):
+    rate_limiter = AdaptiveRateLimiter(args.requests_rate)
+
+    async with TelegramClient(SESSION_PATH, API_ID, API_HASH) as client:
+        await export_chat(client, args.chat_name, Path(args.output_dir), rate_limiter, args)
+
+
+async def export_chat(client, chat_name: str, output_dir: Path, rate_limiter: AdaptiveRateLimiter, args) -> int:
+    # Returns the number of fetched messages
     offset_date = None
     if args.from_date:
         from_date = datetime.fromisoformat(args.from_date)
         offset_date = from_date - timedelta(seconds=1)
 
-    output_dir = Path(args.output_dir)
     audio_files_dir = output_dir / 'audio_files'
 
-    session_path = "../sessions/anon"
-    async with TelegramClient(session_path, API_ID, API_HASH) as client:
-        entity_info = await client.get_entity(args.chat_name)
+    # Limit the queue in batch modes only, other modes keep all the messages in memory anyway
+    audio_downloader = AudioDownloader(
+        audio_files_dir,
+        args.download_concurrency,
+        queue_size=args.batch_size if args.stream or args.sync or args.storage != "jsonl" else 0,
+    )
+
+    async with audio_downloader:
+        entity_info = await client.get_entity(chat_name)
         save_entity_info(entity_info, output_dir)
 
-        output_path = compose_entity_messages_path(entity_info, output_dir)
+        output_path = compose_entity_messages_path(entity_info, output_dir, args.storage, args.compression)
         print(f"Use '{output_path}' file as output")
 
-        old_messages = read_jsonl_with_messages(output_path) \
+        if args.storage != "jsonl":
+            with open_message_storage(output_path) as storage:
+                return await store_messages(client, entity_info, storage, audio_downloader, offset_date, rate_limiter, args)
+
+        if args.refresh_window is not None:
+            return await refresh_messages(client, entity_info, output_path, audio_downloader, offset_date, rate_limiter, args)
+
+        if args.sync:
+            return await sync_messages(client, entity_info, output_path, audio_downloader, offset_date, rate_limiter, args)
+
+        if args.stream:
+            return await stream_messages(client, entity_info, output_path, audio_downloader, offset_date, rate_limiter, args)
+
+        old_messages = JsonlMessageIndex.open(output_path) \
             if args.preserve_old_data else {}
 
         messages: list[Message] = await client.get_messages(
@@ -50,65 +104,644 @@ async def main(args):
         )
         print(f"Total {len(messages)} messages fetched")
 
-        messages_replies = await fetch_replies(client, entity_info, messages, old_messages) \
-            if args.fetch_replies else {}
+        if args.fetch_voice_messages:
+            await enqueue_audio_messages(audio_downloader, messages)
+
+        discussion_scanner = DiscussionGroupScanner(client, entity_info)
+        messages_replies = await collect_replies(
+            client,
+            entity_info,
+            messages,
+            old_messages,
+            rate_limiter,
+            discussion_scanner,
+            args,
+        ) if args.fetch_replies else {}
 
-        messages_data = []
-        for message in messages:
-            message_data = json.loads(message.to_json())
+        if args.fetch_voice_messages:
+            await enqueue_replies_audio_messages(audio_downloader, messages_replies)
 
-            if message.id in messages_replies:
-                message_data["reply_messages"] = [
-                    json.loads(reply.to_json())
-                    for reply in messages_replies[message.id]
-                ]
+        messages_data = compose_messages_data(messages, messages_replies)
+        messages_data.sort(key=lambda m: m["id"])
 
-            messages_data.append(message_data)
+        save_merged_jsonl_with_messages(output_path, messages_data, args)
+        update_sync_state(output_path, discussion_scanner.positions)
 
-        messages_data = merge_messages_with_old(messages_data, old_messages, args.fetch_replies)
-        save_jsonl_with_messages(output_path, messages_data)
+        return len(messages)
+
+
+async def stream_messages(
+        client,
+        entity_info: Entity,
+        output_path: Path,
+        audio_downloader: AudioDownloader,
+        offset_date: datetime | None,
+        rate_limiter: AdaptiveRateLimiter,
+        args,
+) -> int:
+    partial_path = output_path.with_name(f"{output_path.name}.partial")
+    checkpoint_path = output_path.with_name(f"{output_path.name}.checkpoint")
+
+    checkpoint = read_json_file(checkpoint_path)
+    if checkpoint is None or not partial_path.exists():
+        checkpoint = {"last_id": 0, "size": 0}
+    else:
+        print(f"Resume from the checkpoint: last_id={checkpoint['last_id']}")
+
+    # Drop a tail that has been written but not committed by the checkpoint
+    truncate_file(partial_path, checkpoint["size"])
+
+    old_messages = JsonlMessageIndex.open(output_path) \
+        if args.preserve_old_data and args.fetch_replies else {}
+
+    discussion_scanner = DiscussionGroupScanner(client, entity_info, checkpoint.get("discussion_groups"))
+
+    messages_counter = 0
+    async for messages in iter_message_batches(client, entity_info, checkpoint["last_id"], offset_date, args.batch_size):
+        messages_replies = await collect_replies(
+            client,
+            entity_info,
+            messages,
+            old_messages,
+            rate_limiter,
+            discussion_scanner,
+            args,
+        ) if args.fetch_replies else {}
+
+        messages_data = compose_messages_data(messages, messages_replies)
+        checkpoint["size"] = append_jsonl_with_messages(partial_path, messages_data)
+        checkpoint["last_id"] = messages[-1].id
+        checkpoint["discussion_groups"] = discussion_scanner.positions
+        save_json_file(checkpoint_path, checkpoint)
+
+        messages_counter += len(messages)
+        print(f"Saved {messages_counter} messages, last_id={checkpoint['last_id']}")
 
         if args.fetch_voice_messages:
-            flat_replies = [reply for replies in messages_replies.values() for reply in replies]
-            audio_messages = find_audio_messages(messages) + find_audio_messages(flat_replies)
-            await download_audio_messages(audio_messages, audio_files_dir)
+            await enqueue_audio_messages(audio_downloader, messages)
+            await enqueue_replies_audio_messages(audio_downloader, messages_replies)
 
+    save_merged_jsonl_with_messages(output_path, iter_jsonl_with_messages(partial_path), args)
 
-async def fetch_replies(
+    update_sync_state(output_path, discussion_scanner.positions)
+
+    # No checkpoint is written when nothing is fetched
+    partial_path.unlink(missing_ok=True)
+    checkpoint_path.unlink(missing_ok=True)
+    print(f"Total {messages_counter} messages fetched")
+
+    return messages_counter
+
+
+async def sync_messages(
+        client,
+        entity_info: Entity,
+        output_path: Path,
+        audio_downloader: AudioDownloader,
+        offset_date: datetime | None,
+        rate_limiter: AdaptiveRateLimiter,
+        args,
+) -> int:
+    state_path = compose_sync_state_path(output_path)
+
+    state = read_json_file(state_path)
+    if state is None or not output_path.exists() or state["size"] != output_path.stat().st_size:
+        print("Sync state is outdated, restore it from the messages file")
+        state = update_sync_state(output_path)
+
+    print(f"Sync messages newer than max_id={state['max_id']}")
+
+    # New posts are newer than everything scanned in the discussion groups before, so the scan continues from there
+    discussion_scanner = DiscussionGroupScanner(client, entity_info, state.get("discussion_groups"))
+
+    messages_counter = 0
+    async for messages in iter_message_batches(client, entity_info, state["max_id"], offset_date, args.batch_size):
+        messages_replies = await collect_replies(
+            client,
+            entity_info,
+            messages,
+            {},
+            rate_limiter,
+            discussion_scanner,
+            args,
+        ) if args.fetch_replies else {}
+
+        messages_data = compose_messages_data(messages, messages_replies)
+        state["size"] = append_jsonl_with_messages(output_path, messages_data)
+        state["max_id"] = messages[-1].id
+        state["discussion_groups"] = discussion_scanner.positions
+        save_json_file(state_path, state)
+
+        messages_counter += len(messages)
+        print(f"Appended {messages_counter} messages, max_id={state['max_id']}")
+
+        if args.fetch_voice_messages:
+            await enqueue_audio_messages(audio_downloader, messages)
+            await enqueue_replies_audio_messages(audio_downloader, messages_replies)
+
+    print(f"Total {messages_counter} new messages fetched")
+
+    return messages_counter
+
+
+async def refresh_messages(
+        client,
+        entity_info: Entity,
+        output_path: Path,
+        audio_downloader: AudioDownloader,
+        offset_date: datetime | None,
+        rate_limiter: AdaptiveRateLimiter,
+        args,
+) -> int:
+    old_messages = JsonlMessageIndex.open(output_path)
+
+    min_id, offset_date = compose_refresh_bounds(args.refresh_window, max(old_messages.ids, default=0), offset_date)
+    print(f"Refresh messages newer than id={min_id}" + (f" and {offset_date:%Y-%m-%d %H:%M}" if offset_date else ""))
+
+    # The window is small, so its messages are kept in memory and merged into the file at once
+    messages_data = []
+    messages_counter = 0
+    # Comments of old posts are older than the saved scan positions, so the window is scanned from its start
+    discussion_scanner = DiscussionGroupScanner(client, entity_info)
+    async for messages in iter_message_batches(client, entity_info, min_id, offset_date, args.batch_size):
+        # Only the threads with changed counters are fetched again, the others keep their old replies on merge
+        window_old_messages = old_messages.get_messages(message.id for message in messages)
+        messages_replies = await collect_replies(
+            client,
+            entity_info,
+            messages,
+            window_old_messages,
+            rate_limiter,
+            discussion_scanner,
+            args,
+        ) if args.fetch_replies else {}
+
+        messages_data.extend(compose_messages_data(messages, messages_replies))
+
+        messages_counter += len(messages)
+        print(f"Fetched {messages_counter} messages, last_id={messages[-1].id}")
+
+        if args.fetch_voice_messages:
+            await enqueue_audio_messages(audio_downloader, messages)
+            await enqueue_replies_audio_messages(audio_downloader, messages_replies)
+
+    merge_jsonl_with_messages(
+        output_path,
+        messages_data,
+        lambda fresh_message, old_message: merge_message_with_old(fresh_message, old_message, args.fetch_replies),
+    )
+    update_sync_state(output_path, discussion_scanner.positions)
+
+    print(f"Total {messages_counter} messages refreshed")
+
+    return messages_counter
+
+
+def compose_refresh_bounds(
+        refresh_window: timedelta | int,
+        max_id: int,
+        offset_date: datetime | None,
+) -> tuple[int, datetime | None]:
+    # Returns the min ID and the offset date of messages to fetch again
+    if isinstance(refresh_window, int):
+        return max(max_id - refresh_window, 0), offset_date
+
+    window_date = datetime.now(timezone.utc) - refresh_window
+    if offset_date is None:
+        return 0, window_date
+
+    # Telethon treats naive dates as UTC
+    if offset_date.tzinfo is None:
+        offset_date = offset_date.replace(tzinfo=timezone.utc)
+
+    return 0, max(offset_date, window_date)
+
+
+def parse_refresh_window(value: str) -> timedelta | int:
+    try:
+        if value.endswith("d"):
+            return timedelta(days=int(value[:-1]))
+
+        return int(value)
+    except ValueError:
+        raise ArgumentTypeError(f"expected a number of days like 14d, or a number of message IDs: {value!r}")
+
+
+def update_sync_state(output_path: Path, discussion_groups: dict[str, int] | None = None) -> dict:
+    last_message, valid_size = read_jsonl_tail(output_path)
+
+    # Drop an incomplete line left by an interrupted append
+    if output_path.exists():
+        truncate_file(output_path, valid_size)
+
+    old_state = read_json_file(compose_sync_state_path(output_path)) or {}
+    state = {
+        "max_id": last_message["id"] if last_message else 0,
+        "size": valid_size,
+        "discussion_groups": merge_scan_positions(old_state.get("discussion_groups"), discussion_groups),
+    }
+    save_json_file(compose_sync_state_path(output_path), state)
+
+    return state
+
+
+async def store_messages(
+        client,
+        entity_info: Entity,
+        storage: MessageStorage,
+        audio_downloader: AudioDownloader,
+        offset_date: datetime | None,
+        rate_limiter: AdaptiveRateLimiter,
+        args,
+) -> int:
+    # A zero window is a valid one, it refreshes only the latest messages
+    is_refresh = args.refresh_window is not None
+    checkpoint_id = storage.get_meta("checkpoint_last_id")
+    saved_scan_positions = storage.get_meta("discussion_groups")
+    discussion_scanner = DiscussionGroupScanner(
+        client,
+        entity_info,
+        # Only new posts or the rest of an interrupted export are newer than everything scanned before
+        saved_scan_positions if not is_refresh and (args.sync or checkpoint_id is not None) else None,
+    )
+
+    if is_refresh:
+        min_id, offset_date = compose_refresh_bounds(args.refresh_window, storage.get_max_id(), offset_date)
+        print(f"Refresh messages newer than id={min_id}" + (f" and {offset_date:%Y-%m-%d %H:%M}" if offset_date else ""))
+    elif args.sync:
+        min_id = storage.get_max_id()
+        print(f"Sync messages newer than max_id={min_id}")
+    elif checkpoint_id is not None:
+        min_id = checkpoint_id
+        print(f"Resume from the checkpoint: last_id={min_id}")
+    else:
+        min_id = 0
+        if not args.preserve_old_data:
+            storage.clear()
+
+    messages_counter = 0
+    async for messages in iter_message_batches(client, entity_info, min_id, offset_date, args.batch_size):
+        old_messages = storage.get_messages([message.id for message in messages]) \
+            if args.preserve_old_data or is_refresh else {}
+
+        messages_replies = await collect_replies(
+            client,
+            entity_info,
+            messages,
+            old_messages,
+            rate_limiter,
+            discussion_scanner,
+            args,
+        ) if args.fetch_replies else {}
+
+        messages_data = [
+            merge_message_with_old(message_data, old_messages.get(message_data["id"]), args.fetch_replies)
+            for message_data in compose_messages_data(messages, messages_replies)
+        ]
+        meta = {"discussion_groups": merge_scan_positions(saved_scan_positions, discussion_scanner.positions)}
+        # A refresh leaves the checkpoint of an interrupted full export alone, so that export can still be resumed
+        if not is_refresh:
+            meta["checkpoint_last_id"] = messages[-1].id
+
+        storage.save_messages(messages_data, meta=meta)
+
+        messages_counter += len(messages)
+        print(f"Saved {messages_counter} messages, last_id={messages[-1].id}")
+
+        if args.fetch_voice_messages:
+            await enqueue_audio_messages(audio_downloader, messages)
+            await enqueue_replies_audio_messages(audio_downloader, messages_replies)
+
+    if not is_refresh:
+        storage.delete_meta("checkpoint_last_id")
+    print(f"Total {messages_counter} messages fetched")
+
+    return messages_counter
+
+
+async def iter_message_batches(
+        client,
+        entity_info: Entity,
+        min_id: int,
+        offset_date: datetime | None,
+        batch_size: int,
+) -> AsyncIterator[list[Message]]:
+    batch = []
+    async for message in client.iter_messages(
+            entity=entity_info,
+            reverse=True,
+            min_id=min_id,
+            offset_date=offset_date,
+    ):
+        batch.append(message)
+
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def compose_messages_data(messages: list[Message], messages_replies: dict[int, list[Message]]) -> list[dict]:
+    messages_data = []
+    for message in messages:
+        message_data = to_json_data(message)
+
+        if message.id in messages_replies:
+            message_data["reply_messages"] = [
+                to_json_data(reply)
+                for reply in messages_replies[message.id]
+            ]
+
+        messages_data.append(message_data)
+
+    return messages_data
+
+
+def save_merged_jsonl_with_messages(output_path: Path, messages_data: Iterable[dict], args) -> None:
+    if not args.preserve_old_data:
+        save_jsonl_with_messages(output_path, messages_data)
+        return
+
+    merge_jsonl_with_messages(
+        output_path,
+        messages_data,
+        lambda fresh_message, old_message: merge_message_with_old(fresh_message, old_message, args.fetch_replies),
+    )
+
+
+async def collect_replies(
         client,
         entity_info: Entity,
         current_messages: list[Message],
         old_messages: dict[int, dict],
+        rate_limiter: AdaptiveRateLimiter,
+        discussion_scanner: "DiscussionGroupScanner",
+        args,
 ) -> dict[int, list[Message]]:
-    all_replies = []
+    if args.replies_strategy == "discussion-group":
+        return await fetch_discussion_group_replies(
+            client,
+            entity_info,
+            current_messages,
+            old_messages,
+            rate_limiter,
+            discussion_scanner,
+            args.replies_concurrency,
+        )
+
+    return await fetch_replies(
+        client,
+        entity_info,
+        current_messages,
+        old_messages,
+        rate_limiter,
+        args.replies_concurrency,
+    )
 
-    messages_with_replies = len(list(filter(None, [is_message_have_replies(message) for message in current_messages])))
-    print(f"Total {messages_with_replies} messages with replies to fetch")
+
+async def fetch_replies(
+        client,
+        entity_info: Entity,
+        current_messages: list[Message],
+        old_messages: dict[int, dict],
+        rate_limiter: AdaptiveRateLimiter,
+        concurrency: int,
+) -> dict[int, list[Message]]:
+    messages_to_fetch = [
+        message
+        for message in current_messages
+        if is_replies_fetch_required(message, old_messages.get(message.id))
+    ]
+    print(f"Total {len(messages_to_fetch)} messages with replies to fetch")
 
     result: dict[int, list[Message]] = {}
     process_counter = 0
-    for message in current_messages:
-        old_message = old_messages.get(message.id)
-        is_fetch_required = is_replies_fetch_required(message, old_message)
+    notice_step = max(int(len(messages_to_fetch) * .05), 5)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_message_replies(message: Message) -> None:
+        nonlocal process_counter
+
+        async with semaphore:
+            replies = await get_message_replies(client, entity_info, message.id, rate_limiter)
+
+        result[message.id] = replies
+
+        process_counter += 1
+        if process_counter % notice_step == 0:
+            print(f"Fetched replies to {process_counter}/{len(messages_to_fetch)} of messages"
+                  f" at {rate_limiter.rate:.2f} requests/s")
+
+    await asyncio.gather(*[fetch_message_replies(message) for message in messages_to_fetch])
+
+    return result
+
+
+async def get_message_replies(
+        client,
+        entity_info: Entity,
+        message_id: int,
+        rate_limiter: AdaptiveRateLimiter,
+) -> list[Message]:
+    # Every page is a request of its own through the rate limiter, as client.get_messages cannot lower
+    # the flood sleep threshold for its requests only
+    input_peer = utils.get_input_peer(entity_info)
+    replies = []
+    offset_id = 0
+
+    while True:
+        request = GetRepliesRequest(
+            peer=input_peer,
+            msg_id=message_id,
+            offset_id=offset_id,
+            offset_date=None,
+            add_offset=0,
+            limit=REPLIES_PAGE_SIZE,
+            max_id=0,
+            min_id=0,
+            hash=0,
+        )
+        result = await rate_limiter.call(client, request, flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD)
+
+        entities = {utils.get_peer_id(entity): entity for entity in chain(result.users, result.chats)}
+        page = [reply for reply in result.messages if not isinstance(reply, MessageEmpty)]
+        for reply in page:
+            reply._finish_init(client, entities, input_peer)
+
+        replies.extend(page)
+
+        # Pages come from the newest replies, a response of the Messages type holds all of them at once
+        if isinstance(result, Messages) or not page:
+            break
+
+        offset_id = page[-1].id
+
+    replies.reverse()
+
+    return replies
+
+
+async def fetch_discussion_group_replies(
+        client,
+        entity_info: Entity,
+        current_messages: list[Message],
+        old_messages: dict[int, dict],
+        rate_limiter: AdaptiveRateLimiter,
+        discussion_scanner: "DiscussionGroupScanner",
+        concurrency: int,
+) -> dict[int, list[Message]]:
+    messages_to_fetch = [
+        message
+        for message in current_messages
+        if is_replies_fetch_required(message, old_messages.get(message.id))
+    ]
+    print(f"Total {len(messages_to_fetch)} messages with replies to fetch from discussion groups")
+
+    groups_messages: dict[int, list[Message]] = {}
+    for message in messages_to_fetch:
+        if message.replies.channel_id is not None:
+            groups_messages.setdefault(message.replies.channel_id, []).append(message)
+
+    result: dict[int, list[Message]] = {}
+    for group_id, group_messages in groups_messages.items():
+        result.update(await discussion_scanner.get_replies(group_id, group_messages, rate_limiter))
+
+    discussion_scanner.finish_batch(current_messages)
+
+    incomplete_messages = [
+        message
+        for message in messages_to_fetch
+        if len(result.get(message.id, [])) != message.replies.replies
+    ]
+    if incomplete_messages:
+        print(f"Replies of {len(incomplete_messages)} messages don't match their counters, fetch them one by one")
+
+        for message in incomplete_messages:
+            result.pop(message.id, None)
+
+        result.update(await fetch_replies(client, entity_info, incomplete_messages, {}, rate_limiter, concurrency))
+
+    return result
 
-        if is_fetch_required:
-            replies: list[Message] = await client.get_messages(entity=entity_info, reply_to=message.id, reverse=True)
-            all_replies.extend(replies)
-            result[message.id] = replies
 
-            process_counter += 1
-            if process_counter % max(int(messages_with_replies * .05), 5) == 0:
-                print(f"Fetched replies to {process_counter}/{messages_with_replies} of messages")
-                await asyncio.sleep(1)
+class DiscussionGroupScanner:
+    # Discussion groups are scanned forward only, so batches of posts don't scan the same group messages again.
+    # Comments of posts of the next batches are kept until these batches come, a scan covers a limited window of IDs,
+    # so the memory doesn't grow with the group.
+    def __init__(self, client, entity_info: Entity, positions: dict[str, int] | None = None):
+        self.client = client
+        self.entity_info = entity_info
+        # The last scanned message ID by group ID, it's saved to continue from it in the next run
+        self.positions: dict[str, int] = dict(positions or {})
+
+        # Posts are forwarded to the discussion group automatically, comments refer to these copies
+        self._post_copies: dict[int, int] = {}
+        self._replies: dict[int, list[Message]] = {}
+        self._last_done_post_id = 0
+        self._is_group_loaded = False
+
+    async def get_replies(
+            self,
+            group_id: int,
+            group_messages: list[Message],
+            rate_limiter: AdaptiveRateLimiter,
+    ) -> dict[int, list[Message]]:
+        # The newest comment is known from the counters
+        last_reply_id = max(message.replies.max_id or 0 for message in group_messages)
+        if self.positions.get(str(group_id), 0) < last_reply_id:
+            await self._scan(group_id, group_messages, last_reply_id, rate_limiter)
+
+        return {message.id: self._replies.pop(message.id) for message in group_messages if message.id in self._replies}
+
+    def finish_batch(self, messages: list[Message]) -> None:
+        # Comments of done posts are not kept, including posts that never come in a batch, like deleted ones
+        self._last_done_post_id = max([self._last_done_post_id, *(message.id for message in messages)])
+
+        self._replies = {
+            post_id: replies for post_id, replies in self._replies.items() if post_id > self._last_done_post_id
+        }
+        self._post_copies = {
+            copy_id: post_id for copy_id, post_id in self._post_copies.items() if post_id > self._last_done_post_id
+        }
+
+    async def _scan(
+            self,
+            group_id: int,
+            group_messages: list[Message],
+            last_reply_id: int,
+            rate_limiter: AdaptiveRateLimiter,
+    ) -> None:
+        if not self._is_group_loaded:
+            # Load the linked discussion group into the entity cache
+            await rate_limiter.call(
+                self.client,
+                GetFullChannelRequest(self.entity_info),
+                flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD,
+            )
+            self._is_group_loaded = True
+
+        # Comments can't be older than their posts, so the messages before the posts are skipped
+        position = self.positions.get(str(group_id), 0)
+        offset_date = min(message.date for message in group_messages) - timedelta(minutes=1)
+
+        scan_counter = 0
+        scan_end = last_reply_id
+        async for group_message in self.client.iter_messages(
+                entity=PeerChannel(group_id),
+                reverse=True,
+                min_id=position,
+                offset_date=offset_date,
+        ):
+            if scan_counter == 0 and group_message.id + DISCUSSION_SCAN_WINDOW < scan_end:
+                # Threads past the window don't match their counters and are fetched post by post
+                scan_end = group_message.id + DISCUSSION_SCAN_WINDOW
+                print(f"The discussion group {group_id} is scanned up to id={scan_end} for this batch")
+
+            if group_message.id > scan_end:
+                break
+
+            scan_counter += 1
+            if scan_counter % 10000 == 0:
+                print(f"Scanned {scan_counter} messages of the discussion group {group_id}, at id={group_message.id}")
+
+            forward = group_message.fwd_from
+            if forward is not None \
+                    and forward.channel_post is not None \
+                    and getattr(forward.from_id, "channel_id", None) == self.entity_info.id:
+                self._post_copies[group_message.id] = forward.channel_post
+                continue
+
+            reply_to = group_message.reply_to
+            if reply_to is None:
+                continue
+
+            top_message_id = reply_to.reply_to_top_id or reply_to.reply_to_msg_id
+            post_id = self._post_copies.get(top_message_id)
+            if post_id is not None and post_id > self._last_done_post_id:
+                self._replies.setdefault(post_id, []).append(group_message)
+
+        self.positions[str(group_id)] = max(position, scan_end)
+
+        print(f"Scanned {scan_counter} messages of the discussion group {group_id}")
+
+
+def merge_scan_positions(*positions_list: dict[str, int] | None) -> dict[str, int]:
+    result = {}
+    for positions in positions_list:
+        for group_id, position in (positions or {}).items():
+            result[group_id] = max(result.get(group_id, 0), position)
 
     return result
 
 
 def is_message_have_replies(message: dict | Message) -> bool:
-    if not isinstance(message, dict):
-        message = message.to_dict()
+    if isinstance(message, dict):
+        replies_count = data_get(message, 'replies.replies')
+    else:
+        replies_count = message.replies.replies if message.replies else None
 
-    replies_count = data_get(message, 'replies.replies')
     replies_count = int(replies_count) if replies_count else 0
 
     return replies_count > 0
@@ -134,35 +767,37 @@ def save_entity_info(entity_info: Entity, output_dir: Path) -> None:
         entity_info.to_json(fp, ensure_ascii=False, indent=2)
 
 
-def merge_messages_with_old(
-        messages_data: list[dict],
-        old_messages: dict[int, dict],
-        fetch_replies_mode: bool,
-) -> list[dict]:
-    result = old_messages.copy()
+def merge_message_with_old(fresh_message: dict, old_message: dict | None, fetch_replies_mode: bool) -> dict:
+    if old_message is None:
+        return fresh_message
 
-    for fresh_message in messages_data:
-        message_id = fresh_message["id"]
+    are_actual_replies_known = "reply_messages" in fresh_message or not is_message_have_replies(fresh_message)
+    if not fetch_replies_mode or not are_actual_replies_known:
+        old_replies = old_message.get("reply_messages", [])
+        fresh_message["reply_messages"] = old_replies
 
-        if message_id not in result:
-            result[message_id] = fresh_message
-            continue
+    if "reply_messages" in fresh_message and len(fresh_message["reply_messages"]) == 0:
+        del fresh_message["reply_messages"]
+
+    return fresh_message
 
-        are_actual_replies_known = "reply_messages" in fresh_message or not is_message_have_replies(fresh_message)
-        if not fetch_replies_mode or not are_actual_replies_known:
-            old_replies = result[message_id].get("reply_messages", [])
-            fresh_message["reply_messages"] = old_replies
 
-        if "reply_messages" in fresh_message and len(fresh_message["reply_messages"]) == 0:
-            del fresh_message["reply_messages"]
+def compose_entity_messages_path(
+        entity_info: Entity,
+        output_dir: Path,
+        storage_type: str = "jsonl",
+        compression: str | None = None,
+) -> Path:
+    file_path = output_dir / f"entity_{entity_info.id}_messages.{storage_type}"
 
-        result[message_id] = fresh_message
+    if storage_type == "jsonl" and compression:
+        file_path = file_path.with_name(file_path.name + COMPRESSION_SUFFIXES[compression])
 
-    return sorted(result.values(), key=lambda m: m["id"])
+    return file_path
 
 
-def compose_entity_messages_path(entity_info: Entity, output_dir: Path) -> Path:
-    return output_dir / f"entity_{entity_info.id}_messages.jsonl"
+def compose_sync_state_path(output_path: Path) -> Path:
+    return output_path.with_name(f"{output_path.name}.state")
 
 
 def find_audio_messages(messages: list[Message]) -> list[tuple[str, Message]]:
@@ -178,44 +813,23 @@ def find_audio_messages(messages: list[Message]) -> list[tuple[str, Message]]:
     return result
 
 
-async def download_audio_messages(audio_messages, audio_files_dir: Path) -> None:
+async def enqueue_audio_messages(audio_downloader: AudioDownloader, messages: list[Message]) -> None:
+    audio_messages = find_audio_messages(messages)
     print(f"Total {len(audio_messages)} voice messages to download")
 
     for file_name, message in audio_messages:
-        file_path = audio_files_dir / file_name
-
-        if file_path.exists():
-            continue
-
-        print(f"Downloading {file_name=}...")
-        await message.download_media(file_path, progress_callback=create_download_progress())
-
-
-def create_download_progress(notice_step: float = .1):
-    prev_notice: float | None = None
-
-    def func(current: int, total: int):
-        nonlocal prev_notice
-
-        percent = current / total
+        await audio_downloader.put(file_name, message)
 
-        if prev_notice is None or percent - prev_notice >= notice_step:
-            print(f'Downloaded {current} out of {total} bytes: {percent:.2%}')
-            prev_notice = percent
 
-    return func
+async def enqueue_replies_audio_messages(
+        audio_downloader: AudioDownloader,
+        messages_replies: dict[int, list[Message]],
+) -> None:
+    flat_replies = [reply for replies in messages_replies.values() for reply in replies]
+    await enqueue_audio_messages(audio_downloader, flat_replies)
 
 
-if __name__ == "__main__":
-    parser = ArgumentParser(description="Export messages from a Telegram channel, with replies and audio.")
-    parser.add_argument(
-        "chat_name",
-        help="channel name to extract messages from",
-    )
-    parser.add_argument(
-        "output_dir",
-        help="directory to dump results",
-    )
+def add_export_arguments(parser: ArgumentParser) -> None:
     parser.add_argument(
         "--preserve-old-data",
         help="merge new data with old data or fully override it",
@@ -228,16 +842,89 @@ if __name__ == "__main__":
         action=BooleanOptionalAction,
         default=False,
     )
+    parser.add_argument(
+        "--replies-strategy",
+        help="fetch replies thread by thread, or scan the linked discussion group of a channel at once",
+        choices=["threads", "discussion-group"],
+        default="threads",
+    )
+    parser.add_argument(
+        "--replies-concurrency",
+        help="number of reply threads fetched at the same time",
+        type=int,
+        default=4,
+    )
+    parser.add_argument(
+        "--requests-rate",
+        help="max number of API requests per second for fetching replies, it's lowered on flood waits",
+        type=float,
+        default=3.,
+    )
     parser.add_argument(
         "--fetch-voice-messages",
         help="download voice message files",
         action=BooleanOptionalAction,
         default=False,
     )
+    parser.add_argument(
+        "--download-concurrency",
+        help="number of voice message files downloaded at the same time",
+        type=int,
+        default=4,
+    )
     parser.add_argument(
         "--from-date",
         help="export messages from this date only (including)",
     )
+    parser.add_argument(
+        "--stream",
+        help="fetch and save messages by batches, resume an interrupted export from the last saved message",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--sync",
+        help="append only messages newer than the last saved one, without rewriting the output file",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--refresh-window",
+        help="fetch again only recent messages, to update their edits, reactions and replies, and merge them by ID:"
+             " a number of days like 14d, or a number of the latest message IDs",
+        type=parse_refresh_window,
+    )
+    parser.add_argument(
+        "--storage",
+        help="store messages in a JSONL file, or updated by batches (always resumable) in an SQLite database"
+             " or in a directory of monthly JSONL shards, where only shards with changed messages are rewritten",
+        choices=["jsonl", "sqlite", "shards"],
+        default="jsonl",
+    )
+    parser.add_argument(
+        "--compression",
+        help="compress the JSONL storage by frames, which can still be read from any message (zstd needs zstandard)",
+        choices=list(COMPRESSION_SUFFIXES),
+    )
+    parser.add_argument(
+        "--batch-size",
+        help="number of messages in a batch of the stream and sync modes, and of the SQLite storage",
+        type=int,
+        default=500,
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Export messages from a Telegram channel, with replies and audio.")
+    parser.add_argument(
+        "chat_name",
+        help="channel name to extract messages from",
+    )
+    parser.add_argument(
+        "output_dir",
+        help="directory to dump results",
+    )
+    add_export_arguments(parser)
 
     args = parser.parse_args()
 
@@ -0,0 +1,180 @@
+import asyncio
+from argparse import ArgumentParser, Namespace
+from datetime import date
+import json
+from pathlib import Path
+import re
+import time
+import traceback
+
+from telethon import TelegramClient
+
+from dump_chat import (
+    API_HASH,
+    API_ID,
+    SESSION_PATH,
+    add_export_arguments,
+    export_chat,
+    parse_refresh_window,
+)
+from lib import AdaptiveRateLimiter, save_json_file
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Options shared by the whole run, they cannot be set per chat
+GLOBAL_OPTIONS = {"config_file", "requests_rate", "chats_concurrency", "summary_file"}
+
+
+async def main(args):
+    chats = compose_chats_args(load_chats_config(Path(args.config_file)), args)
+
+    # One client and one rate limiter for all the chats, so the flood limits of the account are respected as a whole
+    rate_limiter = AdaptiveRateLimiter(args.requests_rate)
+    semaphore = asyncio.Semaphore(args.chats_concurrency)
+
+    async with TelegramClient(SESSION_PATH, API_ID, API_HASH) as client:
+        summaries = await asyncio.gather(*[
+            export_chat_with_summary(client, chat_args, rate_limiter, semaphore)
+            for chat_args in chats
+        ])
+
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    summary_path = Path(args.summary_file) if args.summary_file else Path(args.output_dir) / "dump_summary.json"
+    save_json_file(summary_path, {"chats": summaries, "flood_waits": rate_limiter.flood_waits})
+
+    for summary in summaries:
+        print(f"{summary['chat']}: {summary['status']}, {summary['messages']} messages in {summary['seconds']} s"
+              + (f", {summary['error']}" if "error" in summary else ""))
+    print(f"Summary saved to '{summary_path}'")
+
+
+async def export_chat_with_summary(
+        client,
+        args,
+        rate_limiter: AdaptiveRateLimiter,
+        semaphore: asyncio.Semaphore,
+) -> dict:
+    summary = {"chat": args.chat_name, "output_dir": args.output_dir, "status": "ok", "messages": 0}
+
+    async with semaphore:
+        started_at = time.perf_counter()
+        print(f"Exporting '{args.chat_name}'")
+
+        try:
+            output_dir = Path(args.output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            summary["messages"] = await export_chat(client, args.chat_name, output_dir, rate_limiter, args)
+        except Exception as e:
+            # A failed chat doesn't stop the others
+            traceback.print_exc()
+            summary["status"] = "failed"
+            summary["error"] = f"{type(e).__name__}: {e}"
+
+        summary["seconds"] = round(time.perf_counter() - started_at, 1)
+
+    return summary
+
+
+def load_chats_config(config_path: Path) -> dict:
+    with open(config_path, "r") as fp:
+        if config_path.suffix in (".yaml", ".yml"):
+            if yaml is None:
+                raise ValueError("PyYAML is required to read YAML configs, install it or use a JSON config")
+
+            config = yaml.safe_load(fp)
+        else:
+            config = json.load(fp)
+
+    # A plain list of chats is a config without defaults
+    if isinstance(config, list):
+        config = {"chats": config}
+
+    if not isinstance(config, dict) or not isinstance(config.get("chats"), list):
+        raise ValueError(f"{config_path}: expected a list of chats, or an object with a 'chats' list")
+
+    return config
+
+
+def compose_chats_args(config: dict, args) -> list[Namespace]:
+    # Options are taken from the command line, then from the config defaults, then from the chat itself
+    defaults = normalize_chat_options(config.get("defaults") or {}, args)
+
+    chats = []
+    for number, chat in enumerate(config["chats"], start=1):
+        if isinstance(chat, (str, int)):
+            chat = {"chat_name": chat}
+
+        if not isinstance(chat, dict) or not isinstance(chat.get("chat_name"), (str, int)) or chat["chat_name"] == "":
+            raise ValueError(f"Chat #{number} of the config has no chat_name: {chat!r}")
+
+        options = normalize_chat_options({key: value for key, value in chat.items() if key != "chat_name"}, args)
+        chat_args = Namespace(**{**vars(args), **defaults, **options, "chat_name": chat["chat_name"]})
+
+        # Every chat gets its own subdirectory by default, as entity files and audio files are shared otherwise
+        if "output_dir" not in options:
+            chat_args.output_dir = str(Path(args.output_dir) / compose_chat_dir_name(chat["chat_name"]))
+
+        chats.append(chat_args)
+
+    return chats
+
+
+def compose_chat_dir_name(chat_name: str | int) -> str:
+    # Chats can be given by links, and no name may lead out of the output directory
+    dir_name = re.sub(r"^(https?://)?(t|telegram)\.me/", "", str(chat_name))
+    dir_name = re.sub(r"[^\w.-]+", "_", dir_name).strip("._-")
+
+    if not dir_name:
+        raise ValueError(f"Cannot compose a directory name for chat {chat_name!r}, set its output_dir")
+
+    return dir_name
+
+
+def normalize_chat_options(options: dict, args) -> dict:
+    result = {}
+    for key, value in options.items():
+        key = key.replace("-", "_")
+
+        if key not in vars(args) or key in GLOBAL_OPTIONS:
+            raise ValueError(f"Unknown chat option: {key}")
+
+        # YAML parses unquoted dates by itself
+        if isinstance(value, date):
+            value = value.isoformat()
+        if key == "refresh_window" and value is not None:
+            value = parse_refresh_window(str(value))
+
+        result[key] = value
+
+    return result
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Export messages from many Telegram channels at once, listed in a config file.")
+    parser.add_argument(
+        "config_file",
+        help="YAML or JSON file with the list of chats and their options (like ../chats.yaml)",
+    )
+    parser.add_argument(
+        "output_dir",
+        help="directory to dump results, every chat goes to its own subdirectory",
+    )
+    add_export_arguments(parser)
+    parser.add_argument(
+        "--chats-concurrency",
+        help="number of chats exported at the same time",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--summary-file",
+        help="path to save the summary of the run (by default dump_summary.json in the output directory)",
+    )
+
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
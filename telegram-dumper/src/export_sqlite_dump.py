@@ -0,0 +1,32 @@
+from argparse import ArgumentParser
+import os
+
+from lib import (
+    SqliteMessageStorage,
+    save_jsonl_with_messages,
+)
+
+
+def main(args):
+    if not os.path.isfile(args.input_sqlite_file):
+        print('Input SQLite file not found')
+        return
+
+    with SqliteMessageStorage(args.input_sqlite_file) as storage:
+        save_jsonl_with_messages(args.output_jsonl_file, storage.iter_messages())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Export messages from an SQLite storage to a JSONL dump file.")
+    parser.add_argument(
+        "input_sqlite_file",
+        help="input SQLite file with messages",
+    )
+    parser.add_argument(
+        "output_jsonl_file",
+        help="output JSONL file with messages, in the same format as the JSONL storage of dump_chat.py",
+    )
+
+    args = parser.parse_args()
+
+    main(args)
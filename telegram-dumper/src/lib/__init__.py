@@ -1,30 +1,208 @@
+import base64
+from datetime import datetime
 import json
+import os
 from pathlib import Path
+from typing import Iterable, Iterator
 
 from telethon.tl.patched import Message
+from telethon.tl.tlobject import TLObject
+
+from .audio_downloader import AudioDownloader
+from .codec import dumps, loads, write_jsonl
+from .compression import decompress_frame, get_compression, get_jsonl_size, load_frames, open_jsonl, replace_jsonl
+from .json_stream import iter_json_array_items
+from .jsonl_index import JsonlMessageIndex, merge_jsonl_with_messages
+from .projection import Projection, compile_projection, load_projection_spec
+from .rate_limiter import AdaptiveRateLimiter
+from .storage import (
+    MessageStorage,
+    ShardedMessageStorage,
+    SqliteMessageStorage,
+    is_sharded_storage_path,
+    open_message_storage,
+)
+from .transcripts import TranscriptIndex, get_manifest_transcripts, is_manifest_transcript_actual, read_transcript
 
 
 def read_jsonl_with_messages(file_path: str | Path) -> dict[int, dict]:
     result = {}
-    try:
-        with open(file_path, "r") as fp:
-            for line in fp.readlines():
-                record = json.loads(line)
-                result[record["id"]] = record
-    except FileNotFoundError:
-        pass
+    for record in iter_jsonl_with_messages(file_path):
+        result[record["id"]] = record
 
     return result
 
 
-def save_jsonl_with_messages(file_path: str | Path, messages: dict[int, dict] | list[dict]) -> None:
+def iter_jsonl_with_messages(file_path: str | Path) -> Iterator[dict]:
+    if is_sharded_storage_path(file_path):
+        yield from ShardedMessageStorage(file_path).iter_messages()
+        return
+
+    try:
+        with open_jsonl(file_path) as fp:
+            for line in fp:
+                yield loads(line)
+    except FileNotFoundError:
+        return
+
+
+def save_jsonl_with_messages(file_path: str | Path, messages: dict[int, dict] | Iterable[dict]) -> None:
     if isinstance(messages, dict):
         messages = messages.values()
 
-    with open(file_path, "w") as fp:
-        for message in messages:
-            line = json.dumps(message, ensure_ascii=False)
-            fp.write(line + "\n")
+    if is_sharded_storage_path(file_path):
+        ShardedMessageStorage(file_path).replace_messages(messages)
+        return
+
+    temp_path = f"{file_path}.tmp"
+    with open_jsonl(temp_path, "wb", get_compression(file_path)) as fp:
+        write_jsonl(fp, messages)
+
+    replace_jsonl(temp_path, file_path)
+
+
+def iter_jsonl_chunks(file_path: str | Path, chunk_size: int = 4 * 1024 * 1024) -> Iterator[bytes]:
+    # Raw chunks of whole lines, to hand them over to other processes without parsing
+    if is_sharded_storage_path(file_path):
+        yield from _iter_sharded_storage_chunks(ShardedMessageStorage(file_path), chunk_size)
+        return
+
+    with open_jsonl(file_path) as fp:
+        while lines := fp.readlines(chunk_size):
+            yield b"".join(lines)
+
+
+def _iter_sharded_storage_chunks(storage: ShardedMessageStorage, chunk_size: int) -> Iterator[bytes]:
+    if not storage.is_ordered:
+        # Overlapping shards have to be merged by ID
+        chunk = []
+        size = 0
+        for message in storage.iter_messages():
+            line = dumps(message) + b"\n"
+            chunk.append(line)
+            size += len(line)
+
+            if size >= chunk_size:
+                yield b"".join(chunk)
+                chunk = []
+                size = 0
+
+        if chunk:
+            yield b"".join(chunk)
+        return
+
+    for shard_path in storage.iter_shard_paths():
+        yield from iter_jsonl_chunks(shard_path, chunk_size)
+
+
+def save_jsonl_chunks(file_path: str | Path, chunks: Iterable[bytes]) -> None:
+    if is_sharded_storage_path(file_path):
+        messages = (loads(line) for chunk in chunks for line in chunk.splitlines() if line.strip())
+        ShardedMessageStorage(file_path).replace_messages(messages)
+        return
+
+    temp_path = f"{file_path}.tmp"
+    with open_jsonl(temp_path, "wb", get_compression(file_path)) as fp:
+        for chunk in chunks:
+            fp.write(chunk)
+
+    replace_jsonl(temp_path, file_path)
+
+
+def append_jsonl_with_messages(file_path: str | Path, messages: Iterable[dict]) -> int:
+    with open_jsonl(file_path, "ab") as fp:
+        write_jsonl(fp, messages)
+
+        fp.flush()
+        os.fsync(fp.fileno())
+
+        return os.fstat(fp.fileno()).st_size
+
+
+def read_jsonl_tail(file_path: str | Path, chunk_size: int = 64 * 1024) -> tuple[dict | None, int]:
+    # Returns the last complete record and the file size without an incomplete trailing line
+    if get_compression(file_path):
+        return _read_compressed_jsonl_tail(file_path)
+
+    try:
+        fp = open(file_path, "rb")
+    except FileNotFoundError:
+        return None, 0
+
+    with fp:
+        end = fp.seek(0, os.SEEK_END)
+        tail = b""
+        position = end
+        while position > 0:
+            previous_position = position
+            position = max(position - chunk_size, 0)
+            fp.seek(position)
+            tail = fp.read(previous_position - position) + tail
+
+            lines = tail.split(b"\n")
+            # The last piece is either empty or an incomplete line, the first one may be cut by the chunk
+            complete_lines = [line for line in lines[(1 if position > 0 else 0):-1] if line.strip()]
+            if complete_lines:
+                return loads(complete_lines[-1]), end - len(lines[-1])
+
+        return None, 0
+
+
+def _read_compressed_jsonl_tail(file_path: str | Path) -> tuple[dict | None, int]:
+    # Frames hold whole lines, so frames are decompressed from the last one only until a record is found
+    compression = get_compression(file_path)
+    try:
+        frames = load_frames(file_path, compression)
+    except FileNotFoundError:
+        return None, 0
+
+    frame_starts = [compressed_offset for compressed_offset, _ in frames["offsets"]]
+    valid_size = frame_end = frames["file_size"]
+
+    with open(file_path, "rb") as fp:
+        for index in reversed(range(len(frame_starts))):
+            fp.seek(frame_starts[index])
+            data = fp.read(frame_end - frame_starts[index])
+            frame_end = frame_starts[index]
+
+            try:
+                data = decompress_frame(data, compression)
+            except EOFError:
+                # Only the last frame can be cut by an interrupted write, the file is valid up to its start
+                if index != len(frame_starts) - 1:
+                    raise
+
+                valid_size = frame_starts[index]
+                continue
+
+            lines = [line for line in data.split(b"\n")[:-1] if line.strip()]
+            if lines:
+                return loads(lines[-1]), valid_size
+
+    return None, valid_size
+
+
+def truncate_file(file_path: str | Path, size: int) -> None:
+    with open(file_path, "a") as fp:
+        fp.truncate(size)
+
+
+def read_json_file(file_path: str | Path) -> dict | None:
+    try:
+        with open(file_path, "r") as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return None
+
+
+def save_json_file(file_path: str | Path, data: dict) -> None:
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, "w") as fp:
+        json.dump(data, fp, ensure_ascii=False, indent=2)
+        fp.flush()
+        os.fsync(fp.fileno())
+
+    os.replace(temp_path, file_path)
 
 
 def data_get(d: dict, path: str) -> any:
@@ -50,36 +228,78 @@ def filter_dict(d: dict, fields_to_remove: set | list) -> None:
             del d[field]
 
 
+_JSON_SCALAR_TYPES = {str, int, float, bool, type(None)}
+
+
+def to_json_data(tl_object: TLObject) -> dict:
+    # Same result as `json.loads(tl_object.to_json())`, without the serialization round trip
+    return _make_json_safe(tl_object.to_dict())
+
+
+def _make_json_safe(value: any) -> any:
+    value_type = type(value)
+
+    if value_type in _JSON_SCALAR_TYPES:
+        return value
+
+    # `to_dict()` creates new containers, so they are updated in place
+    if value_type is dict:
+        for key, item in value.items():
+            if type(item) not in _JSON_SCALAR_TYPES:
+                value[key] = _make_json_safe(item)
+        return value
+
+    if value_type is list:
+        for index, item in enumerate(value):
+            if type(item) not in _JSON_SCALAR_TYPES:
+                value[index] = _make_json_safe(item)
+        return value
+
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (str, int, float)):
+        return value
+    if isinstance(value, dict):
+        return {key: _make_json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_make_json_safe(item) for item in value]
+
+    return repr(value)
+
+
 def compose_voice_message_file_name(message: Message | dict) -> str:
-    if not isinstance(message, dict):
-        message = message.to_dict()
+    if isinstance(message, dict):
+        peer, message_id = message["peer_id"], message["id"]
+    else:
+        peer, message_id = message.peer_id.to_dict(), message.id
 
-    return f"{_message_peer_to_string_id(message)}_msg_{message['id']}.oga"
+    return f"{_peer_to_string_id(peer)}_msg_{message_id}.oga"
 
 
-def _message_peer_to_string_id(message: dict) -> str | None:
-    if "channel_id" in message["peer_id"]:
-        return f"channel_{message['peer_id']['channel_id']}"
-    if "chat_id" in message["peer_id"]:
-        return f"chat_{message['peer_id']['chat_id']}"
-    if "user_id" in message["peer_id"]:
-        return f"user_{message['peer_id']['user_id']}"
+def _peer_to_string_id(peer: dict) -> str | None:
+    if "channel_id" in peer:
+        return f"channel_{peer['channel_id']}"
+    if "chat_id" in peer:
+        return f"chat_{peer['chat_id']}"
+    if "user_id" in peer:
+        return f"user_{peer['user_id']}"
 
     return None
 
 
 def get_voice_message_transcription(audio_path: Path) -> str | None:
-    transcript_path = audio_path.with_suffix(".txt")
-
-    if not audio_path.exists() or not transcript_path.exists():
+    if not audio_path.exists():
         return
 
-    with open(transcript_path, 'r') as fp:
-        transcription = fp.read()
+    transcript_path = audio_path.with_suffix(".txt")
 
-    transcription = transcription.strip()
+    record = get_manifest_transcripts(audio_path.parent).get(audio_path.name)
+    if record is not None and is_manifest_transcript_actual(record, transcript_path):
+        return record["transcript"]
 
-    if len(transcription) == 0:
+    if not transcript_path.exists():
         return
 
-    return transcription
+    return read_transcript(transcript_path)
@@ -0,0 +1,137 @@
+import asyncio
+import os
+from pathlib import Path
+import shutil
+
+from telethon.tl.patched import Message
+
+
+class AudioDownloader:
+    def __init__(self, audio_files_dir: Path, concurrency: int, queue_size: int = 0):
+        self.audio_files_dir = audio_files_dir
+        self.concurrency = concurrency
+
+        self.downloaded_counter = 0
+        self.linked_counter = 0
+        self.skipped_counter = 0
+        self.failed_counter = 0
+
+        self._queue: asyncio.Queue[tuple[str, Message]] = asyncio.Queue(queue_size)
+        self._workers: list[asyncio.Task] = []
+        # Forwarded voice messages share the same document, it's downloaded once
+        self._documents: dict[int, asyncio.Future[Path]] = {}
+
+    async def __aenter__(self):
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            await self._queue.join()
+
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+        if self.downloaded_counter or self.linked_counter or self.failed_counter:
+            print(f"Voice messages: {self.downloaded_counter} downloaded, {self.linked_counter} linked,"
+                  f" {self.skipped_counter} skipped, {self.failed_counter} failed")
+
+    async def put(self, file_name: str, message: Message) -> None:
+        await self._queue.put((file_name, message,))
+
+    async def _work(self) -> None:
+        while True:
+            file_name, message = await self._queue.get()
+
+            try:
+                await self._process(self.audio_files_dir / file_name, message)
+            except Exception as e:
+                self.failed_counter += 1
+                print(f"Failed to download {file_name=}: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, file_path: Path, message: Message) -> None:
+        document = message.document
+
+        if document.id in self._documents:
+            source_path = await self._documents[document.id]
+
+            if source_path == file_path or is_file_complete(file_path, document.size):
+                self.skipped_counter += 1
+            else:
+                link_file(source_path, file_path)
+                self.linked_counter += 1
+
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._documents[document.id] = future
+
+        try:
+            if is_file_complete(file_path, document.size):
+                self.skipped_counter += 1
+            else:
+                await download_document(message, file_path)
+                self.downloaded_counter += 1
+        except Exception as e:
+            del self._documents[document.id]
+            future.set_exception(e)
+            # Mark the exception as retrieved if nobody waits for the document
+            future.exception()
+            raise
+
+        future.set_result(file_path)
+
+
+async def download_document(message: Message, file_path: Path) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = file_path.with_name(f"{file_path.name}.part")
+
+    print(f"Downloading {file_path.name}...")
+    try:
+        await message.download_media(temp_path, progress_callback=create_download_progress())
+
+        downloaded_size = temp_path.stat().st_size
+        if downloaded_size != message.document.size:
+            raise RuntimeError(f"Downloaded {downloaded_size} bytes out of {message.document.size}")
+
+        os.replace(temp_path, file_path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def is_file_complete(file_path: Path, expected_size: int) -> bool:
+    try:
+        return file_path.stat().st_size == expected_size
+    except FileNotFoundError:
+        return False
+
+
+def link_file(source_path: Path, file_path: Path) -> None:
+    temp_path = file_path.with_name(f"{file_path.name}.part")
+
+    try:
+        os.link(source_path, temp_path)
+    except OSError:
+        shutil.copyfile(source_path, temp_path)
+
+    os.replace(temp_path, file_path)
+
+
+def create_download_progress(notice_step: float = .1):
+    prev_notice: float | None = None
+
+    def func(current: int, total: int):
+        nonlocal prev_notice
+
+        percent = current / total
+
+        if prev_notice is None or percent - prev_notice >= notice_step:
+            print(f'Downloaded {current} out of {total} bytes: {percent:.2%}')
+            prev_notice = percent
+
+    return func
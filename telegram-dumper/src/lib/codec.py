@@ -0,0 +1,61 @@
+import json
+from typing import BinaryIO, Iterable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+WRITE_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def stdlib_dumps(data: any) -> bytes:
+    # Compact separators, as orjson has no others. Dumps written before the codec have spaces after separators,
+    # so their lines differ byte for byte, while the data is the same.
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def stdlib_loads(data: bytes | str) -> any:
+    return json.loads(data)
+
+
+def orjson_dumps(data: any) -> bytes:
+    # Output is the same as of `stdlib_dumps`, except floats under 1e-4 or from 1e16 on: orjson prints them
+    # as 0.00001 and 1e16 where the stdlib prints 1e-05 and 1e+16. Both parse to the same floats.
+    try:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    except orjson.JSONEncodeError:
+        # Integers over 64 bits, lone surrogates, etc.
+        return stdlib_dumps(data)
+
+
+def orjson_loads(data: bytes | str) -> any:
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # NaN, Infinity, integers over 64 bits, etc.
+        return stdlib_loads(data)
+
+
+if orjson is not None:
+    dumps, loads = orjson_dumps, orjson_loads
+else:
+    dumps, loads = stdlib_dumps, stdlib_loads
+
+
+def write_jsonl(fp: BinaryIO, records: Iterable[any], chunk_size: int = WRITE_CHUNK_SIZE) -> None:
+    chunk = []
+    chunk_length = 0
+
+    for record in records:
+        line = dumps(record) + b"\n"
+        chunk.append(line)
+        chunk_length += len(line)
+
+        if chunk_length >= chunk_size:
+            fp.write(b"".join(chunk))
+            chunk = []
+            chunk_length = 0
+
+    if chunk:
+        fp.write(b"".join(chunk))
@@ -0,0 +1,308 @@
+from bisect import bisect_right
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+from typing import BinaryIO
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd"}
+# Lines are compressed by frames of about this size, every frame is decoded on its own, so readers can seek in a file
+FRAME_SIZE = 1024 * 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+READ_CHUNK_SIZE = 1024 * 1024
+# Lookups by an index read a line or a few, so the buffer is smaller than a frame
+READ_BUFFER_SIZE = 64 * 1024
+
+# Frames lists of the files read by this process, by path
+_frames_cache: dict[Path, dict] = {}
+
+
+def get_compression(file_path: str | Path) -> str | None:
+    return COMPRESSIONS.get(Path(file_path).suffix)
+
+
+def open_jsonl(file_path: str | Path, mode: str = "rb", compression: str | None = None) -> BinaryIO:
+    # The compression is detected by the extension, unless it's given for a temporary file
+    compression = compression or get_compression(file_path)
+    if compression is None:
+        return open(file_path, mode)
+
+    check_compression(compression)
+
+    if mode == "rb":
+        return io.BufferedReader(FramedReader(file_path, compression), READ_BUFFER_SIZE)
+    if mode in ("wb", "ab"):
+        return FramedWriter(file_path, compression, append=mode == "ab")
+
+    raise ValueError(f"Unsupported mode of compressed JSONL files: {mode}")
+
+
+def replace_jsonl(temp_path: str | Path, file_path: str | Path) -> None:
+    os.replace(temp_path, file_path)
+
+    if os.path.exists(compose_frames_path(temp_path)):
+        os.replace(compose_frames_path(temp_path), compose_frames_path(file_path))
+
+
+def get_jsonl_size(file_path: str | Path) -> int:
+    # Size of the decompressed content, which offsets of lines refer to
+    compression = get_compression(file_path)
+    if compression is None:
+        return os.stat(file_path).st_size
+
+    return load_frames(file_path, compression)["size"]
+
+
+def check_compression(compression: str) -> None:
+    if compression == "zstd" and zstandard is None:
+        raise ValueError("zstandard is required for .zst files, install it or use .gz files")
+
+
+def compose_frames_path(file_path: str | Path) -> Path:
+    file_path = Path(file_path)
+
+    return file_path.with_name(f"{file_path.name}.frames")
+
+
+def load_frames(file_path: str | Path, compression: str) -> dict:
+    # Returns {"offsets": [[compressed offset, decompressed offset], ...], "size": decompressed size}
+    file_path = Path(file_path).absolute()
+    file_stat = os.stat(file_path)
+
+    # Rewritten files are replaced atomically, so they get a new inode
+    def is_actual(frames: dict) -> bool:
+        return frames["inode"] == file_stat.st_ino and frames["file_size"] == file_stat.st_size
+
+    if file_path in _frames_cache and is_actual(_frames_cache[file_path]):
+        return _frames_cache[file_path]
+
+    try:
+        with open(compose_frames_path(file_path), "r") as fp:
+            frames = json.load(fp)
+
+        if not is_actual(frames):
+            frames = None
+    except (FileNotFoundError, ValueError, KeyError):
+        frames = None
+
+    if frames is None:
+        frames = save_frames(file_path, scan_frames(file_path, compression))
+
+    _frames_cache[file_path] = frames
+
+    return frames
+
+
+def save_frames(file_path: str | Path, frames: dict) -> dict:
+    file_stat = os.stat(file_path)
+    frames = {**frames, "inode": file_stat.st_ino, "file_size": file_stat.st_size}
+
+    frames_path = compose_frames_path(file_path)
+    temp_path = f"{frames_path}.tmp"
+    with open(temp_path, "w") as fp:
+        json.dump(frames, fp)
+
+    os.replace(temp_path, frames_path)
+
+    return frames
+
+
+def scan_frames(file_path: str | Path, compression: str) -> dict:
+    # Files written by other tools have no frames list, their frames are found by decompressing them once
+    offsets = []
+    compressed_offset = 0
+    size = 0
+
+    decompressor = None
+    with open(file_path, "rb") as fp:
+        while chunk := fp.read(READ_CHUNK_SIZE):
+            while chunk:
+                if decompressor is None:
+                    decompressor = create_decompressor(compression)
+                    offsets.append([compressed_offset, size])
+
+                size += len(decompressor.decompress(chunk))
+
+                if not decompressor.eof:
+                    compressed_offset += len(chunk)
+                    break
+
+                compressed_offset += len(chunk) - len(decompressor.unused_data)
+                chunk = decompressor.unused_data
+                decompressor = None
+
+    return {"offsets": offsets, "size": size}
+
+
+def decompress_frame(data: bytes, compression: str) -> bytes:
+    # Raises EOFError for a frame cut by an interrupted write
+    decompressor = create_decompressor(compression)
+    try:
+        result = decompressor.decompress(data)
+    except zlib.error as e:
+        raise EOFError(f"Compressed frame is damaged: {e}") from e
+    except Exception as e:
+        if zstandard is None or not isinstance(e, zstandard.ZstdError):
+            raise
+        raise EOFError(f"Compressed frame is damaged: {e}") from e
+
+    if not decompressor.eof:
+        raise EOFError("Compressed frame is incomplete")
+
+    return result
+
+
+def create_decompressor(compression: str):
+    if compression == "gzip":
+        return zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+class FramedReader(io.RawIOBase):
+    def __init__(self, file_path: str | Path, compression: str):
+        self.file_path = Path(file_path)
+        self.compression = compression
+
+        self._fp = open(file_path, "rb")
+        self._stream = self._open_stream()
+        self._position = 0
+        self._frames: dict | None = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._get_frames()["size"]
+
+        if 0 <= offset - self._position <= FRAME_SIZE:
+            # A short step forward is cheaper to decompress than to start a frame again
+            self._skip(offset - self._position)
+            return self._position
+
+        frames = self._get_frames()
+        index = bisect_right(frames["offsets"], offset, key=lambda frame_offsets: frame_offsets[1]) - 1
+        compressed_offset, self._position = frames["offsets"][index] if index >= 0 else (0, 0)
+
+        self._fp.seek(compressed_offset)
+        self._stream = self._open_stream()
+        self._skip(offset - self._position)
+
+        return self._position
+
+    def close(self) -> None:
+        if not self.closed:
+            self._fp.close()
+
+        super().close()
+
+    def _open_stream(self) -> BinaryIO:
+        # Decompress from the current position of the file, which is the start of a frame
+        if self.compression == "gzip":
+            return gzip.GzipFile(fileobj=self._fp, mode="rb")
+
+        return zstandard.ZstdDecompressor().stream_reader(self._fp, read_across_frames=True, closefd=False)
+
+    def _skip(self, length: int) -> None:
+        while length > 0:
+            data = self._stream.read(min(length, READ_CHUNK_SIZE))
+            if not data:
+                break
+
+            self._position += len(data)
+            length -= len(data)
+
+    def _get_frames(self) -> dict:
+        if self._frames is None:
+            self._frames = load_frames(self.file_path, self.compression)
+
+        return self._frames
+
+
+class FramedWriter:
+    def __init__(self, file_path: str | Path, compression: str, append: bool = False):
+        self.file_path = Path(file_path)
+        self.compression = compression
+
+        if append and self.file_path.exists():
+            self._frames = load_frames(file_path, compression)
+        else:
+            self._frames = {"offsets": [], "size": 0}
+
+        self._fp = open(file_path, "ab" if append else "wb")
+        self._buffer = bytearray()
+
+        if compression == "zstd":
+            self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+
+        while len(self._buffer) >= FRAME_SIZE:
+            # Frames end at line ends, so every frame holds whole lines
+            end = self._buffer.find(b"\n", FRAME_SIZE - 1) + 1
+            if end == 0:
+                break
+
+            self._write_frame(bytes(self._buffer[:end]))
+            del self._buffer[:end]
+
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._write_frame(bytes(self._buffer))
+            self._buffer.clear()
+
+        self._fp.flush()
+
+    def fileno(self) -> int:
+        return self._fp.fileno()
+
+    def close(self) -> None:
+        if self._fp.closed:
+            return
+
+        self.flush()
+        self._fp.close()
+        save_frames(self.file_path, self._frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _write_frame(self, data: bytes) -> None:
+        if self.compression == "gzip":
+            frame = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+        else:
+            frame = self._compressor.compress(data)
+
+        self._frames["offsets"].append([self._fp.tell(), self._frames["size"]])
+        self._frames["size"] += len(data)
+        self._fp.write(frame)
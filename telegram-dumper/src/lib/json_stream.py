@@ -0,0 +1,114 @@
+import json
+from typing import Iterator, TextIO
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACE = " \t\n\r"
+# A complete JSON value is followed by one of these characters
+_VALUE_DELIMITERS = _WHITESPACE + ",]}:"
+
+
+class JsonStreamReader:
+    def __init__(self, fp: TextIO, chunk_size: int = READ_CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._position = 0
+        self._is_eof = False
+
+    def next_char(self) -> str:
+        char = self.peek_char()
+        self._position += 1
+
+        return char
+
+    def peek_char(self) -> str:
+        while True:
+            while self._position < len(self._buffer) and self._buffer[self._position] in _WHITESPACE:
+                self._position += 1
+
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+
+            if not self._read():
+                raise ValueError("Unexpected end of JSON data")
+
+    def expect_char(self, expected: str) -> None:
+        char = self.next_char()
+
+        if char != expected:
+            raise ValueError(f"Expected {expected!r} but got {char!r} in JSON data")
+
+    def decode_value(self) -> any:
+        self.peek_char()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+
+            # Numbers and literals may be cut by the end of the buffer
+            if end == len(self._buffer) and not self._is_eof \
+                    or end < len(self._buffer) and self._buffer[end] not in _VALUE_DELIMITERS:
+                if self._read():
+                    continue
+
+            self._position = end
+
+            return value
+
+    def _read(self) -> bool:
+        if self._is_eof:
+            return False
+
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self._is_eof = True
+            return True
+
+        # Drop the consumed part, so the buffer doesn't grow with the input
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+
+        return True
+
+
+def iter_json_array_items(fp: TextIO, key: str, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[any]:
+    # Walks items of an array under the key of the top-level object, without loading the whole file
+    reader = JsonStreamReader(fp, chunk_size)
+    reader.expect_char("{")
+
+    if reader.peek_char() == "}":
+        return
+
+    while True:
+        field = reader.decode_value()
+        reader.expect_char(":")
+
+        if field != key:
+            reader.decode_value()
+        else:
+            reader.expect_char("[")
+
+            if reader.peek_char() == "]":
+                return
+
+            while True:
+                yield reader.decode_value()
+
+                char = reader.next_char()
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' but got {char!r} in JSON data")
+
+        char = reader.next_char()
+        if char == "}":
+            return
+        if char != ",":
+            raise ValueError(f"Expected ',' or '}}' but got {char!r} in JSON data")
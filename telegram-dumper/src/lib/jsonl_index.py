@@ -0,0 +1,241 @@
+from array import array
+from bisect import bisect_left
+import io
+import json
+import os
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+from .codec import dumps, loads
+from .compression import get_compression, get_jsonl_size, open_jsonl, replace_jsonl
+
+
+class JsonlMessageIndex:
+    def __init__(self, file_path: str | Path):
+        self.file_path = Path(file_path)
+        # Entries follow the order of lines in the file
+        self.ids = array("q")
+        self.offsets = array("q")
+        # Size of the file part with complete lines, which are indexed
+        self.indexed_size = 0
+
+        self._is_sorted: bool | None = None
+        self._offsets_by_id: dict[int, int] | None = None
+
+    @classmethod
+    def open(cls, file_path: str | Path) -> "JsonlMessageIndex":
+        index = cls(file_path)
+
+        if not index.file_path.exists():
+            return index
+
+        index_stat = index._load()
+        file_stat = os.stat(file_path)
+        # Offsets of compressed files refer to their decompressed content
+        file_size = get_jsonl_size(file_path)
+
+        # Rewritten files are replaced atomically, so they usually get a new inode. An inode can be reused though,
+        # so a file changed since the index has been saved is trusted only if its last indexed line is the same.
+        if index_stat is None \
+                or index_stat["inode"] != file_stat.st_ino \
+                or index.indexed_size > file_size \
+                or (index_stat.get("mtime_ns") != file_stat.st_mtime_ns and not index._is_last_line_indexed()):
+            index.ids, index.offsets, index.indexed_size = array("q"), array("q"), 0
+            index._scan()
+            index.save()
+        elif index.indexed_size < file_size:
+            # Lines are appended to the same file by the sync mode, index the new tail only
+            index._scan()
+            index.save()
+
+        return index
+
+    @property
+    def index_path(self) -> Path:
+        return compose_index_path(self.file_path)
+
+    @property
+    def is_sorted(self) -> bool:
+        if self._is_sorted is None:
+            self._is_sorted = all(self.ids[i] < self.ids[i + 1] for i in range(len(self.ids) - 1))
+
+        return self._is_sorted
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, message_id: int) -> bool:
+        return self._find_offset(message_id) is not None
+
+    def get(self, message_id: int) -> dict | None:
+        offset = self._find_offset(message_id)
+        if offset is None:
+            return None
+
+        with open_jsonl(self.file_path) as fp:
+            fp.seek(offset)
+            return loads(fp.readline())
+
+    def get_messages(self, message_ids: Iterable[int]) -> dict[int, dict]:
+        offsets = sorted(
+            (offset, message_id)
+            for message_id in message_ids
+            if (offset := self._find_offset(message_id)) is not None
+        )
+
+        result = {}
+        with open_jsonl(self.file_path) as fp:
+            for offset, message_id in offsets:
+                fp.seek(offset)
+                result[message_id] = loads(fp.readline())
+
+        return result
+
+    def iter_range(self, min_id: int, max_id: int) -> Iterator[dict]:
+        if not self.is_sorted:
+            raise ValueError(f"Messages in '{self.file_path}' are not sorted by ID")
+
+        start = bisect_left(self.ids, min_id)
+        if start == len(self.ids):
+            return
+
+        with open_jsonl(self.file_path) as fp:
+            fp.seek(self.offsets[start])
+            for message_id in self.ids[start:]:
+                if message_id > max_id:
+                    break
+
+                yield loads(fp.readline())
+
+    def iter_raw_lines(self, fp: BinaryIO) -> Iterator[tuple[int, bytes]]:
+        for message_id, offset in zip(self.ids, self.offsets):
+            fp.seek(offset)
+            yield message_id, fp.readline()
+
+    def save(self) -> None:
+        file_stat = os.stat(self.file_path)
+        header = {
+            "inode": file_stat.st_ino,
+            "mtime_ns": file_stat.st_mtime_ns,
+            "size": self.indexed_size,
+            "count": len(self.ids),
+        }
+
+        temp_path = f"{self.index_path}.tmp"
+        with open(temp_path, "wb") as fp:
+            fp.write(json.dumps(header).encode() + b"\n")
+            self.ids.tofile(fp)
+            self.offsets.tofile(fp)
+
+        os.replace(temp_path, self.index_path)
+
+    def _load(self) -> dict | None:
+        try:
+            with open(self.index_path, "rb") as fp:
+                header = json.loads(fp.readline())
+                self.ids.fromfile(fp, header["count"])
+                self.offsets.fromfile(fp, header["count"])
+                self.indexed_size = header["size"]
+        except (FileNotFoundError, EOFError, ValueError, KeyError):
+            self.ids, self.offsets, self.indexed_size = array("q"), array("q"), 0
+            return None
+
+        return header
+
+    def _is_last_line_indexed(self) -> bool:
+        if not self.ids:
+            return self.indexed_size == 0
+
+        with open_jsonl(self.file_path) as fp:
+            fp.seek(self.offsets[-1])
+            line = fp.readline()
+
+        try:
+            return line.endswith(b"\n") \
+                and self.offsets[-1] + len(line) <= self.indexed_size \
+                and loads(line)["id"] == self.ids[-1]
+        except (ValueError, KeyError, TypeError):
+            return False
+
+    def _scan(self) -> None:
+        with open_jsonl(self.file_path) as fp:
+            fp.seek(self.indexed_size)
+
+            for line in fp:
+                # An incomplete line of an interrupted append is indexed when it's completed
+                if not line.endswith(b"\n"):
+                    break
+
+                if line.strip():
+                    self.ids.append(loads(line)["id"])
+                    self.offsets.append(self.indexed_size)
+
+                self.indexed_size += len(line)
+
+        self._is_sorted = None
+        self._offsets_by_id = None
+
+    def _find_offset(self, message_id: int) -> int | None:
+        if self._offsets_by_id is None and not self.is_sorted:
+            self._offsets_by_id = dict(zip(self.ids, self.offsets))
+
+        if self._offsets_by_id is not None:
+            return self._offsets_by_id.get(message_id)
+
+        position = bisect_left(self.ids, message_id)
+        if position < len(self.ids) and self.ids[position] == message_id:
+            return self.offsets[position]
+
+        return None
+
+
+def compose_index_path(file_path: str | Path) -> Path:
+    file_path = Path(file_path)
+
+    return file_path.with_name(f"{file_path.name}.idx")
+
+
+def merge_jsonl_with_messages(
+        file_path: str | Path,
+        fresh_messages: Iterable[dict],
+        merge: Callable[[dict, dict], dict],
+) -> None:
+    # Fresh messages must be sorted by ID, unchanged old lines are copied without parsing
+    index = JsonlMessageIndex.open(file_path)
+    if not index.is_sorted:
+        raise ValueError(f"Messages in '{file_path}' are not sorted by ID")
+
+    new_index = JsonlMessageIndex(file_path)
+
+    def write(fp: BinaryIO, message_id: int, line: bytes) -> None:
+        new_index.ids.append(message_id)
+        new_index.offsets.append(new_index.indexed_size)
+        fp.write(line)
+        new_index.indexed_size += len(line)
+
+    def dump(message: dict) -> bytes:
+        return dumps(message) + b"\n"
+
+    temp_path = f"{file_path}.tmp"
+    input_fp = open_jsonl(file_path) if index.file_path.exists() else io.BytesIO()
+    with open_jsonl(temp_path, "wb", get_compression(file_path)) as output_fp, input_fp:
+        old_lines = index.iter_raw_lines(input_fp)
+        fresh_messages = iter(fresh_messages)
+
+        old_id, old_line = next(old_lines, (None, None))
+        fresh_message = next(fresh_messages, None)
+
+        while fresh_message is not None or old_id is not None:
+            if old_id is None or (fresh_message is not None and fresh_message["id"] < old_id):
+                write(output_fp, fresh_message["id"], dump(fresh_message))
+                fresh_message = next(fresh_messages, None)
+            elif fresh_message is None or old_id < fresh_message["id"]:
+                write(output_fp, old_id, old_line if old_line.endswith(b"\n") else old_line + b"\n")
+                old_id, old_line = next(old_lines, (None, None))
+            else:
+                write(output_fp, old_id, dump(merge(fresh_message, loads(old_line))))
+                fresh_message = next(fresh_messages, None)
+                old_id, old_line = next(old_lines, (None, None))
+
+    replace_jsonl(temp_path, file_path)
+    new_index.save()
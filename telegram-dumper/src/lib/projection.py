@@ -0,0 +1,122 @@
+import json
+from pathlib import Path
+from typing import Callable
+
+# Called with the root message and the projected field value
+ProjectionHook = Callable[[dict, any], None]
+Projection = Callable[[dict], dict]
+
+_Transform = Callable[[any, dict | None], any]
+
+_NODE_KEYS = {"when_type", "drop", "drop_none", "fields"}
+
+
+def load_projection_spec(file_path: str | Path) -> dict:
+    with open(file_path, "r") as fp:
+        return json.load(fp)
+
+
+def compile_projection(spec: dict, hooks: dict[str, ProjectionHook] | None = None) -> Projection:
+    # Spec maps message types (the "_" field) to node specs, "*" is used for other types
+    hooks = hooks or {}
+    nodes = {message_type: _compile_node(node_spec, hooks) for message_type, node_spec in spec.items()}
+    default_node = nodes.get("*")
+
+    def project(message: dict) -> dict:
+        node = nodes.get(message.get("_"), default_node)
+        if node is None:
+            return message
+
+        return node(message, None)
+
+    return project
+
+
+def _compile_node(spec: dict, hooks: dict[str, ProjectionHook]) -> _Transform:
+    when_types = frozenset(_as_list(spec["when_type"])) if "when_type" in spec else None
+    drop = frozenset(spec.get("drop", ()))
+    drop_none = spec.get("drop_none", False)
+
+    # Fields are transformed in the order of the spec, so a hook sees the fields before it already transformed
+    steps: list[tuple[str, _Transform | None, ProjectionHook | None]] = []
+    for key, field_spec in spec.get("fields", {}).items():
+        hook = None
+        if "hook" in field_spec:
+            if field_spec["hook"] not in hooks:
+                raise ValueError(f"Unknown projection hook: {field_spec['hook']}")
+            hook = hooks[field_spec["hook"]]
+
+        steps.append((key, _compile_field(field_spec, hooks), hook,))
+
+    def transform_node(value: dict, root: dict | None) -> dict:
+        if when_types is not None and value.get("_") not in when_types:
+            return value
+
+        # Building a new dict in one comprehension is several times faster than deleting keys in place
+        if drop_none:
+            result = {key: item for key, item in value.items() if item is not None and key not in drop}
+        else:
+            result = {key: item for key, item in value.items() if key not in drop}
+
+        if root is None:
+            root = result
+
+        for key, transform, hook in steps:
+            item = result.get(key)
+            if not item:
+                continue
+
+            if transform is not None:
+                item = result[key] = transform(item, root)
+            if hook is not None and item:
+                hook(root, item)
+
+        return result
+
+    return transform_node
+
+
+def _compile_field(spec: dict, hooks: dict[str, ProjectionHook]) -> _Transform | None:
+    if "pick" in spec:
+        pick_key = spec["pick"]
+
+        return lambda value, root: value[pick_key]
+
+    if "pick_by_type" in spec:
+        pick_keys = spec["pick_by_type"]
+
+        def pick_by_type(value: dict, root: dict) -> any:
+            if value["_"] not in pick_keys:
+                raise ValueError(f"Unknown type: {value['_']}")
+
+            return value[pick_keys[value["_"]]]
+
+        return pick_by_type
+
+    if spec.get("collapse_reactions"):
+        return _collapse_reactions
+
+    if "each" in spec:
+        item_node = _compile_node(spec["each"], hooks)
+
+        return lambda value, root: [item_node(item, root) for item in value]
+
+    if _NODE_KEYS & spec.keys():
+        return _compile_node(spec, hooks)
+
+    return None
+
+
+def _collapse_reactions(value: dict, root: dict) -> dict:
+    result = {}
+    for reaction_model in value["results"]:
+        if reaction_model["reaction"]["_"] == "ReactionEmoji":
+            result[reaction_model["reaction"]["emoticon"]] = reaction_model["count"]
+        elif reaction_model["reaction"]["_"] == "ReactionCustomEmoji":
+            result[reaction_model["reaction"]["document_id"]] = reaction_model["count"]
+
+    return result
+
+
+def _as_list(value: str | list[str]) -> list[str]:
+    return [value] if isinstance(value, str) else value
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from telethon.errors import FloodWaitError
+
+T = TypeVar("T")
+
+
+class AdaptiveRateLimiter:
+    def __init__(
+            self,
+            max_rate: float,
+            min_rate: float = .1,
+            backoff_factor: float = .5,
+            recovery_factor: float = 1.1,
+            max_retries: int = 5,
+    ):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.backoff_factor = backoff_factor
+        self.recovery_factor = recovery_factor
+        self.max_retries = max_retries
+
+        self.rate = max_rate
+        self.flood_waits = 0
+
+        self._tokens = 1.
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+
+                # The bucket holds one token at most, so requests don't come in bursts after a pause
+                self._tokens = min(1., self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1.:
+                    self._tokens -= 1.
+                    return
+
+                await asyncio.sleep((1. - self._tokens) / self.rate)
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate * self.recovery_factor)
+
+    def on_flood_wait(self, seconds: int) -> None:
+        self.flood_waits += 1
+        self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        retries = 0
+        while True:
+            await self.acquire()
+
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise
+
+                self.on_flood_wait(e.seconds)
+                print(f"Flood wait for {e.seconds} seconds, slow down to {self.rate:.2f} requests/s")
+                continue
+
+            self.on_success()
+
+            return result
@@ -0,0 +1,429 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+import hashlib
+import heapq
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+from typing import Iterable, Iterator
+
+from .codec import dumps, loads
+
+SHARDED_STORAGE_SUFFIX = ".shards"
+SHARDS_MANIFEST_FILE_NAME = "manifest.json"
+# Files written by the storage, other files of the directory are never touched
+SHARD_FILE_NAME_PATTERN = re.compile(r"(\d{4}-\d{2}|undated)-[0-9a-f]{16}\.jsonl(\.tmp)?")
+
+
+class MessageStorage(ABC):
+    def get(self, message_id: int) -> dict | None:
+        return self.get_messages([message_id]).get(message_id)
+
+    @abstractmethod
+    def get_messages(self, message_ids: Iterable[int]) -> dict[int, dict]:
+        ...
+
+    @abstractmethod
+    def get_max_id(self) -> int:
+        ...
+
+    @abstractmethod
+    def iter_messages(self) -> Iterator[dict]:
+        ...
+
+    @abstractmethod
+    def save_messages(self, messages: Iterable[dict], meta: dict[str, any] | None = None) -> None:
+        ...
+
+    @abstractmethod
+    def get_meta(self, key: str) -> any:
+        ...
+
+    @abstractmethod
+    def delete_meta(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SqliteMessageStorage(MessageStorage):
+    def __init__(self, file_path: str | Path):
+        self.connection = sqlite3.connect(file_path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS reply_messages (
+                    message_id INTEGER NOT NULL,
+                    id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (message_id, id)
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+
+    def get_messages(self, message_ids: Iterable[int]) -> dict[int, dict]:
+        message_ids = list(message_ids)
+        result = {}
+
+        # Keep the number of query parameters under the SQLite limit
+        for start in range(0, len(message_ids), 500):
+            chunk = message_ids[start:start + 500]
+            placeholders = ", ".join("?" * len(chunk))
+
+            rows = self.connection.execute(
+                f"SELECT id, data FROM messages WHERE id IN ({placeholders})",
+                chunk,
+            )
+            for message_id, data in rows:
+                result[message_id] = loads(data)
+
+            rows = self.connection.execute(
+                f"SELECT message_id, data FROM reply_messages WHERE message_id IN ({placeholders}) ORDER BY message_id, id",
+                chunk,
+            )
+            for message_id, data in rows:
+                result[message_id].setdefault("reply_messages", []).append(loads(data))
+
+        return result
+
+    def get_max_id(self) -> int:
+        (max_id,) = self.connection.execute("SELECT MAX(id) FROM messages").fetchone()
+
+        return max_id or 0
+
+    def iter_messages(self) -> Iterator[dict]:
+        messages = self.connection.execute("SELECT id, data FROM messages ORDER BY id")
+        replies = self.connection.execute("SELECT message_id, data FROM reply_messages ORDER BY message_id, id")
+
+        reply = next(replies, None)
+        for message_id, data in messages:
+            message = loads(data)
+
+            # Both cursors are sorted by message ID, so replies are joined in one pass
+            while reply is not None and reply[0] <= message_id:
+                if reply[0] == message_id:
+                    message.setdefault("reply_messages", []).append(loads(reply[1]))
+                reply = next(replies, None)
+
+            yield message
+
+    def save_messages(self, messages: Iterable[dict], meta: dict[str, any] | None = None) -> None:
+        with self.connection:
+            for message in messages:
+                message = message.copy()
+                reply_messages = message.pop("reply_messages", [])
+
+                self.connection.execute(
+                    "INSERT INTO messages (id, data) VALUES (?, ?)"
+                    " ON CONFLICT (id) DO UPDATE SET data = excluded.data",
+                    (message["id"], dumps(message).decode()),
+                )
+
+                self.connection.execute("DELETE FROM reply_messages WHERE message_id = ?", (message["id"],))
+                self.connection.executemany(
+                    "INSERT INTO reply_messages (message_id, id, data) VALUES (?, ?, ?)",
+                    [(message["id"], reply["id"], dumps(reply).decode()) for reply in reply_messages],
+                )
+
+            for key, value in (meta or {}).items():
+                self.connection.execute(
+                    "INSERT INTO meta (key, value) VALUES (?, ?)"
+                    " ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                    (key, dumps(value).decode()),
+                )
+
+    def get_meta(self, key: str) -> any:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+
+        return loads(row[0]) if row else None
+
+    def delete_meta(self, key: str) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM meta WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM messages")
+            self.connection.execute("DELETE FROM reply_messages")
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class ShardedMessageStorage(MessageStorage):
+    # A directory with a JSONL file of messages per month and a manifest of them. Shard files are never changed:
+    # a rewritten shard gets a new file, and the manifest replaced afterwards switches to it atomically.
+    def __init__(self, directory: str | Path):
+        self.directory = Path(directory)
+
+        try:
+            with open(self.directory / SHARDS_MANIFEST_FILE_NAME, "r") as fp:
+                manifest = json.load(fp)
+        except FileNotFoundError:
+            manifest = {"shards": {}, "meta": {}}
+
+        # Shard key -> {"file", "min_id", "max_id", "count", "sha256"}
+        self.shards: dict[str, dict] = manifest["shards"]
+        self.meta: dict[str, any] = manifest["meta"]
+
+        # The last read shard, as a batch is usually read and then saved to the same shard
+        self._cached_shard: tuple[str, dict[int, dict]] | None = None
+
+    @property
+    def is_ordered(self) -> bool:
+        # Months follow the order of IDs, unless dates of messages are unusual
+        shards = self._sorted_shards()
+
+        return all(shards[i]["max_id"] < shards[i + 1]["min_id"] for i in range(len(shards) - 1))
+
+    def get_messages(self, message_ids: Iterable[int]) -> dict[int, dict]:
+        message_ids = sorted(set(message_ids))
+        result = {}
+
+        for key, shard in self.shards.items():
+            start = bisect_left(message_ids, shard["min_id"])
+            end = bisect_right(message_ids, shard["max_id"])
+            if start == end:
+                continue
+
+            messages = self._read_shard(key)
+            for message_id in message_ids[start:end]:
+                if message_id in messages:
+                    result[message_id] = messages[message_id]
+
+        return result
+
+    def get_max_id(self) -> int:
+        return max((shard["max_id"] for shard in self.shards.values()), default=0)
+
+    def iter_messages(self) -> Iterator[dict]:
+        group = []
+        group_max_id = None
+
+        # Shards with overlapping ID ranges are merged, the others are read one by one
+        for shard in self._sorted_shards():
+            if group and shard["min_id"] > group_max_id:
+                yield from self._iter_group_messages(group)
+                group = []
+
+            group.append(shard)
+            group_max_id = max(group_max_id, shard["max_id"]) if len(group) > 1 else shard["max_id"]
+
+        yield from self._iter_group_messages(group)
+
+    def iter_shard_paths(self) -> Iterator[Path]:
+        for shard in self._sorted_shards():
+            yield self.directory / shard["file"]
+
+    def save_messages(self, messages: Iterable[dict], meta: dict[str, any] | None = None) -> None:
+        shards_messages: dict[str, list[dict]] = {}
+        for message in messages:
+            shards_messages.setdefault(compose_shard_key(message), []).append(message)
+
+        self._remove_moved_messages(shards_messages)
+
+        # Only the shards with the saved messages are rewritten
+        for key, new_messages in shards_messages.items():
+            shard_messages = dict(self._read_shard(key)) if key in self.shards else {}
+            for message in new_messages:
+                shard_messages[message["id"]] = message
+
+            self._write_shard(key, shard_messages)
+
+        self.meta.update(meta or {})
+        self._save_manifest()
+
+    def _remove_moved_messages(self, shards_messages: dict[str, list[dict]]) -> None:
+        # A message is in the shard of another month only if its date has changed, which is rare
+        message_keys = {message["id"]: key for key, messages in shards_messages.items() for message in messages}
+        message_ids = sorted(message_keys)
+
+        for key, shard in list(self.shards.items()):
+            start = bisect_left(message_ids, shard["min_id"])
+            end = bisect_right(message_ids, shard["max_id"])
+
+            moved_ids = [message_id for message_id in message_ids[start:end] if message_keys[message_id] != key]
+            if not moved_ids:
+                continue
+
+            shard_messages = dict(self._read_shard(key))
+            if not any(message_id in shard_messages for message_id in moved_ids):
+                continue
+
+            for message_id in moved_ids:
+                shard_messages.pop(message_id, None)
+
+            if shard_messages:
+                self._write_shard(key, shard_messages)
+            else:
+                del self.shards[key]
+                self._cached_shard = None
+
+    def replace_messages(self, messages: Iterable[dict]) -> None:
+        # Messages sorted by ID come month by month, so only one shard is kept in memory
+        self.shards = {}
+        self._cached_shard = None
+
+        key = None
+        shard_messages: dict[int, dict] = {}
+        for message in messages:
+            message_key = compose_shard_key(message)
+
+            if message_key != key:
+                if key is not None:
+                    self._write_shard(key, shard_messages)
+
+                key = message_key
+                shard_messages = dict(self._read_shard(key)) if key in self.shards else {}
+
+            shard_messages[message["id"]] = message
+
+        if key is not None:
+            self._write_shard(key, shard_messages)
+
+        self._save_manifest()
+
+    def get_meta(self, key: str) -> any:
+        return self.meta.get(key)
+
+    def delete_meta(self, key: str) -> None:
+        if key in self.meta:
+            del self.meta[key]
+            self._save_manifest()
+
+    def clear(self) -> None:
+        self.shards = {}
+        self._cached_shard = None
+        self._save_manifest()
+
+    def _sorted_shards(self) -> list[dict]:
+        return sorted(self.shards.values(), key=lambda shard: (shard["min_id"], shard["max_id"]))
+
+    def _iter_group_messages(self, shards: list[dict]) -> Iterator[dict]:
+        if len(shards) == 1:
+            yield from self._iter_shard_file(shards[0])
+        elif shards:
+            yield from heapq.merge(*[self._iter_shard_file(shard) for shard in shards], key=lambda m: m["id"])
+
+    def _iter_shard_file(self, shard: dict) -> Iterator[dict]:
+        # Lines are hashed as they are read, so a damaged shard fails the iteration at its end
+        digest = hashlib.sha256()
+        with open(self.directory / shard["file"], "rb") as fp:
+            for line in fp:
+                digest.update(line)
+                yield loads(line)
+
+        self._check_digest(shard, digest.hexdigest())
+
+    def _read_shard(self, key: str) -> dict[int, dict]:
+        if self._cached_shard is not None and self._cached_shard[0] == key:
+            return self._cached_shard[1]
+
+        shard = self.shards[key]
+        with open(self.directory / shard["file"], "rb") as fp:
+            data = fp.read()
+
+        self._check_digest(shard, hashlib.sha256(data).hexdigest())
+
+        messages = {}
+        for line in data.splitlines():
+            message = loads(line)
+            messages[message["id"]] = message
+
+        self._cached_shard = (key, messages,)
+
+        return messages
+
+    def _check_digest(self, shard: dict, digest: str) -> None:
+        if digest != shard["sha256"]:
+            raise ValueError(f"Shard '{self.directory / shard['file']}' doesn't match its checksum")
+
+    def _write_shard(self, key: str, messages: dict[int, dict]) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        message_ids = sorted(messages)
+        data = b"".join(dumps(messages[message_id]) + b"\n" for message_id in message_ids)
+        digest = hashlib.sha256(data).hexdigest()
+
+        # The name depends on the content, so the file of the current manifest is never overwritten
+        file_name = f"{key}-{digest[:16]}.jsonl"
+        temp_path = self.directory / f"{file_name}.tmp"
+        with open(temp_path, "wb") as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(temp_path, self.directory / file_name)
+
+        self.shards[key] = {
+            "file": file_name,
+            "min_id": message_ids[0],
+            "max_id": message_ids[-1],
+            "count": len(message_ids),
+            "sha256": digest,
+        }
+        self._cached_shard = (key, messages,)
+
+    def _save_manifest(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        manifest_path = self.directory / SHARDS_MANIFEST_FILE_NAME
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, "w") as fp:
+            json.dump({"shards": dict(sorted(self.shards.items())), "meta": self.meta}, fp, ensure_ascii=False, indent=2)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+        os.replace(temp_path, manifest_path)
+
+        # Replaced shards, and files left by an interrupted write
+        shard_files = {shard["file"] for shard in self.shards.values()}
+        for path in self.directory.iterdir():
+            if SHARD_FILE_NAME_PATTERN.fullmatch(path.name) and path.name not in shard_files:
+                path.unlink()
+
+
+def compose_shard_key(message: dict) -> str:
+    # Dates are ISO strings in dumps of both the API and Telegram Desktop
+    date = message.get("date")
+
+    return date[:7] if isinstance(date, str) and len(date) >= 7 else "undated"
+
+
+def is_sharded_storage_path(file_path: str | Path) -> bool:
+    return Path(file_path).suffix == SHARDED_STORAGE_SUFFIX
+
+
+def open_message_storage(file_path: str | Path) -> MessageStorage:
+    if Path(file_path).suffix in {".sqlite", ".sqlite3", ".db"}:
+        return SqliteMessageStorage(file_path)
+    if is_sharded_storage_path(file_path):
+        return ShardedMessageStorage(file_path)
+
+    raise ValueError(f"Unknown message storage type: {file_path}")
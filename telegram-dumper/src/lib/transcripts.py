@@ -0,0 +1,192 @@
+import json
+import os
+from pathlib import Path
+
+# Written by the stt scripts into every audio directory, a JSONL file with a record per transcribed file
+MANIFEST_FILE_NAME = "transcripts.jsonl"
+
+# Manifest transcripts of the directories read by this process, with the (size, mtime_ns) of their manifests
+_manifest_transcripts_cache: dict[Path, tuple[tuple[int, int], dict[str, dict]]] = {}
+
+
+class DirectoryTranscripts:
+    def __init__(self, directory: Path, use_cache: bool):
+        self.directory = directory
+        self.use_cache = use_cache
+
+        self.mtime_ns: int | None = None
+        self.file_names: set[str] = set()
+        self.transcripts: dict[str, str | None] = {}
+        # (size, mtime_ns) of every cached transcript, as in-place edits don't change the directory mtime
+        self.transcript_stats: dict[str, list[int]] = {}
+        self.is_changed = False
+        # The cache is kept outside the directory, so writing it doesn't change the directory mtime
+        self.cache_path = directory.parent / f"{directory.name}.transcripts.json"
+
+        if not self.use_cache or not self._load_cache():
+            self._scan()
+
+    def get(self, audio_file_name: str) -> str | None:
+        if audio_file_name not in self.file_names:
+            return None
+
+        transcript_name = Path(audio_file_name).with_suffix(".txt").name
+        transcript_path = self.directory / transcript_name
+
+        # Appending to the manifest doesn't change the directory mtime, so it isn't cached here
+        if MANIFEST_FILE_NAME in self.file_names:
+            record = get_manifest_transcripts(self.directory).get(audio_file_name)
+            if record is not None and is_manifest_transcript_actual(record, transcript_path):
+                return record["transcript"]
+
+        if transcript_name not in self.file_names:
+            return None
+
+        try:
+            transcript_stat = os.stat(transcript_path)
+        except FileNotFoundError:
+            return None
+
+        stat = [transcript_stat.st_size, transcript_stat.st_mtime_ns]
+        if transcript_name not in self.transcripts or self.transcript_stats.get(transcript_name) != stat:
+            self.transcripts[transcript_name] = read_transcript(transcript_path)
+            self.transcript_stats[transcript_name] = stat
+            self.is_changed = True
+
+        return self.transcripts[transcript_name]
+
+    def load_all(self) -> None:
+        for file_name in self.file_names:
+            if file_name.endswith(".txt"):
+                self.get(file_name)
+
+    def save_cache(self) -> None:
+        if not self.use_cache or not self.is_changed or self.mtime_ns is None:
+            return
+
+        cache = {
+            "mtime_ns": self.mtime_ns,
+            "file_names": sorted(self.file_names),
+            "transcripts": self.transcripts,
+            "transcript_stats": self.transcript_stats,
+        }
+
+        temp_path = f"{self.cache_path}.tmp"
+        with open(temp_path, "w") as fp:
+            json.dump(cache, fp, ensure_ascii=False)
+
+        os.replace(temp_path, self.cache_path)
+        self.is_changed = False
+
+    def _scan(self) -> None:
+        try:
+            self.mtime_ns = os.stat(self.directory).st_mtime_ns
+            with os.scandir(self.directory) as entries:
+                self.file_names = {entry.name for entry in entries}
+        except FileNotFoundError:
+            self.mtime_ns = None
+            self.file_names = set()
+
+        self.transcripts = {}
+        self.transcript_stats = {}
+        self.is_changed = True
+
+    def _load_cache(self) -> bool:
+        # Any added, removed or renamed file changes the directory mtime, in-place edits of transcripts are found by
+        # their own stats
+        try:
+            with open(self.cache_path, "r") as fp:
+                cache = json.load(fp)
+
+            if cache["mtime_ns"] != os.stat(self.directory).st_mtime_ns:
+                return False
+        except (FileNotFoundError, ValueError, KeyError):
+            return False
+
+        self.mtime_ns = cache["mtime_ns"]
+        self.file_names = set(cache["file_names"])
+        self.transcripts = cache["transcripts"]
+        self.transcript_stats = cache["transcript_stats"]
+
+        return True
+
+
+class TranscriptIndex:
+    def __init__(self, use_cache: bool = False):
+        self.use_cache = use_cache
+
+        self._directories: dict[Path, DirectoryTranscripts] = {}
+
+    def get(self, audio_path: Path) -> str | None:
+        return self.get_directory(audio_path.parent).get(audio_path.name)
+
+    def get_directory(self, directory: Path) -> DirectoryTranscripts:
+        if directory not in self._directories:
+            self._directories[directory] = DirectoryTranscripts(directory, self.use_cache)
+
+        return self._directories[directory]
+
+    def save_cache(self) -> None:
+        for directory in self._directories.values():
+            directory.save_cache()
+
+
+def get_manifest_transcripts(directory: Path) -> dict[str, dict]:
+    # The stt scripts append to the manifest while a dump runs, so it's read again when its stats change
+    directory = directory.absolute()
+    try:
+        manifest_stat = os.stat(directory / MANIFEST_FILE_NAME)
+    except FileNotFoundError:
+        return {}
+
+    stat = (manifest_stat.st_size, manifest_stat.st_mtime_ns)
+    if directory not in _manifest_transcripts_cache or _manifest_transcripts_cache[directory][0] != stat:
+        _manifest_transcripts_cache[directory] = (stat, read_manifest_transcripts(directory))
+
+    return _manifest_transcripts_cache[directory][1]
+
+
+def read_manifest_transcripts(directory: Path) -> dict[str, dict]:
+    # Returns {"transcript", "transcript_mtime_ns"} by file name, the last record of a file wins
+    transcripts = {}
+
+    try:
+        with open(directory / MANIFEST_FILE_NAME, "r") as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut by an interrupted write
+                    continue
+
+                transcripts[record["file"]] = {
+                    "transcript": record["transcript"].strip() or None,
+                    "transcript_mtime_ns": record.get("transcript_mtime_ns"),
+                }
+    except FileNotFoundError:
+        pass
+
+    return transcripts
+
+
+def is_manifest_transcript_actual(record: dict, transcript_path: Path) -> bool:
+    # A .txt transcript edited by hand after the record was written wins over the record
+    try:
+        transcript_mtime_ns = os.stat(transcript_path).st_mtime_ns
+    except FileNotFoundError:
+        return True
+
+    # Records written before the mtime was kept cannot tell, their .txt is written along with them
+    return record["transcript_mtime_ns"] is not None and transcript_mtime_ns <= record["transcript_mtime_ns"]
+
+
+def read_transcript(transcript_path: Path) -> str | None:
+    with open(transcript_path, 'r') as fp:
+        transcription = fp.read()
+
+    transcription = transcription.strip()
+
+    if len(transcription) == 0:
+        return None
+
+    return transcription
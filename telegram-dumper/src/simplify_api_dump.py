@@ -1,155 +1,191 @@
-import json
 from argparse import ArgumentParser, BooleanOptionalAction
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import os
 from pathlib import Path
+from typing import Iterable, Iterator
 
 from lib import (
+    Projection,
+    TranscriptIndex,
+    compile_projection,
     compose_voice_message_file_name,
+    dumps,
     filter_dict,
-    get_voice_message_transcription,
-    read_jsonl_with_messages,
+    iter_jsonl_chunks,
+    iter_jsonl_with_messages,
+    load_projection_spec,
+    loads,
+    save_jsonl_chunks,
+    save_jsonl_with_messages,
 )
 
 
+MESSAGE_PROJECTION_SPEC = {
+    "*": {
+        "drop": [
+            "_",
+            "out",
+            "mentioned",
+            "media_unread",
+            "silent",
+            "post",
+            "from_scheduled",
+            "legacy",
+            "edit_hide",
+            "pinned",
+            "noforwards",
+            "invert_media",
+            "offline",
+            "video_processing_pending",
+            "from_boosts_applied",
+            "saved_peer_id",
+            "via_bot_id",
+            "via_business_bot_id",
+            "reply_markup",
+            "entities",
+            "edit_date",
+            "grouped_id",
+            "restriction_reason",
+            "ttl_period",
+            "quick_reply_shortcut_id",
+            "effect",
+            "factcheck",
+        ],
+        "drop_none": True,
+        "fields": {
+            "reply_to": {"pick": "reply_to_msg_id"},
+            "reactions": {"collapse_reactions": True},
+            "replies": {"pick": "replies"},
+            "media": {
+                "when_type": "MessageMediaDocument",
+                "drop": ["_", "alt_documents", "nopremium", "round", "spoiler", "ttl_seconds"],
+                "drop_none": True,
+                "fields": {
+                    "document": {
+                        "drop": ["_", "access_hash", "dc_id", "file_reference", "thumbs", "video_thumbs"],
+                        "drop_none": True,
+                        "fields": {
+                            "attributes": {
+                                "each": {
+                                    "when_type": "DocumentAttributeAudio",
+                                    "drop": ["_", "waveform"],
+                                    "drop_none": True,
+                                },
+                            },
+                        },
+                    },
+                },
+                "hook": "voice_transcript",
+            },
+            "from_id": {"pick_by_type": {"PeerUser": "user_id", "PeerChannel": "channel_id"}},
+            "peer_id": {"pick_by_type": {"PeerUser": "user_id", "PeerChannel": "channel_id"}},
+        },
+    },
+}
+
+
 def main(args):
-    if not os.path.isfile(args.input_jsonl_file):
+    if not os.path.exists(args.input_jsonl_file):
         print('Input JSONL file not found')
         return
 
     input_dir = Path(args.input_jsonl_file).parent
+    transcript_index = TranscriptIndex(use_cache=args.transcripts_cache)
+    spec = load_projection_spec(args.projection_spec) if args.projection_spec else MESSAGE_PROJECTION_SPEC
+
+    if args.workers > 1:
+        # Workers get a copy of the index, so transcripts are loaded once here
+        transcript_index.get_directory(input_dir / "audio_files").load_all()
+
+        chunks = process_chunks_in_pool(
+            iter_jsonl_chunks(args.input_jsonl_file),
+            spec,
+            input_dir,
+            transcript_index,
+            args,
+        )
+        save_jsonl_chunks(args.output_jsonl_file, chunks)
+    else:
+        project = compile_message_projection(spec, input_dir, transcript_index)
 
-    input_data = read_jsonl_with_messages(args.input_jsonl_file)
-
-    for message in input_data.values():
-        process_message(message, input_dir, args)
-
-        for reply in message.get('reply_messages', []):
-            process_message(reply, input_dir, args)
-
-    with open(args.output_jsonl_file, 'w') as fp:
-        for message in input_data.values():
-            line = json.dumps(message, ensure_ascii=False)
-            fp.write(line + "\n")
-
-
-def process_message(message: dict, input_dir: Path, args) -> None:
-    clean_message_fields(message)
-    process_reply_to(message)
-    process_reactions(message)
-    process_standard_replies(message)
-
-    process_media(message, input_dir)
+        messages = iter_jsonl_with_messages(args.input_jsonl_file)
+        save_jsonl_with_messages(args.output_jsonl_file, process_messages(messages, project, args))
 
-    process_peer_ref(message, "from_id")
-    process_peer_ref(message, "peer_id")
+    transcript_index.save_cache()
 
-    if args.remove_media:
-        filter_dict(message, {"media"})
-    if args.remove_reply_messages:
-        filter_dict(message, {"reply_messages"})
 
+def compile_message_projection(spec: dict, input_dir: Path, transcript_index: TranscriptIndex) -> Projection:
+    def substitute_transcript(message: dict, media: dict) -> None:
+        if media.get("voice", False):
+            substitute_voice_transcript(message, input_dir / "audio_files", transcript_index)
 
-def clean_message_fields(message: dict) -> None:
-    filter_dict(message, {
-        "_",
-        "out",
-        "mentioned",
-        "media_unread",
-        "silent",
-        "post",
-        "from_scheduled",
-        "legacy",
-        "edit_hide",
-        "pinned",
-        "noforwards",
-        "invert_media",
-        "offline",
-        "video_processing_pending",
-        "from_boosts_applied",
-        "saved_peer_id",
-        "via_bot_id",
-        "via_business_bot_id",
-        "reply_markup",
-        "entities",
-        "edit_date",
-        "grouped_id",
-        "restriction_reason",
-        "ttl_period",
-        "quick_reply_shortcut_id",
-        "effect",
-        "factcheck",
-    })
-
-
-def process_reply_to(message: dict) -> None:
-    if "reply_to" not in message or message["reply_to"] is None:
-        return
+    return compile_projection(spec, {"voice_transcript": substitute_transcript})
 
-    message["reply_to"] = message["reply_to"]["reply_to_msg_id"]
 
+worker_project: Projection | None = None
 
-def process_peer_ref(message: dict, field: str) -> None:
-    if field not in message or not message[field]:
-        return
 
-    if message[field]["_"] == 'PeerUser':
-        message[field] = message[field]["user_id"]
-    elif message[field]["_"] == 'PeerChannel':
-        message[field] = message[field]["channel_id"]
-    else:
-        raise ValueError(f"Unknown peer type: {message[field]['_']}")
+def init_worker(spec: dict, input_dir: Path, transcript_index: TranscriptIndex) -> None:
+    global worker_project
+    worker_project = compile_message_projection(spec, input_dir, transcript_index)
 
 
-def process_reactions(message: dict) -> None:
-    if "reactions" not in message or message["reactions"] is None:
-        return
+def process_chunks_in_pool(
+        chunks: Iterable[bytes],
+        spec: dict,
+        input_dir: Path,
+        transcript_index: TranscriptIndex,
+        args,
+) -> Iterator[bytes]:
+    initargs = (spec, input_dir, transcript_index)
+    with ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=initargs) as executor:
+        # Results are taken in the order of submission, a few chunks ahead keep all the workers busy
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(process_chunk, chunk, args))
 
-    result = {}
-    for reaction_model in message["reactions"]["results"]:
-        if reaction_model["reaction"]["_"] == "ReactionEmoji":
-            result[reaction_model["reaction"]["emoticon"]] = reaction_model["count"]
-        elif reaction_model["reaction"]["_"] == "ReactionCustomEmoji":
-            result[reaction_model["reaction"]["document_id"]] = reaction_model["count"]
+            if len(pending) >= args.workers * 2:
+                yield pending.popleft().result()
 
-    message["reactions"] = result
+        while pending:
+            yield pending.popleft().result()
 
 
-def process_standard_replies(message: dict) -> None:
-    if "replies" not in message or not message["replies"]:
-        return
+def process_chunk(chunk: bytes, args) -> bytes:
+    messages = (loads(line) for line in chunk.splitlines() if line.strip())
 
-    message["replies"] = message["replies"]["replies"]
+    messages = process_messages(messages, worker_project, args)
 
+    return b"".join(dumps(message) + b"\n" for message in messages)
 
-def process_media(message: dict, input_dir: Path) -> None:
-    if "media" not in message or not message["media"] or message["media"]["_"] != "MessageMediaDocument":
-        return
 
-    media = message["media"]
-    filter_dict(media, {"_", "alt_documents", "nopremium", "round", "spoiler", "ttl_seconds"})
+def process_messages(messages: Iterable[dict], project: Projection, args) -> Iterator[dict]:
+    for message in messages:
+        message = process_message(message, project, args)
 
-    process_document(media)
+        if "reply_messages" in message:
+            message["reply_messages"] = [process_message(reply, project, args) for reply in message["reply_messages"]]
 
-    if media.get("voice", False):
-        substitute_voice_transcript(message, input_dir / "audio_files")
+        yield message
 
 
-def process_document(media: dict) -> None:
-    if "document" not in media or not media["document"]:
-        return
+def process_message(message: dict, project: Projection, args) -> dict:
+    message = project(message)
 
-    filter_dict(media["document"], {"_", "access_hash", "dc_id", "file_reference", "thumbs", "video_thumbs"})
+    if args.remove_media:
+        filter_dict(message, {"media"})
+    if args.remove_reply_messages:
+        filter_dict(message, {"reply_messages"})
 
-    for attr in media["document"]["attributes"]:
-        if attr["_"] == "DocumentAttributeAudio":
-            filter_dict(attr, {"_", "waveform"})
+    return message
 
 
-def substitute_voice_transcript(message: dict, input_dir: Path) -> None:
+def substitute_voice_transcript(message: dict, input_dir: Path, transcript_index: TranscriptIndex) -> None:
     file_name = compose_voice_message_file_name(message)
 
     audio_path = input_dir / file_name
-    transcription = get_voice_message_transcription(audio_path)
+    transcription = transcript_index.get(audio_path)
 
     if not transcription:
         return
@@ -161,11 +197,11 @@ if __name__ == "__main__":
     parser = ArgumentParser(description="Convert messages JSONL dump to a simple JSON format file.")
     parser.add_argument(
         "input_jsonl_file",
-        help="input JSONL file with messages",
+        help="input JSONL file with messages (.gz and .zst ones are decompressed), or a directory of sharded messages (*.shards)",
     )
     parser.add_argument(
         "output_jsonl_file",
-        help="output JSONL file of text messages",
+        help="output JSONL file of text messages (compressed for .gz and .zst), or a directory of sharded messages (*.shards)",
     )
     parser.add_argument(
         "--remove-media",
@@ -179,6 +215,22 @@ if __name__ == "__main__":
         action=BooleanOptionalAction,
         default=False,
     )
+    parser.add_argument(
+        "--transcripts-cache",
+        help="keep the list of audio files and their transcripts in a cache file, updated when the directory changes",
+        action=BooleanOptionalAction,
+        default=False,
+    )
+    parser.add_argument(
+        "--projection-spec",
+        help="JSON file with the rules of message cleaning, used instead of the built-in ones",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of processes to transform messages in parallel",
+        type=int,
+        default=1,
+    )
 
     args = parser.parse_args()
 
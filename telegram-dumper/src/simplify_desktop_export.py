@@ -1,9 +1,13 @@
-import json
 from argparse import ArgumentParser, BooleanOptionalAction
 import os
 from pathlib import Path
+from typing import Iterable, Iterator
 
-from lib import get_voice_message_transcription
+from lib import (
+    TranscriptIndex,
+    iter_json_array_items,
+    save_jsonl_with_messages,
+)
 
 
 def main(args):
@@ -12,25 +16,30 @@ def main(args):
         return
 
     input_dir = Path(args.input_json_file).parent
+    transcript_index = TranscriptIndex(use_cache=args.transcripts_cache)
 
-    with open(args.input_json_file, 'r') as fp:
-        input_data = fp.read()
+    with open(args.input_json_file, 'r', encoding='utf-8') as fp:
+        messages = iter_json_array_items(fp, 'messages')
+        save_jsonl_with_messages(args.output_jsonl_file, process_messages(messages, input_dir, transcript_index, args))
 
-    input_json = json.loads(input_data)
+    transcript_index.save_cache()
 
-    messages = input_json['messages']
+
+def process_messages(
+        messages: Iterable[dict],
+        input_dir: Path,
+        transcript_index: TranscriptIndex,
+        args,
+) -> Iterator[dict]:
     for message in messages:
         clean_message_fields(message)
         message["text"] = flat_text_array(message["text"])
-        substitute_audio_transcript(message, input_dir)
+        substitute_audio_transcript(message, input_dir, transcript_index)
 
         if args.skip_text_entities and "text_entities" in message:
             del message["text_entities"]
 
-    with open(args.output_jsonl_file, 'w') as fp:
-        for message in messages:
-            line = json.dumps(message, ensure_ascii=False)
-            fp.write(line + "\n")
+        yield message
 
 
 def clean_message_fields(message: dict) -> None:
@@ -55,12 +64,12 @@ def flat_text_array(text_array: str | list[str | dict]) -> str:
     return text_array
 
 
-def substitute_audio_transcript(message: dict, input_dir) -> None:
+def substitute_audio_transcript(message: dict, input_dir, transcript_index: TranscriptIndex) -> None:
     if "media_type" not in message or message["media_type"] != "voice_message":
         return
 
     audio_path = Path(input_dir) / message["file"]
-    transcription = get_voice_message_transcription(audio_path)
+    transcription = transcript_index.get(audio_path)
 
     if not transcription:
         return
@@ -80,7 +89,7 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "output_jsonl_file",
-        help="output JSONL file of text messages",
+        help="output JSONL file of text messages (compressed for .gz and .zst), or a directory of sharded messages (*.shards)",
     )
     parser.add_argument(
         "--skip-text-entities",
@@ -89,6 +98,13 @@ if __name__ == "__main__":
         action=BooleanOptionalAction,
     )
 
+    parser.add_argument(
+        "--transcripts-cache",
+        help="keep the list of audio files and their transcripts in a cache file, updated when the directory changes",
+        default=False,
+        action=BooleanOptionalAction,
+    )
+
     args = parser.parse_args()
 
     main(args)
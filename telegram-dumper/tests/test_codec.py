@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+from lib import codec
+from lib.codec import stdlib_dumps, stdlib_loads
+
+# Floats which orjson and the stdlib print differently, by the orjson spelling
+EXPONENT_FLOATS = {b"0.00001": b"1e-05", b"1e16": b"1e+16", b"1.5e-7": b"1.5e-07"}
+
+
+def compose_representative_message() -> dict:
+    return {
+        "_": "Message",
+        "id": 42,
+        "peer_id": {"_": "PeerChannel", "channel_id": 1234567890},
+        "date": "2024-01-01T00:00:00+00:00",
+        "message": "Привет, мир! 👋 «кавычки» \"quotes\" \\ tab\t",
+        "out": False,
+        "post": True,
+        "views": 12345,
+        "entities": [
+            {"_": "MessageEntityBold", "offset": 0, "length": 5},
+            {"_": "MessageEntityTextUrl", "offset": 6, "length": 5, "url": "https://example.com/"},
+        ],
+        "media": {
+            "_": "MessageMediaDocument",
+            "document": {
+                "_": "Document",
+                "id": 5368324170671202287,
+                "access_hash": -1234567890123456789,
+                "file_reference": "AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8=",
+                "attributes": [
+                    {"_": "DocumentAttributeAudio", "duration": 42, "voice": True, "waveform": "AAECAwQ="},
+                    {"_": "DocumentAttributeVideo", "duration": 12.5, "w": 1280},
+                ],
+                "thumbs": [],
+            },
+            "geo": {"_": "GeoPoint", "lat": 55.751244, "long": 37.618423, "accuracy_radius": None},
+        },
+        "reactions": {
+            "_": "MessageReactions",
+            "results": [{"_": "ReactionCount", "count": 100, "reaction": {"_": "ReactionEmoji", "emoticon": "👍"}}],
+        },
+        "reply_messages": [{"id": 43, "message": "ответ", "views": 0, "out": False}],
+    }
+
+
+def test_orjson_and_stdlib_lines_are_identical():
+    if codec.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    message = compose_representative_message()
+
+    assert codec.orjson_dumps(message) == stdlib_dumps(message)
+    assert codec.orjson_loads(stdlib_dumps(message)) == message
+
+
+def test_orjson_and_stdlib_lines_differ_in_exponent_floats_only():
+    if codec.orjson is None:
+        pytest.skip("orjson is not installed")
+
+    message = compose_representative_message()
+    message["media"]["geo"]["accuracy_radius"] = 1e-05
+    message["media"]["document"]["attributes"][1]["duration"] = 1e16
+    message["reply_messages"][0]["ratio"] = 1.5e-7
+
+    orjson_line = codec.orjson_dumps(message)
+    stdlib_line = stdlib_dumps(message)
+
+    assert orjson_line != stdlib_line
+    for orjson_float, stdlib_float in EXPONENT_FLOATS.items():
+        orjson_line = orjson_line.replace(orjson_float, stdlib_float)
+    assert orjson_line == stdlib_line
+    assert codec.orjson_loads(codec.orjson_dumps(message)) == stdlib_loads(stdlib_dumps(message)) == message
+
+
+def test_stdlib_lines_are_compact_utf8():
+    message = compose_representative_message()
+    line = stdlib_dumps(message)
+
+    assert b"\n" not in line
+    assert "Привет".encode() in line
+    assert stdlib_loads(line) == message == json.loads(json.dumps(message, ensure_ascii=False))
@@ -0,0 +1,136 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon.tl.patched import Message
+from telethon.tl.types import MessageFwdHeader, MessageReplies, MessageReplyHeader, PeerChannel
+
+import dump_chat
+from dump_chat import DiscussionGroupScanner, fetch_discussion_group_replies
+from lib import AdaptiveRateLimiter
+
+CHANNEL_ID = 100
+GROUP_ID = 200
+DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeClient:
+    def __init__(self, group_messages: list[Message]):
+        self.group_messages = group_messages
+        self.scanned_ids = []
+
+    async def __call__(self, request, flood_sleep_threshold=None):
+        return None
+
+    async def iter_messages(self, entity, reverse, min_id=0, offset_date=None):
+        for message in self.group_messages:
+            if message.id > min_id and (offset_date is None or message.date > offset_date):
+                self.scanned_ids.append(message.id)
+                yield message
+
+
+def compose_group(posts_comments: dict[int, int]) -> tuple[list[Message], dict[int, int]]:
+    # Returns messages of the group, and the last comment ID by post ID
+    messages = []
+    last_comment_ids = {}
+    for post_id, comments_count in posts_comments.items():
+        copy_id = len(messages) + 1
+        messages.append(Message(
+            id=copy_id,
+            peer_id=PeerChannel(GROUP_ID),
+            date=DATE + timedelta(minutes=copy_id),
+            message="",
+            fwd_from=MessageFwdHeader(date=DATE, from_id=PeerChannel(CHANNEL_ID), channel_post=post_id),
+        ))
+
+        for _ in range(comments_count):
+            messages.append(Message(
+                id=len(messages) + 1,
+                peer_id=PeerChannel(GROUP_ID),
+                date=DATE + timedelta(minutes=len(messages) + 1),
+                message="comment",
+                reply_to=MessageReplyHeader(reply_to_msg_id=copy_id),
+            ))
+        last_comment_ids[post_id] = messages[-1].id
+
+    return messages, last_comment_ids
+
+
+def compose_post(post_id: int, comments_count: int, last_comment_id: int) -> Message:
+    return Message(
+        id=post_id,
+        peer_id=PeerChannel(CHANNEL_ID),
+        date=DATE + timedelta(seconds=post_id),
+        message="post",
+        replies=MessageReplies(replies=comments_count, replies_pts=0, channel_id=GROUP_ID, max_id=last_comment_id),
+    )
+
+
+def test_batches_scan_discussion_group_once():
+    posts_comments = {1: 2, 2: 3, 3: 1, 4: 2}
+    group_messages, last_comment_ids = compose_group(posts_comments)
+    posts = [compose_post(post_id, count, last_comment_ids[post_id]) for post_id, count in posts_comments.items()]
+
+    client = FakeClient(group_messages)
+    entity_info = SimpleNamespace(id=CHANNEL_ID)
+    scanner = DiscussionGroupScanner(client, entity_info)
+    rate_limiter = AdaptiveRateLimiter(100.)
+
+    async def run() -> dict:
+        result = {}
+        for batch in (posts[:2], posts[2:]):
+            result.update(await fetch_discussion_group_replies(client, entity_info, batch, {}, rate_limiter, scanner, 1))
+        return result
+
+    result = asyncio.run(run())
+
+    assert {post_id: len(replies) for post_id, replies in result.items()} == posts_comments
+    # Every scan reads one message past its end, nothing else is read twice
+    assert set(client.scanned_ids) == {message.id for message in group_messages}
+    assert len(client.scanned_ids) <= len(group_messages) + 2
+    assert scanner.positions == {str(GROUP_ID): group_messages[-1].id}
+
+
+def test_scan_continues_from_saved_position():
+    group_messages, last_comment_ids = compose_group({1: 2, 2: 3})
+    post = compose_post(2, 3, last_comment_ids[2])
+
+    client = FakeClient(group_messages)
+    entity_info = SimpleNamespace(id=CHANNEL_ID)
+    # Everything up to the last comment of the first post has been scanned by a previous run
+    scanner = DiscussionGroupScanner(client, entity_info, {str(GROUP_ID): last_comment_ids[1]})
+
+    result = asyncio.run(scanner.get_replies(GROUP_ID, [post], AdaptiveRateLimiter(100.)))
+
+    assert len(result[2]) == 3
+    assert min(client.scanned_ids) == last_comment_ids[1] + 1
+
+
+def test_scan_window_is_capped(monkeypatch):
+    monkeypatch.setattr(dump_chat, "DISCUSSION_SCAN_WINDOW", 5)
+
+    group_messages, last_comment_ids = compose_group({1: 2, 2: 3, 3: 3})
+    # A recent comment of the old post
+    group_messages.append(Message(
+        id=len(group_messages) + 1,
+        peer_id=PeerChannel(GROUP_ID),
+        date=DATE + timedelta(minutes=len(group_messages) + 1),
+        message="late comment",
+        reply_to=MessageReplyHeader(reply_to_msg_id=1),
+    ))
+    post = compose_post(1, 3, group_messages[-1].id)
+
+    client = FakeClient(group_messages)
+    scanner = DiscussionGroupScanner(client, SimpleNamespace(id=CHANNEL_ID))
+
+    result = asyncio.run(scanner.get_replies(GROUP_ID, [post], AdaptiveRateLimiter(100.)))
+
+    # The late comment is past the window, so the counter doesn't match and the post is fetched on its own
+    assert len(result[1]) == 2
+    assert max(client.scanned_ids) <= 1 + 5 + 1
+    assert scanner.positions == {str(GROUP_ID): 1 + 5}
+    assert set(scanner._replies) == {2}
+
+    scanner.finish_batch([compose_post(3, 3, last_comment_ids[3])])
+
+    assert scanner._replies == {}
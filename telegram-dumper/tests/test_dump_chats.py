@@ -0,0 +1,43 @@
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pytest
+
+from dump_chat import add_export_arguments
+from dump_chats import compose_chats_args, load_chats_config
+
+
+def parse_args(output_dir: str):
+    parser = ArgumentParser()
+    parser.add_argument("output_dir")
+    add_export_arguments(parser)
+
+    return parser.parse_args([output_dir])
+
+
+def test_chat_directories_stay_inside_output_dir(tmp_path):
+    args = parse_args(str(tmp_path))
+    config = {"chats": ["https://t.me/some_channel", "../escape", {"chat_name": "@user/name"}, -1001234]}
+
+    output_dirs = [Path(chat_args.output_dir) for chat_args in compose_chats_args(config, args)]
+
+    assert [output_dir.name for output_dir in output_dirs] == ["some_channel", "escape", "user_name", "1001234"]
+    assert all(output_dir.parent == tmp_path for output_dir in output_dirs)
+
+
+def test_chat_without_name_is_reported(tmp_path):
+    args = parse_args(str(tmp_path))
+
+    with pytest.raises(ValueError, match="Chat #2"):
+        compose_chats_args({"chats": ["channel", {"limit": 10}]}, args)
+
+
+def test_yaml_config_is_loaded(tmp_path):
+    config_path = tmp_path / "chats.yaml"
+    config_path.write_text("defaults:\n  from-date: 2024-01-01\nchats:\n  - some_channel\n")
+
+    config = load_chats_config(config_path)
+    [chat_args] = compose_chats_args(config, parse_args(str(tmp_path)))
+
+    assert chat_args.chat_name == "some_channel"
+    assert chat_args.from_date == "2024-01-01"
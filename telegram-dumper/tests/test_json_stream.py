@@ -0,0 +1,107 @@
+from io import StringIO
+import json
+import random
+
+import pytest
+
+from lib import iter_json_array_items
+
+DOCUMENT = {
+    "name": "Чат 👋",
+    "type": "public_channel",
+    "nested": {"messages": ["not this one"], "list": [[], {}, [1, [2, [3]]]]},
+    "messages": [
+        {"id": 1, "type": "message", "text": "Привет, мир! «кавычки» \"quotes\" \\ slash / tab\t newline\n"},
+        {"id": 2, "text": ["bold ", {"type": "bold", "text": "текст"}, " \u0000 \u2028 😀"]},
+        {"id": 3, "text": "", "reactions": [], "photo": None, "edited": False, "forwarded": True},
+        {"id": 4, "numbers": [0, -1, 12345678901234567890, 1.5, -2.5e-7, 1e+16]},
+        "plain string",
+        12345,
+        -0.5,
+        True,
+        None,
+        [],
+        {},
+        [[{"deep": [{"deeper": []}]}]],
+    ],
+    "after": {"messages": [5]},
+}
+
+
+def read_items(text: str, key: str = "messages", chunk_size: int = 1) -> list:
+    return list(iter_json_array_items(StringIO(text), key, chunk_size))
+
+
+@pytest.mark.parametrize("indent", [None, 1, "\t"])
+def test_items_match_json_loads_at_every_chunk_boundary(indent):
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=indent)
+    escaped_text = json.dumps(DOCUMENT, ensure_ascii=True, indent=indent)
+
+    # Chunk sizes up to the longest string, so boundaries fall at every position of strings and escapes
+    for chunk_size in range(1, 80):
+        assert read_items(text, chunk_size=chunk_size) == json.loads(text)["messages"]
+        assert read_items(escaped_text, chunk_size=chunk_size) == json.loads(escaped_text)["messages"]
+
+
+def test_items_match_json_loads_on_random_documents():
+    random_generator = random.Random(0)
+    alphabet = "ab\"\\/\n\t\u0001é€😀 {}[],:0"
+
+    def compose_value(depth: int) -> any:
+        kind = random_generator.randrange(8 if depth < 4 else 5)
+        if kind == 0:
+            return "".join(random_generator.choices(alphabet, k=random_generator.randrange(10)))
+        if kind == 1:
+            return random_generator.randint(-10 ** 20, 10 ** 20)
+        if kind == 2:
+            return random_generator.uniform(-1e10, 1e10)
+        if kind == 3:
+            return random_generator.choice([True, False, None])
+        if kind == 4:
+            return ""
+        if kind == 5:
+            return [compose_value(depth + 1) for _ in range(random_generator.randrange(4))]
+        return {str(compose_value(depth + 1)): compose_value(depth + 1) for _ in range(random_generator.randrange(4))}
+
+    for _ in range(200):
+        document = {"before": compose_value(0), "messages": [compose_value(0) for _ in range(5)], "after": []}
+        ensure_ascii = random_generator.random() < 0.5
+        text = json.dumps(document, ensure_ascii=ensure_ascii, indent=random_generator.choice([None, 2]))
+
+        assert read_items(text, chunk_size=random_generator.randint(1, 16)) == json.loads(text)["messages"]
+
+
+@pytest.mark.parametrize("text", [
+    '{"messages": []}',
+    '{"messages":[]}',
+    ' \n\t{ "messages" :\r\n [ \n ] } \n',
+    '{}',
+    '{"name": "no messages", "list": [1, 2]}',
+])
+def test_empty_and_missing_arrays_give_no_items(text):
+    assert read_items(text) == []
+
+
+def test_whitespace_around_items():
+    text = '\n{\n\t"messages" \t:\r\n[\n  1 ,\n\t"two"\r\n,{ "three" : [ 3 ] }\n  ]\n}\n'
+
+    assert read_items(text) == [1, "two", {"three": [3]}]
+
+
+@pytest.mark.parametrize("text", [
+    '',
+    '{',
+    '{"messages"',
+    '{"messages": [',
+    '{"messages": [1, 2',
+    '{"messages": [1, 2,',
+    '{"messages": [{"id": 1, "text": "Прив',
+    '{"messages": [{"id": 1, "text": "\\u04',
+    '{"messages": [{"id": 1}, {"id": 2',
+    '{"messages": [tru',
+    '{"name": "Ча',
+])
+def test_truncated_input_raises(text):
+    for chunk_size in (1, 3, 1024):
+        with pytest.raises(ValueError):
+            read_items(text, chunk_size=chunk_size)
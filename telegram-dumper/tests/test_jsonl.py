@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+import random
+import string
+import time
+
+import pytest
+
+from lib import (
+    JsonlMessageIndex,
+    append_jsonl_with_messages,
+    read_jsonl_tail,
+    save_jsonl_with_messages,
+    truncate_file,
+)
+
+
+def test_read_jsonl_tail_with_last_line_longer_than_chunk(tmp_path):
+    file_path = tmp_path / "messages.jsonl"
+    text = "".join(random.Random(1).choices(string.ascii_letters + string.digits, k=100000))
+    append_jsonl_with_messages(file_path, [{"id": 1, "t": "first"}, {"id": 2, "t": text}])
+
+    last_message, size = read_jsonl_tail(file_path, chunk_size=1000)
+
+    assert last_message == {"id": 2, "t": text}
+    assert size == file_path.stat().st_size
+
+
+def test_read_jsonl_tail_skips_incomplete_line(tmp_path):
+    file_path = tmp_path / "messages.jsonl"
+    append_jsonl_with_messages(file_path, [{"id": 1}, {"id": 2}])
+    valid_size = file_path.stat().st_size
+
+    with open(file_path, "ab") as fp:
+        fp.write(json.dumps({"id": 3, "t": "torn"}).encode()[:10])
+
+    last_message, size = read_jsonl_tail(file_path, chunk_size=4)
+
+    assert last_message == {"id": 2}
+    assert size == valid_size
+
+
+def test_index_is_rebuilt_for_rewritten_file_with_same_inode(tmp_path):
+    file_path = tmp_path / "messages.jsonl"
+    save_jsonl_with_messages(file_path, [{"id": 1, "t": "aaaa"}, {"id": 2, "t": "bbbb"}])
+    assert JsonlMessageIndex.open(file_path).get(2) == {"id": 2, "t": "bbbb"}
+
+    # Rewritten in place, so the inode and the size stay the same
+    with open(file_path, "wb") as fp:
+        fp.write(b'{"id":3,"t":"cc"}\n{"id":4,"t":"dddddd"}\n')
+    os.utime(file_path, ns=(time.time_ns(), time.time_ns() + 1000))
+
+    index = JsonlMessageIndex.open(file_path)
+
+    assert list(index.ids) == [3, 4]
+    assert index.get(4) == {"id": 4, "t": "dddddd"}
+
+
+def test_index_scans_appended_tail_only(tmp_path):
+    file_path = tmp_path / "messages.jsonl"
+    append_jsonl_with_messages(file_path, [{"id": 1}, {"id": 2}])
+    JsonlMessageIndex.open(file_path)
+
+    append_jsonl_with_messages(file_path, [{"id": 3}])
+    os.utime(file_path, ns=(time.time_ns(), time.time_ns() + 1000))
+
+    index = JsonlMessageIndex.open(file_path)
+
+    assert list(index.ids) == [1, 2, 3]
+    assert index.get(3) == {"id": 3}
+
+
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_torn_last_frame_of_compressed_file_is_dropped(tmp_path, suffix):
+    if suffix == ".zst":
+        zstandard = pytest.importorskip("zstandard")
+        torn_frame = zstandard.ZstdCompressor().compress(b'{"id": 3}\n')[:-4]
+    else:
+        torn_frame = gzip.compress(b'{"id": 3}\n')[:-4]
+
+    file_path = tmp_path / f"messages.jsonl{suffix}"
+    save_jsonl_with_messages(file_path, [{"id": 1}])
+    append_jsonl_with_messages(file_path, [{"id": 2}])
+    valid_size = os.path.getsize(file_path)
+
+    # A frame cut by an interrupted append, which the frames list doesn't know of yet
+    with open(file_path, "ab") as fp:
+        fp.write(torn_frame)
+
+    assert read_jsonl_tail(file_path) == ({"id": 2}, valid_size)
+
+    truncate_file(file_path, valid_size)
+    append_jsonl_with_messages(file_path, [{"id": 3}])
+
+    assert read_jsonl_tail(file_path) == ({"id": 3}, os.path.getsize(file_path))
@@ -0,0 +1,84 @@
+import asyncio
+
+from telethon import TelegramClient
+from telethon.errors import FloodWaitError
+from telethon.sessions import MemorySession
+from telethon.tl.patched import Message
+from telethon.tl.types import Channel, ChatPhotoEmpty, PeerChannel
+from telethon.tl.types.messages import ChannelMessages
+
+from dump_chat import FLOOD_SLEEP_THRESHOLD, get_message_replies
+from lib import AdaptiveRateLimiter
+
+
+def test_flood_wait_lowers_rate():
+    rate_limiter = AdaptiveRateLimiter(max_rate=100., recovery_factor=1.)
+    calls = []
+
+    async def request():
+        calls.append(None)
+        if len(calls) == 1:
+            raise FloodWaitError(request=None, capture=0)
+
+        return "result"
+
+    result = asyncio.run(rate_limiter.call(request))
+
+    assert result == "result"
+    assert len(calls) == 2
+    assert rate_limiter.flood_waits == 1
+    assert rate_limiter.rate == 50.
+
+
+def test_flood_wait_is_raised_after_max_retries():
+    rate_limiter = AdaptiveRateLimiter(max_rate=100., max_retries=1)
+
+    async def request():
+        raise FloodWaitError(request=None, capture=0)
+
+    try:
+        asyncio.run(rate_limiter.call(request))
+    except FloodWaitError:
+        pass
+    else:
+        assert False, "FloodWaitError is expected"
+
+    assert rate_limiter.flood_waits == 1
+
+
+def test_reply_pages_pass_flood_waits_to_limiter():
+    channel = Channel(id=100, title="channel", photo=ChatPhotoEmpty(), date=None, access_hash=1)
+    replies = [
+        Message(id=reply_id, peer_id=PeerChannel(200), date=None, message=f"reply {reply_id}")
+        for reply_id in range(250, 0, -1)
+    ]
+
+    # A client that isn't connected, its requests are answered by the test
+    class FakeClient(TelegramClient):
+        def __init__(self):
+            super().__init__(MemorySession(), api_id=1, api_hash="test")
+            self.thresholds = []
+
+        async def __call__(self, request, flood_sleep_threshold=None):
+            self.thresholds.append(flood_sleep_threshold)
+            if len(self.thresholds) == 1:
+                raise FloodWaitError(request=request, capture=0)
+
+            page = [reply for reply in replies if not request.offset_id or reply.id < request.offset_id]
+            return ChannelMessages(
+                pts=0,
+                count=len(replies),
+                messages=page[:request.limit],
+                topics=[],
+                chats=[],
+                users=[],
+            )
+
+    client = FakeClient()
+    rate_limiter = AdaptiveRateLimiter(max_rate=100., recovery_factor=1.)
+
+    result = asyncio.run(get_message_replies(client, channel, 1, rate_limiter))
+
+    assert [reply.id for reply in result] == list(range(1, 251))
+    assert rate_limiter.rate == 50.
+    assert set(client.thresholds) == {FLOOD_SLEEP_THRESHOLD}
@@ -0,0 +1,215 @@
+import copy
+import json
+from argparse import Namespace
+from pathlib import Path
+
+import pytest
+
+from lib import TranscriptIndex, compose_voice_message_file_name, filter_dict, get_voice_message_transcription
+from simplify_api_dump import MESSAGE_PROJECTION_SPEC, compile_message_projection, process_messages
+
+DATE = "2024-01-01T00:00:00+00:00"
+
+
+def simplify_message_by_functions(message: dict, input_dir: Path, args) -> None:
+    # simplify_api_dump as it was before MESSAGE_PROJECTION_SPEC, the projection must give the same output
+    filter_dict(message, {
+        "_", "out", "mentioned", "media_unread", "silent", "post", "from_scheduled", "legacy", "edit_hide", "pinned",
+        "noforwards", "invert_media", "offline", "video_processing_pending", "from_boosts_applied", "saved_peer_id",
+        "via_bot_id", "via_business_bot_id", "reply_markup", "entities", "edit_date", "grouped_id",
+        "restriction_reason", "ttl_period", "quick_reply_shortcut_id", "effect", "factcheck",
+    })
+
+    if message.get("reply_to") is not None:
+        message["reply_to"] = message["reply_to"]["reply_to_msg_id"]
+
+    if message.get("reactions") is not None:
+        result = {}
+        for reaction_model in message["reactions"]["results"]:
+            if reaction_model["reaction"]["_"] == "ReactionEmoji":
+                result[reaction_model["reaction"]["emoticon"]] = reaction_model["count"]
+            elif reaction_model["reaction"]["_"] == "ReactionCustomEmoji":
+                result[reaction_model["reaction"]["document_id"]] = reaction_model["count"]
+        message["reactions"] = result
+
+    if message.get("replies"):
+        message["replies"] = message["replies"]["replies"]
+
+    media = message.get("media")
+    if media and media["_"] == "MessageMediaDocument":
+        filter_dict(media, {"_", "alt_documents", "nopremium", "round", "spoiler", "ttl_seconds"})
+
+        if media.get("document"):
+            filter_dict(media["document"], {"_", "access_hash", "dc_id", "file_reference", "thumbs", "video_thumbs"})
+            for attr in media["document"]["attributes"]:
+                if attr["_"] == "DocumentAttributeAudio":
+                    filter_dict(attr, {"_", "waveform"})
+
+        if media.get("voice", False):
+            audio_path = input_dir / "audio_files" / compose_voice_message_file_name(message)
+            transcription = get_voice_message_transcription(audio_path)
+            if transcription:
+                message["message"] = transcription
+
+    for field in ("from_id", "peer_id"):
+        if message.get(field):
+            if message[field]["_"] == "PeerUser":
+                message[field] = message[field]["user_id"]
+            elif message[field]["_"] == "PeerChannel":
+                message[field] = message[field]["channel_id"]
+            else:
+                raise ValueError(f"Unknown peer type: {message[field]['_']}")
+
+    if args.remove_media:
+        filter_dict(message, {"media"})
+    if args.remove_reply_messages:
+        filter_dict(message, {"reply_messages"})
+
+
+def compose_voice_message(message_id: int, voice: bool) -> dict:
+    return {
+        "_": "Message",
+        "id": message_id,
+        "peer_id": {"_": "PeerChannel", "channel_id": 100},
+        "date": DATE,
+        "message": "",
+        "out": False,
+        "post": True,
+        "silent": None,
+        "views": 10,
+        "edit_date": DATE,
+        "media": {
+            "_": "MessageMediaDocument",
+            "nopremium": None,
+            "spoiler": None,
+            "voice": voice,
+            "round": None,
+            "ttl_seconds": None,
+            "alt_documents": [],
+            "document": {
+                "_": "Document",
+                "id": 5368324170671202287,
+                "access_hash": -1234567890123456789,
+                "file_reference": "AAECAw==",
+                "date": DATE,
+                "mime_type": "audio/ogg" if voice else "video/mp4",
+                "size": 12345,
+                "thumbs": [] if voice else [{"_": "PhotoSize", "type": "m", "w": 320, "h": 180, "size": 1000}],
+                "video_thumbs": [],
+                "dc_id": 2,
+                "attributes": [
+                    {"_": "DocumentAttributeAudio", "duration": 7, "voice": voice, "title": None, "waveform": "AAEC"},
+                    {"_": "DocumentAttributeVideo", "duration": 12.5, "w": 1280, "h": 720, "round_message": None},
+                    {"_": "DocumentAttributeFilename", "file_name": "clip.mp4"},
+                ],
+            },
+        },
+    }
+
+
+def compose_messages() -> list[dict]:
+    service_message = {
+        "_": "MessageService",
+        "id": 1,
+        "peer_id": {"_": "PeerChannel", "channel_id": 100},
+        "date": DATE,
+        "out": False,
+        "post": True,
+        "from_id": None,
+        "reply_to": None,
+        "action": {"_": "MessageActionChatEditTitle", "title": "New title"},
+        "reactions": None,
+        "ttl_period": None,
+    }
+
+    voice_message = compose_voice_message(2, True)
+    voice_message["reactions"] = {
+        "_": "MessageReactions",
+        "min": None,
+        "results": [
+            {"_": "ReactionCount", "count": 5, "reaction": {"_": "ReactionEmoji", "emoticon": "👍"}},
+            {"_": "ReactionCount", "count": 2, "reaction": {"_": "ReactionCustomEmoji", "document_id": 777}},
+            {"_": "ReactionCount", "count": 1, "reaction": {"_": "ReactionPaid"}},
+        ],
+        "recent_reactions": [],
+    }
+    voice_message["replies"] = {"_": "MessageReplies", "replies": 2, "replies_pts": 1, "channel_id": 200, "max_id": 9}
+    voice_message["reply_messages"] = [
+        {
+            "_": "Message",
+            "id": 8,
+            "peer_id": {"_": "PeerChannel", "channel_id": 200},
+            "from_id": {"_": "PeerUser", "user_id": 300},
+            "date": DATE,
+            "message": "Ответ 👋",
+            "reply_to": {"_": "MessageReplyHeader", "reply_to_msg_id": 7, "reply_to_top_id": None, "quote": False},
+            "entities": [{"_": "MessageEntityBold", "offset": 0, "length": 5}],
+            "reactions": {"_": "MessageReactions", "results": []},
+        },
+        compose_voice_message(9, True),
+    ]
+
+    video_message = compose_voice_message(3, False)
+    video_message["message"] = "Video with a caption"
+    video_message["grouped_id"] = 123
+
+    forward = {
+        "_": "Message",
+        "id": 4,
+        "peer_id": {"_": "PeerChannel", "channel_id": 100},
+        "date": DATE,
+        "message": "Forwarded text",
+        "fwd_from": {
+            "_": "MessageFwdHeader",
+            "date": DATE,
+            "from_id": {"_": "PeerChannel", "channel_id": 500},
+            "channel_post": 42,
+            "post_author": None,
+        },
+        "media": {"_": "MessageMediaPhoto", "spoiler": None, "photo": {"_": "Photo", "id": 1, "sizes": []}},
+        "replies": None,
+        "reply_markup": {"_": "ReplyInlineMarkup", "rows": []},
+    }
+
+    # A reply to a message of another chat has no ID of the message
+    reply = {
+        "_": "Message",
+        "id": 5,
+        "peer_id": {"_": "PeerUser", "user_id": 300},
+        "date": DATE,
+        "message": "Reply",
+        "reply_to": {"_": "MessageReplyHeader", "reply_to_msg_id": None, "reply_to_peer_id": None},
+        "media": {"_": "MessageMediaWebPage", "webpage": {"_": "WebPageEmpty", "id": 1, "url": None}},
+    }
+
+    bare_message = {"_": "Message", "id": 6, "peer_id": {"_": "PeerChannel", "channel_id": 100}, "date": DATE}
+
+    return [service_message, voice_message, video_message, forward, reply, bare_message]
+
+
+@pytest.mark.parametrize("remove_media", [False, True])
+@pytest.mark.parametrize("remove_reply_messages", [False, True])
+def test_projection_output_matches_simplify_functions(tmp_path, remove_media, remove_reply_messages):
+    audio_dir = tmp_path / "audio_files"
+    audio_dir.mkdir()
+    for message_id in (2, 9):
+        (audio_dir / f"channel_100_msg_{message_id}.oga").write_bytes(b"")
+        (audio_dir / f"channel_100_msg_{message_id}.txt").write_text(f"Транскрипт {message_id}")
+
+    args = Namespace(remove_media=remove_media, remove_reply_messages=remove_reply_messages)
+
+    expected = copy.deepcopy(compose_messages())
+    for message in expected:
+        simplify_message_by_functions(message, tmp_path, args)
+        for reply in message.get("reply_messages", []):
+            simplify_message_by_functions(reply, tmp_path, args)
+
+    project = compile_message_projection(MESSAGE_PROJECTION_SPEC, tmp_path, TranscriptIndex())
+    result = list(process_messages(compose_messages(), project, args))
+
+    # Dumps compare the order of keys too
+    assert [json.dumps(message, ensure_ascii=False) for message in result] == \
+        [json.dumps(message, ensure_ascii=False) for message in expected]
+    assert result[1]["message"] == "Транскрипт 2"
+    if not remove_reply_messages:
+        assert result[1]["reply_messages"][1]["message"] == "Транскрипт 9"
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from lib import MessageStorage, ShardedMessageStorage, SqliteMessageStorage
+
+
+def test_incomplete_storage_cannot_be_created():
+    class IncompleteStorage(MessageStorage):
+        def get_messages(self, message_ids):
+            return {}
+
+    with pytest.raises(TypeError):
+        IncompleteStorage()
+
+
+def test_sqlite_storage_saves_messages_with_replies(tmp_path):
+    with SqliteMessageStorage(tmp_path / "messages.sqlite") as storage:
+        storage.save_messages([
+            {"id": 2, "message": "b"},
+            {"id": 1, "message": "a", "reply_messages": [{"id": 10}, {"id": 11}]},
+        ], meta={"checkpoint_last_id": 2})
+
+        assert storage.get_max_id() == 2
+        assert storage.get_meta("checkpoint_last_id") == 2
+        assert storage.get(1) == {"id": 1, "message": "a", "reply_messages": [{"id": 10}, {"id": 11}]}
+        assert [message["id"] for message in storage.iter_messages()] == [1, 2]
+
+
+def test_refresh_keeps_checkpoint_of_interrupted_export(tmp_path):
+    from datetime import datetime, timezone
+    from types import SimpleNamespace
+
+    from telethon.tl.patched import Message
+    from telethon.tl.types import PeerChannel
+
+    from dump_chat import store_messages
+
+    class FakeClient:
+        async def iter_messages(self, entity, reverse, min_id=0, offset_date=None):
+            for message_id in range(1, 6):
+                if message_id > min_id:
+                    yield Message(id=message_id, peer_id=PeerChannel(1), date=datetime.now(timezone.utc), message="")
+
+    args = SimpleNamespace(
+        refresh_window=0,
+        sync=False,
+        preserve_old_data=False,
+        batch_size=10,
+        fetch_replies=False,
+        fetch_voice_messages=False,
+    )
+
+    with SqliteMessageStorage(tmp_path / "messages.sqlite") as storage:
+        storage.save_messages([{"id": message_id} for message_id in (1, 2, 3)], meta={"checkpoint_last_id": 3})
+
+        # A zero window refreshes messages newer than the max ID only
+        assert asyncio.run(store_messages(FakeClient(), None, storage, None, None, None, args)) == 2
+        assert storage.get_meta("checkpoint_last_id") == 3
+
+
+def test_sharded_storage_removes_only_its_own_files(tmp_path):
+    directory = tmp_path / "messages.shards"
+    directory.mkdir()
+    (directory / "notes.jsonl").write_text("{}\n")
+    (directory / "2020-01-0123456789abcdef.jsonl.tmp").write_text("")
+
+    storage = ShardedMessageStorage(directory)
+    storage.save_messages([{"id": 1, "date": "2024-01-05T00:00:00+00:00"}])
+    old_file = storage.shards["2024-01"]["file"]
+    storage.save_messages([{"id": 2, "date": "2024-01-06T00:00:00+00:00"}])
+
+    assert sorted(path.name for path in directory.iterdir()) \
+        == sorted(["manifest.json", "notes.jsonl", storage.shards["2024-01"]["file"]])
+    assert old_file != storage.shards["2024-01"]["file"]
+
+
+def test_sharded_storage_checks_checksums_on_iteration(tmp_path):
+    storage = ShardedMessageStorage(tmp_path / "messages.shards")
+    storage.save_messages([{"id": 1, "date": "2024-01-05T00:00:00+00:00", "message": "a"}])
+
+    shard_path = tmp_path / "messages.shards" / storage.shards["2024-01"]["file"]
+    shard_path.write_bytes(shard_path.read_bytes().replace(b'"a"', b'"b"'))
+
+    with pytest.raises(ValueError, match="checksum"):
+        list(ShardedMessageStorage(tmp_path / "messages.shards").iter_messages())
@@ -0,0 +1,20 @@
+import asyncio
+from types import SimpleNamespace
+
+from dump_chat import stream_messages
+
+
+class EmptyClient:
+    async def iter_messages(self, entity, reverse, min_id=0, offset_date=None):
+        return
+        yield
+
+
+def test_empty_fetch_leaves_no_partial_files(tmp_path):
+    output_path = tmp_path / "messages.jsonl"
+    args = SimpleNamespace(preserve_old_data=False, fetch_replies=False, fetch_voice_messages=False, batch_size=10)
+
+    assert asyncio.run(stream_messages(EmptyClient(), None, output_path, None, None, None, args)) == 0
+
+    assert output_path.read_bytes() == b""
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["messages.jsonl", "messages.jsonl.state"]
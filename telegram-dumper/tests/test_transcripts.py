@@ -0,0 +1,70 @@
+import json
+import os
+
+from lib import TranscriptIndex, get_voice_message_transcription
+
+
+def test_transcript_rewritten_in_place_is_read_again(tmp_path):
+    audio_dir = tmp_path / "audio"
+    audio_dir.mkdir()
+    (audio_dir / "1.ogg").write_bytes(b"")
+    transcript_path = audio_dir / "1.txt"
+    transcript_path.write_text("old text")
+
+    index = TranscriptIndex(use_cache=True)
+    assert index.get(audio_dir / "1.ogg") == "old text"
+    index.save_cache()
+
+    directory_stat = os.stat(audio_dir)
+    transcript_path.write_text("new longer text")
+    # Keep the directory mtime, as an in-place edit on a coarse clock would
+    os.utime(audio_dir, ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns))
+
+    assert TranscriptIndex(use_cache=True).get(audio_dir / "1.ogg") == "new longer text"
+
+
+def test_voice_message_transcription_reads_manifest_once_per_change(tmp_path, monkeypatch):
+    import lib.transcripts
+
+    (tmp_path / "1.ogg").write_bytes(b"")
+    (tmp_path / "2.ogg").write_bytes(b"")
+    manifest_path = tmp_path / "transcripts.jsonl"
+    manifest_path.write_text(json.dumps({"file": "1.ogg", "transcript": "first"}) + "\n")
+
+    read_count = 0
+    read_manifest_transcripts = lib.transcripts.read_manifest_transcripts
+
+    def count_reads(directory):
+        nonlocal read_count
+        read_count += 1
+        return read_manifest_transcripts(directory)
+
+    monkeypatch.setattr(lib.transcripts, "read_manifest_transcripts", count_reads)
+
+    assert get_voice_message_transcription(tmp_path / "1.ogg") == "first"
+    assert get_voice_message_transcription(tmp_path / "2.ogg") is None
+    assert read_count == 1
+
+    with open(manifest_path, "a") as fp:
+        fp.write(json.dumps({"file": "2.ogg", "transcript": "second"}) + "\n")
+
+    assert get_voice_message_transcription(tmp_path / "2.ogg") == "second"
+    assert read_count == 2
+
+
+def test_transcript_edited_by_hand_wins_over_manifest(tmp_path):
+    (tmp_path / "1.ogg").write_bytes(b"")
+    transcript_path = tmp_path / "1.txt"
+    transcript_path.write_text("model text\n")
+    transcript_mtime_ns = os.stat(transcript_path).st_mtime_ns
+    record = {"file": "1.ogg", "transcript": "model text", "transcript_mtime_ns": transcript_mtime_ns}
+    (tmp_path / "transcripts.jsonl").write_text(json.dumps(record) + "\n")
+
+    assert get_voice_message_transcription(tmp_path / "1.ogg") == "model text"
+    assert TranscriptIndex().get(tmp_path / "1.ogg") == "model text"
+
+    transcript_path.write_text("corrected text\n")
+    os.utime(transcript_path, ns=(transcript_mtime_ns, transcript_mtime_ns + 1_000_000_000))
+
+    assert get_voice_message_transcription(tmp_path / "1.ogg") == "corrected text"
+    assert TranscriptIndex().get(tmp_path / "1.ogg") == "corrected text"